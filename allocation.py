@@ -0,0 +1,108 @@
+import math
+import bisect
+
+import numpy as np
+
+
+class Choice(object):
+    """
+    `rng.choice(values, p=p)` from the same uniform draw of `rng`, without the
+    validation of `p` that numpy does on every call.
+    """
+
+    def __init__(self, values, p):
+        cdf = np.cumsum(p, dtype=np.float64)
+        cdf /= cdf[-1]
+        self.values = list(values)
+        self.cdf = cdf.tolist()
+
+    def __call__(self, rng):
+        return self.values[bisect.bisect_right(self.cdf, rng.random_sample())]
+
+
+def pick(values, u):
+    """ element of `values` for the uniform draw `u`, like `rng.choice(values)` """
+    return values[min(int(u * len(values)), len(values) - 1)]
+
+
+class HouseholdAllocator(object):
+    """
+    Houses with vacancies, in their creation order, for the household assignment of
+    `City.initialize_humans`. `find(age)` is the first of them where a new resident
+    of `age` keeps the average age of the house above `min_avg_age`.
+
+    A house accepts `age` if `age + sum of ages > min_avg_age * (residents + 1)`, i.e.
+    if its slack `sum of ages - min_avg_age * residents` is above `min_avg_age - age`.
+    The maximum slack is kept in a segment tree over the creation order, so that
+    `find` and `assign` are O(log(houses)) instead of a scan of the houses.
+    """
+
+    def __init__(self, min_avg_age, capacity=1024):
+        self.min_avg_age = min_avg_age
+        self.houses = []
+        self.vacancies = []
+        self.age_sums = []
+        self.n_residents = []
+        self.n_open = 0 # houses with vacancies
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.tree = [-math.inf] * (2 * self.size)
+
+    def __len__(self):
+        return self.n_open
+
+    def add(self, house, vacancies, ages=()):
+        """ adds `house` with `vacancies` and residents of `ages` """
+        if len(self.houses) == self.size:
+            self._grow()
+        self.houses.append(house)
+        self.vacancies.append(vacancies)
+        self.age_sums.append(sum(ages))
+        self.n_residents.append(len(ages))
+        self.n_open += vacancies > 0
+        self._update(len(self.houses) - 1)
+
+    def find(self, age):
+        """ index of the first house that accepts a resident of `age`, None if there are none """
+        tree, threshold = self.tree, self.min_avg_age - age
+        if tree[1] <= threshold:
+            return None
+        i = 1
+        while i < self.size:
+            i *= 2
+            if tree[i] <= threshold:
+                i += 1
+        return i - self.size
+
+    def assign(self, i, age):
+        """ adds a resident of `age` to the house `i` """
+        self.age_sums[i] += age
+        self.n_residents[i] += 1
+        self.vacancies[i] -= 1
+        self.n_open -= self.vacancies[i] == 0
+        self._update(i)
+
+    def _update(self, i):
+        if self.vacancies[i] > 0:
+            value = self.age_sums[i] - self.min_avg_age * self.n_residents[i]
+        else:
+            value = -math.inf
+        tree = self.tree
+        i += self.size
+        tree[i] = value
+        i //= 2
+        while i:
+            left, right = tree[2 * i], tree[2 * i + 1]
+            value = left if left > right else right
+            if tree[i] == value:
+                break
+            tree[i] = value
+            i //= 2
+
+    def _grow(self):
+        leaves = self.tree[self.size:]
+        self.size *= 2
+        self.tree = [-math.inf] * self.size + leaves + [-math.inf] * (self.size - len(leaves))
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
@@ -9,52 +9,98 @@ from orderedset import OrderedSet
 import copy
 import zipfile
 from config import *
-from utils import compute_distance, _get_random_area, _draw_random_discreet_gaussian, get_intervention
+from utils import _get_random_area, _draw_random_discreet_gaussian, get_intervention
 from track import Tracker
 from models.run import integrated_risk_pred
 from interventions import *
+from population import Population
+from eventlog import EventSink
+from spatial import SpatialIndex
+from allocation import HouseholdAllocator, Choice, pick
+from synthesis import draw_attributes
+from sampling import alias_table
 
 class Env(simpy.Environment):
+    """
+    simpy environment with a calendar. `now` counts ticks of TICK_MINUTE minutes.
+    The integer fields (`minute`, `hour`, `day_index`, `weekday`) are derived from
+    `now` without building a datetime; `timestamp` is built lazily once per tick.
+    """
+
+    WEEKEND_DAYS = (0, 6)
 
     def __init__(self, initial_timestamp):
         super().__init__()
         self.initial_timestamp = initial_timestamp
+        self._initial_minute_of_day = initial_timestamp.hour * 60 + initial_timestamp.minute
+        self._initial_weekday = initial_timestamp.weekday()
+        self._timestamp_now, self._timestamp = 0, initial_timestamp
 
     def time(self):
         return self.now
 
     @property
     def timestamp(self):
-        return self.initial_timestamp + datetime.timedelta(
-            minutes=self.now * TICK_MINUTE)
+        if self._timestamp_now != self.now:
+            self._timestamp_now = self.now
+            self._timestamp = self.initial_timestamp + datetime.timedelta(
+                minutes=self.now * TICK_MINUTE)
+        return self._timestamp
+
+    @property
+    def minute(self):
+        """ minutes since `initial_timestamp` """
+        return int(self.now * TICK_MINUTE)
+
+    @property
+    def hour(self):
+        return (self._initial_minute_of_day + self.minute) // 60 % 24
+
+    @property
+    def day_index(self):
+        """ number of days since the date of `initial_timestamp` (changes at midnight) """
+        return (self._initial_minute_of_day + self.minute) // 1440
+
+    @property
+    def weekday(self):
+        return (self._initial_weekday + self.day_index) % 7
 
     def minutes(self):
-        return self.timestamp.minute
+        return (self._initial_minute_of_day + self.minute) % 60
 
     def hour_of_day(self):
-        return self.timestamp.hour
+        return self.hour
 
     def day_of_week(self):
-        return self.timestamp.weekday()
+        return self.weekday
 
     def is_weekend(self):
-        return self.day_of_week() in [0, 6]
+        return self.weekday in self.WEEKEND_DAYS
 
     def time_of_day(self):
         return self.timestamp.isoformat()
 
 class City(simpy.Environment):
 
-    def __init__(self, env, n_people, rng, x_range, y_range, start_time, init_percent_sick, Human):
+    def __init__(self, env, n_people, rng, x_range, y_range, start_time, init_percent_sick, Human, event_sink=None,
+                 streams=None):
+        """
+        `rng` draws the synthesis of the city. With `streams` (a `RandomStreams`), every human
+        and location draws from its own stream, otherwise they all draw from `rng`.
+        """
         self.env = env
+        if event_sink is None and EVENT_SINK:
+            event_sink = EventSink(capacity=EVENT_SINK_CAPACITY)
+        self.event_sink = event_sink
         self.rng = rng
+        self.streams = streams
         self.x_range = x_range
         self.y_range = y_range
         self.total_area = (x_range[1] - x_range[0]) * (y_range[1] - y_range[0])
         self.n_people = n_people
         self.start_time = start_time
         self.init_percent_sick = init_percent_sick
-        self.last_date_to_check_tests = self.env.timestamp.date()
+        self.last_day_to_check_tests = self.env.day_index
         self.test_count_today = defaultdict(int)
         self.test_type_preference = list(zip(*sorted(TEST_TYPES.items(), key=lambda x:x[1]['preference'])))[0]
         print("Initializing locations ...")
@@ -62,6 +108,7 @@ class City(simpy.Environment):
 
         self.humans = []
         self.households = OrderedSet()
+        self.population = Population(self.env.initial_timestamp, Human.columns(), capacity=n_people)
         print("Initializing humans ...")
         self.initialize_humans(Human)
 
@@ -73,6 +120,7 @@ class City(simpy.Environment):
         # self.tracker.track_initialized_covid_params(self.humans)
 
         self.intervention = None
+        self.current_day = 0
 
     def create_location(self, specs, type, name, area=None):
         _cls = Location
@@ -83,7 +131,7 @@ class City(simpy.Environment):
 
         return   _cls(
                         env=self.env,
-                        rng=self.rng,
+                        rng=self.rng if self.streams is None else self.streams("location", f"{type}:{name}"),
                         name=f"{type}:{name}",
                         location_type=type,
                         lat=self.rng.randint(*self.x_range),
@@ -95,8 +143,8 @@ class City(simpy.Environment):
                         )
     @property
     def tests_available(self):
-        if self.last_date_to_check_tests != self.env.timestamp.date():
-            self.last_date_to_check_tests = self.env.timestamp.date()
+        if self.last_day_to_check_tests != self.env.day_index:
+            self.last_day_to_check_tests = self.env.day_index
             for k in self.test_count_today.keys():
                 self.test_count_today[k] = 0
         return any(self.test_count_today[test_type] < TEST_TYPES[test_type]['capacity'] for test_type in self.test_type_preference)
@@ -117,6 +165,9 @@ class City(simpy.Environment):
             locs = [self.create_location(specs, location, i, area[i]) for i in range(n)]
             setattr(self, f"{location}s", locs)
 
+        self.spatial_index = SpatialIndex({'store': self.stores, 'park': self.parks,
+                                           'misc': self.miscs, 'hospital': self.hospitals})
+
     def initialize_humans(self, Human):
         # allocate humans to houses such that (unsolved)
         # 1. average number of residents in a house is (approx.) 2.6
@@ -129,6 +180,9 @@ class City(simpy.Environment):
         count_humans = 0
         house_allocations = {2:[], 3:[], 4:[], 5:[]}
         n_houses = 0
+        others_workplace_cdf = np.cumsum(OTHERS_WORKPLACE_CHOICE)
+        others_workplace_cdf /= others_workplace_cdf[-1]
+        healthcare_workplaces = self.hospitals + self.senior_residencys
         for age_bin, specs in HUMAN_DISTRIBUTION.items():
             n = math.ceil(specs['p'] * self.n_people)
             ages = self.rng.randint(*age_bin, size=n)
@@ -139,30 +193,36 @@ class City(simpy.Environment):
             p = [specs['profession_profile'][x] for x in professions]
             profession = self.rng.choice(professions, p=p, size=n)
 
+            # static attributes, residences and workplaces of the whole bin at once
+            infected = self.rng.random_sample(n) < self.init_percent_sick
+            attributes = draw_attributes(self.rng, ages, profession, infected)
+            senior = self.rng.random_sample(n) < senior_residency_preference
+            # uniform draws picking the residence, the type of workplace and the workplace
+            u = self.rng.random_sample((n, 3))
+            type_of_workplace = np.searchsorted(others_workplace_cdf, u[:, 1], side='right')
+
             for i in range(n):
                 count_humans += 1
                 age = ages[i]
 
                 # residence
                 res = None
-                if self.rng.random() < senior_residency_preference:
-                    res = self.rng.choice(self.senior_residencys)
+                if senior[i]:
+                    res = pick(self.senior_residencys, u[i, 0])
                 # workplace
                 if profession[i] == "healthcare":
-                    workplace = self.rng.choice(self.hospitals + self.senior_residencys)
+                    workplace = pick(healthcare_workplaces, u[i, 2])
                 elif profession[i] == 'school':
-                    workplace = self.rng.choice(self.schools)
+                    workplace = pick(self.schools, u[i, 2])
                 elif profession[i] == 'others':
-                    type_of_workplace = self.rng.choice([0,1,2], p=OTHERS_WORKPLACE_CHOICE, size=1).item()
-                    type_of_workplace = [self.workplaces, self.stores, self.miscs][type_of_workplace]
-                    workplace = self.rng.choice(type_of_workplace)
+                    workplace = pick([self.workplaces, self.stores, self.miscs][type_of_workplace[i]], u[i, 2])
                 else:
                     workplace = res
 
                 self.humans.append(Human(
                         env=self.env,
                         city=self,
-                        rng=self.rng,
+                        rng=self.rng if self.streams is None else self.streams("human", count_humans),
                         name=count_humans,
                         age=age,
                         household=res,
@@ -170,32 +230,31 @@ class City(simpy.Environment):
                         profession=profession[i],
                         rho=RHO,
                         gamma=GAMMA,
-                        infection_timestamp=self.start_time if self.rng.random() < self.init_percent_sick else None
+                        infection_timestamp=self.start_time if infected[i] else None,
+                        attributes={name: values[i] for name, values in attributes.items()}
                         )
                     )
 
         # assign houses
-        # stores tuples - (location, current number of residents, maximum number of residents allowed)
-        remaining_houses = []
+        remaining_houses = HouseholdAllocator(MIN_AVG_HOUSE_AGE, capacity=len(self.humans))
+        house_size = Choice(range(1,6), HOUSE_SIZE_PREFERENCE)
+        house_size_by_bin = {bin: Choice(range(1,6), specs['residence_preference']['house_size'])
+                             for bin, specs in HUMAN_DISTRIBUTION.items()}
         for human in self.humans:
             if human.household is not None:
                 continue
             if len(remaining_houses) == 0:
-                cap = self.rng.choice(range(1,6), p=HOUSE_SIZE_PREFERENCE, size=1)
+                cap = house_size(self.rng)
                 x = self.create_location(LOCATION_DISTRIBUTION['household'], 'household', len(self.households))
 
-                remaining_houses.append((x, cap))
+                remaining_houses.add(x, cap)
 
             # get_best_match
             res = None
-            for  c, (house, n_vacancy) in enumerate(remaining_houses):
-                new_avg_age = (human.age + sum(x.age for x in house.residents))/(len(house.residents) + 1)
-                if new_avg_age > MIN_AVG_HOUSE_AGE:
-                    res = house
-                    n_vacancy -= 1
-                    if n_vacancy == 0:
-                        remaining_houses = remaining_houses[:c] + remaining_houses[c+1:]
-                    break
+            c = remaining_houses.find(human.age)
+            if c is not None:
+                res = remaining_houses.houses[c]
+                remaining_houses.assign(c, human.age)
 
             if res is None:
                 for i, (l,u) in enumerate(HUMAN_DISTRIBUTION.keys()):
@@ -203,11 +262,10 @@ class City(simpy.Environment):
                         bin = (l,u)
                         break
 
-                house_size_preference = HUMAN_DISTRIBUTION[(l,u)]['residence_preference']['house_size']
-                cap = self.rng.choice(range(1,6), p=house_size_preference, size=1)
+                cap = house_size_by_bin[(l,u)](self.rng)
                 res = self.create_location(LOCATION_DISTRIBUTION['household'], 'household', len(self.households))
                 if cap - 1 > 0:
-                    remaining_houses.append((res, cap-1))
+                    remaining_houses.add(res, cap-1, [human.age])
 
             # FIXME: there is some circular reference here
             res.residents.append(human)
@@ -228,23 +286,29 @@ class City(simpy.Environment):
 
     @property
     def events(self):
+        if self.event_sink is not None:
+            return list(self.event_sink.buffer)
         return list(itertools.chain(*[h.events for h in self.humans]))
 
     def events_slice(self, begin, end):
         return list(itertools.chain(*[h.events_slice(begin, end) for h in self.humans]))
 
+    def n_events_before(self, end):
+        return sum(h.n_events_before(end) for h in self.humans)
+
     def pull_events_slice(self, end):
         return list(itertools.chain(*[h.pull_events_slice(end) for h in self.humans]))
 
     def _compute_preferences(self):
         """ compute preferred distribution of each human for park, stores, etc."""
-        for h in self.humans:
-            h.stores_preferences = [(compute_distance(h.household, s) + 1e-1) ** -1 for s in self.stores]
-            h.parks_preferences = [(compute_distance(h.household, s) + 1e-1) ** -1 for s in self.parks]
+        households = [h.household for h in self.humans]
+        stores_preferences = self.spatial_index.preferences('store', households)
+        parks_preferences = self.spatial_index.preferences('park', households)
+        for i, h in enumerate(self.humans):
+            h.stores_preferences = stores_preferences[i]
+            h.parks_preferences = parks_preferences[i]
 
     def run(self, duration, outfile, start_time, all_possible_symptoms, port, n_jobs):
-        self.current_day = 0
-
         print(f"INTERVENTION_DAY: {INTERVENTION_DAY}")
         while True:
 
@@ -282,6 +346,12 @@ class Location(simpy.Resource):
 
         super().__init__(env, capacity)
         self.humans = OrderedSet() #OrderedSet instead of set for determinism when iterating
+        # the occupants again, as a list to draw from by index (see `Human._sampled_encounters`)
+        self.occupants = []
+        self._occupant_idx = {}
+        # occupants that are or can become infectious during their visit (see `Human.is_carrier`);
+        # kept on arrivals, departures and transmissions, it may hold occupants that recovered
+        self.carriers = set()
         self.name = name
         self.rng = rng
         self.lat = lat
@@ -290,35 +360,52 @@ class Location(simpy.Resource):
         self.location_type = location_type
         self.social_contact_factor = social_contact_factor
         self.env = env
-        self.contamination_timestamp = datetime.datetime.min
+        self.contamination_minute = -np.inf # env.minute of the last visit of an infectious human
         self.contaminated_surface_probability = surface_prob
         self.max_day_contamination = 0
+        self._surface_contamination_days = alias_table(
+            tuple(MAX_DAYS_CONTAMINATION),
+            tuple(surface_prob) if surface_prob is not None else (1,) * len(MAX_DAYS_CONTAMINATION))
 
     def infectious_human(self):
-        return any([h.is_infectious for h in self.humans])
+        return any(h.is_infectious for h in self.carriers)
 
     def __repr__(self):
         return f"{self.name} - occ:{len(self.humans)}/{self.capacity} - I:{self.is_contaminated}"
 
     def add_human(self, human):
-        self.humans.add(human)
-        if human.is_infectious:
-            self.contamination_timestamp = self.env.timestamp
-            rnd_surface = float(self.rng.choice(a=MAX_DAYS_CONTAMINATION, size=1, p=self.contaminated_surface_probability))
+        self.place_human(human)
+        if human in self.carriers and human.is_infectious:
+            self.contamination_minute = self.env.minute
+            rnd_surface = float(self._surface_contamination_days.draw(self.rng))
             self.max_day_contamination = max(self.max_day_contamination, rnd_surface)
 
+    def place_human(self, human):
+        """ adds `human` to the occupants, without the contamination of an arrival """
+        self.humans.add(human)
+        if human not in self._occupant_idx:
+            self._occupant_idx[human] = len(self.occupants)
+            self.occupants.append(human)
+        if human.is_carrier:
+            self.carriers.add(human)
+
     def remove_human(self, human):
         self.humans.remove(human)
+        self.carriers.discard(human)
+        # the last occupant takes the place of `human`
+        i, last = self._occupant_idx.pop(human), self.occupants.pop()
+        if last is not human:
+            self.occupants[i] = last
+            self._occupant_idx[last] = i
 
     @property
     def is_contaminated(self):
-        return self.env.timestamp - self.contamination_timestamp <= datetime.timedelta(days=self.max_day_contamination)
+        return self.env.minute - self.contamination_minute <= self.max_day_contamination * 1440
 
     @property
     def contamination_probability(self):
         if self.is_contaminated:
-            lag = (self.env.timestamp - self.contamination_timestamp)
-            lag /= datetime.timedelta(days=1)
+            lag = (self.env.minute - self.contamination_minute) / 1440
             p_infection = 1 - lag / self.max_day_contamination # linear decay; &envrionmental_contamination
             return self.social_contact_factor * p_infection
         return 0.0
@@ -335,12 +422,14 @@ class Location(simpy.Resource):
             del s['rng']
         if s.get('_env'):
             del s['_env']
-        if s.get('contamination_timestamp'):
-            del s['contamination_timestamp']
+        if s.get('contamination_minute'):
+            del s['contamination_minute']
         if s.get('residents'):
             del s['residents']
         if s.get('humans'):
             del s['humans']
+        if s.get('carriers'):
+            del s['carriers']
         return s
 
 class Household(Location):
@@ -420,12 +509,19 @@ class Event:
     visit = 'visit'
     daily = 'daily'
 
+    @staticmethod
+    def push(human, event):
+        if human.city.event_sink is not None:
+            human.city.event_sink.push(event)
+        else:
+            human.log_event(event)
+
     @staticmethod
     def members():
         return [Event.test, Event.encounter, Event.contamination, Event.static_info, Event.visit, Event.daily]
 
     @staticmethod
-    def log_encounter(human1, human2, location, duration, distance, infectee, time):
+    def log_encounter(human1, human2, location, duration, distance, infectee, time, weight=1):
 
         h_obs_keys   = ['obs_hospitalized', 'obs_in_icu',
                         'obs_lat', 'obs_lon']
@@ -457,17 +553,19 @@ class Event:
         loc_unobs = {key:getattr(location, key) for key in loc_unobs_keys}
         loc_unobs['location_p_infection'] = location.contamination_probability / location.social_contact_factor
         other_obs = {'duration':duration, 'distance':distance}
+        # number of encounters this one stands for (sampled contacts, see `Human._sampled_encounters`)
+        other_unobs = {'weight':weight}
         both_have_app = human1.has_app and human2.has_app
         for i, human in [(0, human1), (1, human2)]:
             if both_have_app:
                 obs_payload = {**loc_obs, **other_obs, 'human1':obs[i], 'human2':obs[1-i]}
-                unobs_payload = {**loc_unobs, 'human1':unobs[i], 'human2':unobs[1-i]}
+                unobs_payload = {**loc_unobs, **other_unobs, 'human1':unobs[i], 'human2':unobs[1-i]}
             else:
                 obs_payload = {}
-                unobs_payload = { **loc_obs, **loc_unobs, **other_obs, 'human1':{**obs[i], **unobs[i]},
+                unobs_payload = { **loc_obs, **loc_unobs, **other_obs, **other_unobs, 'human1':{**obs[i], **unobs[i]},
                                     'human2': {**obs[1-i], **unobs[1-i]} }
 
-            human.events.append({
+            Event.push(human, {
                 'human_id':human.name,
                 'event_type':Event.encounter,
                 'time':time,
@@ -476,7 +574,7 @@ class Event:
 
     @staticmethod
     def log_test(human, time):
-        human.events.append(
+        Event.push(human,
             {
                 'human_id': human.name,
                 'event_type': Event.test,
@@ -498,7 +596,7 @@ class Event:
 
     @staticmethod
     def log_daily(human, time):
-        human.events.append(
+        Event.push(human,
             {
                 'human_id': human.name,
                 'event_type': Event.daily,
@@ -522,7 +620,7 @@ class Event:
 
     @staticmethod
     def log_exposed(human, source, time):
-        human.events.append(
+        Event.push(human,
             {
                 'human_id': human.name,
                 'event_type': Event.contamination,
@@ -544,7 +642,7 @@ class Event:
 
     @staticmethod
     def log_recovery(human, time, death):
-        human.events.append(
+        Event.push(human,
             {
                 'human_id': human.name,
                 'event_type': Event.recovered,
@@ -577,7 +675,7 @@ class Event:
 
         obs_payload['household_size'] = len(human.household.residents)
 
-        human.events.append(
+        Event.push(human,
             {
                 'human_id': human.name,
                 'event_type':Event.static_info,
@@ -660,7 +758,7 @@ class Contacts(object):
         if False:
             remove_idx = 0
             for historical_message in self.messages:
-                if (human.env.timestamp - human.env.initial_timestamp).days - historical_message.day > TRACING_N_DAYS_HISTORY:
+                if human.env.day_index - historical_message.day > TRACING_N_DAYS_HISTORY:
                     remove_idx += 1
                 else:
                     break
@@ -669,7 +767,7 @@ class Contacts(object):
         p_contact = tracing_method.p_contact
         delay = tracing_method.delay
         app = tracing_method.app
-        today = (owner.env.timestamp - owner.env.initial_timestamp).days
+        today = owner.env.day_index
         if app and not owner.has_app:
             return
 
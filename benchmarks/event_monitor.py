@@ -0,0 +1,116 @@
+"""
+Cost of one `EventMonitor.run` tick on the per-human event lists (EVENT_SINK = False),
+with the bisect slicing of `Human` and with the linear scans it replaced.
+The humans are bare `Human` objects that only hold their events.
+
+    python benchmarks/event_monitor.py --n_people 10000 --events_per_day 100
+"""
+import os
+import sys
+import time
+import datetime
+import itertools
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import config
+config.EVENT_SINK = False
+
+from base import City
+from simulator import Human
+from monitors import EventMonitor
+
+
+def linear_events_slice(self, begin, end):
+    end_i = len(self._events)
+    begin_i = end_i
+    for i, event in enumerate(self._events):
+        if i < begin_i and event['time'] >= begin:
+            begin_i = i
+        elif event['time'] > end:
+            end_i = i
+            break
+
+    return self._events[begin_i:end_i]
+
+
+def linear_pull_events_slice(self, end):
+    end_i = len(self._events)
+    for i, event in enumerate(self._events):
+        if event['time'] >= end:
+            end_i = i
+            break
+
+    events_slice, self._events = self._events[:end_i], self._events[end_i:]
+    return events_slice
+
+
+def linear_run(monitor, env, city):
+    """ `EventMonitor.run` before the bisect slicing """
+    while True:
+        monitor.data = list(itertools.chain(*[h.events for h in city.humans]))
+        older = list(itertools.chain(*[linear_events_slice(h, datetime.datetime.min, env.timestamp - datetime.timedelta(days=2))
+                                       for h in city.humans]))
+        if monitor.chunk_size and len(older) > monitor.chunk_size:
+            monitor.data = list(itertools.chain(*[linear_pull_events_slice(h, env.timestamp - datetime.timedelta(days=2))
+                                                  for h in city.humans]))
+            monitor.dump()
+
+        yield env.timeout(monitor.f / config.TICK_MINUTE)
+
+
+class FakeEnv(object):
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+    def timeout(self, delay):
+        return delay
+
+
+def make_city(n_people, events_per_day, days, start_time):
+    city = City.__new__(City)
+    city.event_sink = None
+    city.humans = []
+    step = datetime.timedelta(days=1) / events_per_day
+    for i in range(n_people):
+        human = Human.__new__(Human)
+        human._events, human._event_times = [], []
+        for k in range(events_per_day * days):
+            human.log_event({'human_id': f"human:{i}", 'event_type': 'encounter', 'time': start_time + k * step})
+        city.humans.append(human)
+    return city
+
+
+def time_ticks(run, city, start_time, days, chunk_size):
+    """ seconds per tick of `run`, every 30 minutes of the last simulated day """
+    # nothing is written: the chunk size is never reached
+    monitor = EventMonitor(f=1800, dest="benchmark", chunk_size=chunk_size)
+    env = FakeEnv(start_time + datetime.timedelta(days=days - 1))
+    ticks = run(monitor, env, city)
+    n_ticks = 48
+    begin = time.perf_counter()
+    for _ in range(n_ticks):
+        next(ticks)
+        env.timestamp += datetime.timedelta(minutes=30)
+    return (time.perf_counter() - begin) / n_ticks
+
+
+@click.command()
+@click.option('--n_people', default=10000)
+@click.option('--events_per_day', default=100)
+@click.option('--days', default=3)
+def main(n_people, events_per_day, days):
+    start_time = datetime.datetime(2020, 2, 28, 0, 0)
+    chunk_size = n_people * events_per_day * days
+
+    results = {}
+    for name, run in [("bisect", EventMonitor.run), ("linear", linear_run)]:
+        city = make_city(n_people, events_per_day, days, start_time)
+        results[name] = time_ticks(run, city, start_time, days, chunk_size)
+        print(f"{name:>6}: {1000 * results[name]:8.2f} ms per tick ({n_people} humans, {events_per_day * days} events each)")
+    print(f"speedup: {results['linear'] / results['bisect']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Household assignment of `City.initialize_humans` with `HouseholdAllocator` and with
+the scan of the remaining houses it replaced. The houses are bare objects and the
+ages are drawn from HUMAN_DISTRIBUTION, the rest of the city is not built.
+
+    python benchmarks/household_allocation.py --n_people 1000000
+"""
+import os
+import sys
+import math
+import time
+
+import click
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import HUMAN_DISTRIBUTION, HOUSE_SIZE_PREFERENCE, MIN_AVG_HOUSE_AGE
+from allocation import HouseholdAllocator, Choice
+
+
+class House(object):
+    def __init__(self):
+        self.residents = []
+
+
+class Resident(object):
+    def __init__(self, age):
+        self.age = age
+
+
+def house_size_preferences():
+    """ HUMAN_DISTRIBUTION house size preference of every age """
+    preferences = {}
+    for (l, u), specs in HUMAN_DISTRIBUTION.items():
+        for age in range(l, u):
+            preferences.setdefault(age, specs['residence_preference']['house_size'])
+    return preferences
+
+
+def scan(ages, rng, preferences):
+    """ `City.initialize_humans` before `HouseholdAllocator` """
+    houses = []
+    remaining_houses = []
+    for age in ages:
+        human = Resident(age)
+        if len(remaining_houses) == 0:
+            cap = rng.choice(range(1, 6), p=HOUSE_SIZE_PREFERENCE, size=1)
+            remaining_houses.append((House(), cap))
+
+        res = None
+        for c, (house, n_vacancy) in enumerate(remaining_houses):
+            new_avg_age = (human.age + sum(x.age for x in house.residents))/(len(house.residents) + 1)
+            if new_avg_age > MIN_AVG_HOUSE_AGE:
+                res = house
+                n_vacancy -= 1
+                if n_vacancy == 0:
+                    remaining_houses = remaining_houses[:c] + remaining_houses[c+1:]
+                break
+
+        if res is None:
+            cap = rng.choice(range(1, 6), p=preferences[age], size=1)
+            res = House()
+            if cap - 1 > 0:
+                remaining_houses.append((res, cap - 1))
+
+        res.residents.append(human)
+        houses.append(res)
+    return houses
+
+
+def allocator(ages, rng, preferences):
+    houses = []
+    remaining_houses = HouseholdAllocator(MIN_AVG_HOUSE_AGE, capacity=len(ages))
+    house_size = Choice(range(1, 6), HOUSE_SIZE_PREFERENCE)
+    house_size_by_age = {age: Choice(range(1, 6), p) for age, p in preferences.items()}
+    for age in ages:
+        human = Resident(age)
+        if len(remaining_houses) == 0:
+            cap = house_size(rng)
+            remaining_houses.add(House(), cap)
+
+        res = None
+        c = remaining_houses.find(human.age)
+        if c is not None:
+            res = remaining_houses.houses[c]
+            remaining_houses.assign(c, human.age)
+
+        if res is None:
+            cap = house_size_by_age[age](rng)
+            res = House()
+            if cap - 1 > 0:
+                remaining_houses.add(res, cap - 1, [human.age])
+
+        res.residents.append(human)
+        houses.append(res)
+    return houses
+
+
+@click.command()
+@click.option('--n_people', default=1000000)
+@click.option('--max_scan', help='largest population allocated with the scan', default=50000)
+def main(n_people, max_scan):
+    # one age bin after the other, like the humans of the city
+    rng = np.random.RandomState(0)
+    ages = []
+    for age_bin, specs in HUMAN_DISTRIBUTION.items():
+        ages.extend(rng.randint(*age_bin, size=math.ceil(specs['p'] * n_people)).tolist())
+    preferences = house_size_preferences()
+
+    results = {}
+    for name, allocate in [("allocator", allocator), ("scan", scan)]:
+        if name == "scan" and n_people > max_scan:
+            print(f"{name:>9}: skipped (n_people > {max_scan})")
+            continue
+        begin = time.perf_counter()
+        houses = allocate(ages, np.random.RandomState(1), preferences)
+        results[name] = [id(h) for h in houses]
+        print(f"{name:>9}: {time.perf_counter() - begin:8.2f} s for {n_people} people in {len(set(results[name]))} houses")
+
+    if len(results) == 2:
+        index = {}
+        same = [index.setdefault(a, b) == b for a, b in zip(results["allocator"], results["scan"])]
+        print(f"same households: {all(same)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Checkpoints of a simulation at a day boundary, to branch several variants
+(interventions, tracing methods, ...) from one simulated prefix.
+
+simpy processes are generators and cannot be saved, so checkpoints are taken from
+the stepped engine, whose state is resumable at any hour boundary: a checkpoint
+holds the `Env` (its clock, without the event queue), the `City` with its humans,
+`Population`, `Tracker` and rng, and the `SteppedEngine` with its pending departures.
+`run_simu(checkpoint=...)` starts new processes for the city, the engine and the
+monitors, from the day of the checkpoint.
+
+The events of the `EventSink` of the city are not part of the checkpoint.
+
+A checkpoint file is a header with the version of Python, then the checkpoint
+pickled by `Pickler`. The lambdas are pickled as bytecode, which only the same
+version of Python reads: `load` raises a ValueError for another version.
+"""
+import os
+import sys
+import types
+import pickle
+import marshal
+import copyreg
+import traceback
+
+import config
+from config import TICK_MINUTE
+from base import Env
+from simulator import Human
+
+# settings that are read before the intervention day: a variant cannot change them
+PREFIX_SETTINGS = ["P_HAS_APP"]
+
+
+class Checkpoint(object):
+
+    def __init__(self, env, city, engine):
+        if env.now % (24 * 60 / TICK_MINUTE):
+            raise ValueError(f"checkpoints are taken at a day boundary, not at {env.timestamp}")
+        self.env = env
+        self.city = city
+        self.engine = engine
+        self.day = city.current_day
+        self.settings = {name: getattr(config, name) for name in PREFIX_SETTINGS}
+
+    def check(self, settings):
+        """ raises a ValueError if the variant of `settings` does not share the prefix of the checkpoint """
+        for name in PREFIX_SETTINGS:
+            if name in settings and settings[name] != self.settings[name]:
+                raise ValueError(f"{name}={settings[name]} changes the prefix of the checkpoint ({name}={self.settings[name]})")
+        day = settings.get("INTERVENTION_DAY", self.day)
+        if day < self.day:
+            raise ValueError(f"INTERVENTION_DAY={day} is before the day of the checkpoint ({self.day})")
+
+
+def _restore_env(initial_timestamp, now):
+    env = Env(initial_timestamp)
+    env._now = now
+    return env
+
+
+def _cell(value):
+    return (lambda: value).__closure__[0]
+
+
+def _restore_function(code, module, name, defaults, closure):
+    return types.FunctionType(marshal.loads(code), sys.modules[module].__dict__, name, defaults,
+                              closure and tuple(_cell(value) for value in closure))
+
+
+def _reduce_env(env):
+    return _restore_env, (env.initial_timestamp, env.now)
+
+
+def _reduce_human(human):
+    # the whole state, not the one of `Human.__getstate__` that is sent to the risk models
+    return copyreg.__newobj__, (type(human),), human.__dict__
+
+
+class Pickler(pickle.Pickler):
+    """
+    pickles `Env` as its clock, `Human` with its whole state and the lambdas (e.g.
+    `defaultdict` factories) with their code, in the same stream as their closure
+    (as persistent ids, read back by `Unpickler`).
+    """
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table.update({Env: _reduce_env, Human: _reduce_human})
+
+    def persistent_id(self, obj):
+        if isinstance(obj, types.FunctionType) and "<" in obj.__qualname__: # not importable by name
+            closure = obj.__closure__ and tuple(cell.cell_contents for cell in obj.__closure__)
+            return "function", marshal.dumps(obj.__code__), obj.__module__, obj.__name__, obj.__defaults__, closure
+        return None
+
+
+class Unpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        if pid[0] == "function":
+            return _restore_function(*pid[1:])
+        raise pickle.UnpicklingError(f"unknown persistent id {pid[0]}")
+
+
+def save(path, checkpoint):
+    city = checkpoint.city
+    sink, city.event_sink = city.event_sink, None
+    try:
+        with open(path, 'wb') as f:
+            pickle.dump(("checkpoint", sys.version), f, pickle.HIGHEST_PROTOCOL)
+            Pickler(f, pickle.HIGHEST_PROTOCOL).dump(checkpoint)
+    finally:
+        city.event_sink = sink
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        header = pickle.load(f)
+        if not (isinstance(header, tuple) and header[0] == "checkpoint"):
+            raise ValueError(f"{path} is not a checkpoint of this version of the simulator")
+        if header[1] != sys.version:
+            raise ValueError(f"{path} was saved by Python {header[1]}, it cannot be loaded by Python {sys.version}")
+        return Unpickler(f).load()
+
+
+def configure(settings):
+    """
+    Sets the `settings` of config, also in the modules of the simulator that
+    imported them with `from config import *`.
+    """
+    root = os.path.dirname(os.path.abspath(config.__file__))
+    for name, value in settings.items():
+        old = getattr(config, name, None)
+        setattr(config, name, value)
+        for module in list(sys.modules.values()):
+            if os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or "/")) != root:
+                continue
+            if name in vars(module) and vars(module)[name] is old:
+                setattr(module, name, value)
+
+
+def branch(path, variants, run, workers=None):
+    """
+    Calls `run(checkpoint, name)` for each `name: settings` of `variants`, after
+    `configure(settings)`, from the checkpoint saved at `path`.
+
+    With `os.fork`, the checkpoint is loaded once and each variant runs in a child
+    process that shares it copy-on-write, `workers` (default: number of cores)
+    at a time. Otherwise, the variants run one after the other and the checkpoint
+    is loaded again for each of them.
+    """
+    checkpoint = load(path)
+    for settings in variants.values():
+        checkpoint.check(settings)
+
+    if not hasattr(os, "fork"):
+        for i, (name, settings) in enumerate(variants.items()):
+            if i:
+                checkpoint = load(path)
+            configure(settings)
+            run(checkpoint, name)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    running, failed = set(), 0
+    for name, settings in variants.items():
+        if len(running) >= workers:
+            pid, status = os.wait()
+            running.discard(pid)
+            failed += status != 0
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                configure(settings)
+                run(checkpoint, name)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        running.add(pid)
+
+    for pid in running:
+        failed += os.waitpid(pid, 0)[1] != 0
+    if failed:
+        raise RuntimeError(f"{failed} of {len(variants)} variants failed")
@@ -243,6 +243,31 @@ TICK_MINUTE = 2  # @param increment
 SIMULATION_DAYS = 30  # @param
 SYMPTOM_DAYS = 5  # @param
 COLLECT_LOGS = False
+# push the events to the EventSink of the city at log time instead of keeping them in per-human lists
+EVENT_SINK = True
+# maximum number of events held in memory by the sink before they are written
+EVENT_SINK_CAPACITY = 100000
+# "vectorized" draws the random numbers of all the pairs of an arrival as numpy arrays
+# "sequential" draws them one pair at a time (same random stream as the original loop)
+ENCOUNTER_ENGINE = "vectorized"
+# contacts between the residents of a household during their stays at home:
+# "aggregated" evaluates them once per stay and pair of residents, with the probability of any hour of the stay
+# "hourly" visits home one hour at a time, each visit evaluating the encounters with every resident
+HOUSEHOLD_CONTACTS = "aggregated"
+# None: an arrival meets every occupant of the location; otherwise, at the locations other than
+# households with more occupants, it meets a Poisson number (mean CONTACT_SAMPLE_SIZE) of occupants
+# drawn at random, each standing for several so that the expected contacts and transmissions stay the same
+CONTACT_SAMPLING_MIN_OCCUPANTS = None
+CONTACT_SAMPLE_SIZE = 20
+# directory of the on-disk cache of synthesized cities (see population_cache.py), None to disable
+POPULATION_CACHE_DIR = None
+# settings that do not change the synthesized city: they are not part of the key of the cache
+POPULATION_CACHE_IGNORED = ["COLLECT_LOGS", "COLLECT_TRAINING_DATA", "USE_INFERENCE_SERVER", "GET_RISK_PREDICTOR_METRICS",
+                            "INTERVENTION_DAY", "INTERVENTION", "RISK_MODEL", "TRACING_ORDER", "TRACE_SYMPTOMS",
+                            "TRACE_RISK_UPDATE", "MANUAL_TRACING_NOISE", "RISK_MAPPING_FILE", "EVENT_SINK",
+                            "EVENT_SINK_CAPACITY", "ENCOUNTER_ENGINE", "HOUSEHOLD_CONTACTS", "CONTACT_SAMPLING_MIN_OCCUPANTS",
+                            "CONTACT_SAMPLE_SIZE", "POPULATION_CACHE_DIR",
+                            "POPULATION_CACHE_IGNORED"]
 
 # LIFESTYLE PARAMETERS
 RHO = 0.40
@@ -0,0 +1,325 @@
+"""
+Columnar event log.
+
+Every dump of `EventMonitor` is written as a chunk of the `{dest}.zip` archive.
+Inside a chunk, the events of each type are stored as a table with one typed
+`.npy` column per leaf of the event dicts (the path of the leaf is the column name,
+e.g. `payload/unobserved/human1/carefulness`). Strings are dictionary encoded
+against the `strings.npy` table of the chunk. `load_events` rebuilds the original
+list of dicts.
+
+    chunk-00000/strings.npy
+    chunk-00000/encounter/schema.json
+    chunk-00000/encounter/_row.npy
+    chunk-00000/encounter/human_id.npy
+    chunk-00000/encounter/payload/observed/duration.npy
+    ...
+
+`EventSink` receives the events at log time and streams them to the archive.
+"""
+import io
+import json
+import queue
+import datetime
+import threading
+import zipfile
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# fixed date so that the same events always give the same archive
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+SEP = "/"
+
+# kinds of columns
+BOOL, INT, FLOAT, STRING, DATETIME, STRING_LIST, EMPTY_DICT, NONE, OBJECT = \
+    "bool", "int", "float", "str", "datetime", "str_list", "empty_dict", "none", "object"
+
+# leaf values standing for an empty dict and for a missing key
+_EMPTY = object()
+_MISSING = object()
+
+
+def _flatten(d, prefix, row, n, columns):
+    """ writes the leaves of `d` at `row` of the columns (lists of length `n`) """
+    for key, value in d.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            _flatten(value, path + SEP, row, n, columns)
+            continue
+
+        column = columns.get(path)
+        if column is None:
+            column = columns[path] = [_MISSING] * n
+        column[row] = _EMPTY if isinstance(value, dict) else value
+
+
+def _kind(values):
+    """ column kind of the non-None `values` """
+    if not values:
+        return NONE
+    types = set(map(type, values))
+    if types <= {bool, np.bool_}:
+        return BOOL
+    if all(issubclass(t, (int, np.integer)) and not issubclass(t, (bool, np.bool_)) for t in types):
+        return INT
+    if all(issubclass(t, (int, float, np.integer, np.floating)) and not issubclass(t, (bool, np.bool_)) for t in types):
+        return FLOAT
+    if types == {str}:
+        return STRING
+    if types == {datetime.datetime}:
+        return DATETIME
+    if types == {list} and all(isinstance(x, str) for v in values for x in v):
+        return STRING_LIST
+    if all(v is _EMPTY for v in values):
+        return EMPTY_DICT
+    return OBJECT
+
+
+class _Strings(object):
+    """ dictionary of the strings of a chunk """
+
+    def __init__(self):
+        self.codes = OrderedDict()
+
+    def encode(self, s):
+        code = self.codes.get(s)
+        if code is None:
+            code = self.codes[s] = len(self.codes)
+        return code
+
+    def table(self):
+        return np.array(list(self.codes), dtype=str)
+
+
+def _encode_column(kind, values, strings):
+    """ typed arrays of the column (missing and None rows hold a placeholder) """
+    if kind == BOOL:
+        return {"": np.array([bool(v) if v is not None else False for v in values], dtype=np.bool_)}
+    if kind == INT:
+        return {"": np.array([v if v is not None else 0 for v in values], dtype=np.int64)}
+    if kind == FLOAT:
+        return {"": np.array([v if v is not None else np.nan for v in values], dtype=np.float64)}
+    if kind == STRING:
+        return {"": np.array([strings.encode(v) if v is not None else -1 for v in values], dtype=np.int32)}
+    if kind == DATETIME:
+        return {"": np.array([v if v is not None else "NaT" for v in values], dtype="datetime64[us]")}
+    if kind == STRING_LIST:
+        lengths = [len(v) if v is not None else 0 for v in values]
+        codes = [strings.encode(x) for v in values if v is not None for x in v]
+        return {"": np.array(codes, dtype=np.int32), ".offsets": np.cumsum([0] + lengths, dtype=np.int64)}
+    if kind == OBJECT:
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return {"": column}
+    return {}
+
+
+def _decode_column(kind, arrays, strings, n):
+    if kind == EMPTY_DICT:
+        return [{} for _ in range(n)]
+    if kind == NONE:
+        return [None] * n
+    values = arrays[""]
+    if kind == STRING:
+        return [strings[c] if c >= 0 else None for c in values.tolist()]
+    if kind == DATETIME:
+        return [None if np.isnat(v) else v.astype(datetime.datetime) for v in values]
+    if kind == STRING_LIST:
+        offsets = arrays[".offsets"]
+        return [[strings[c] for c in values[offsets[i]:offsets[i + 1]].tolist()] for i in range(n)]
+    if kind == OBJECT:
+        return list(values)
+    return values.tolist()
+
+
+def _write_array(zf, name, array):
+    buf = io.BytesIO()
+    np.save(buf, array, allow_pickle=array.dtype == object)
+    _write_bytes(zf, name, buf.getvalue())
+
+
+def _write_bytes(zf, name, data):
+    info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    zf.writestr(info, data)
+
+
+def _read_array(zf, name):
+    return np.load(io.BytesIO(zf.read(name)), allow_pickle=True)
+
+
+def _chunks(zf):
+    return sorted({name.split(SEP, 1)[0] for name in zf.namelist() if name.startswith("chunk-")})
+
+
+def write_chunk(events, dest):
+    """
+    Appends the list of event dicts `events` as a new chunk of the archive `dest`.
+    """
+    if not events:
+        return
+
+    by_type = OrderedDict()
+    for row, event in enumerate(events):
+        by_type.setdefault(event['event_type'], []).append(row)
+
+    strings = _Strings()
+    with zipfile.ZipFile(dest, mode='a', compression=zipfile.ZIP_DEFLATED) as zf:
+        chunk = f"chunk-{len(_chunks(zf)):05d}"
+        for event_type, rows in by_type.items():
+            n = len(rows)
+            columns = OrderedDict()
+            for i, row in enumerate(rows):
+                _flatten(events[row], "", i, n, columns)
+
+            prefix = f"{chunk}{SEP}{event_type}{SEP}"
+            schema = OrderedDict()
+            _write_array(zf, prefix + "_row.npy", np.array(rows, dtype=np.int64))
+            for path, values in columns.items():
+                present = np.array([v is not _MISSING for v in values], dtype=np.bool_)
+                null = np.array([v is None for v in values], dtype=np.bool_)
+                values = [None if v is _MISSING else v for v in values]
+                kind = _kind([v for v in values if v is not None])
+                schema[path] = {"kind": kind, "sparse": not present.all(), "nullable": bool(null.any())}
+
+                for suffix, array in _encode_column(kind, values, strings).items():
+                    _write_array(zf, f"{prefix}{path}{suffix}.npy", array)
+                if schema[path]["sparse"]:
+                    _write_array(zf, f"{prefix}{path}.present.npy", present)
+                if schema[path]["nullable"] and kind not in [NONE, OBJECT]:
+                    _write_array(zf, f"{prefix}{path}.null.npy", null)
+
+            _write_bytes(zf, prefix + "schema.json", json.dumps(schema).encode())
+
+        _write_array(zf, f"{chunk}{SEP}strings.npy", strings.table())
+
+
+def _read_table(zf, prefix, strings):
+    schema = json.loads(zf.read(prefix + "schema.json"), object_pairs_hook=OrderedDict)
+    rows = _read_array(zf, prefix + "_row.npy").tolist()
+    n = len(rows)
+    events = [{} for _ in range(n)]
+    for path, spec in schema.items():
+        kind = spec["kind"]
+        arrays = {}
+        if kind not in [EMPTY_DICT, NONE]:
+            arrays[""] = _read_array(zf, f"{prefix}{path}.npy")
+        if kind == STRING_LIST:
+            arrays[".offsets"] = _read_array(zf, f"{prefix}{path}.offsets.npy")
+        values = _decode_column(kind, arrays, strings, n)
+
+        if spec["nullable"] and kind not in [NONE, OBJECT]:
+            null = _read_array(zf, f"{prefix}{path}.null.npy")
+            values = [None if is_null else v for v, is_null in zip(values, null.tolist())]
+        present = _read_array(zf, f"{prefix}{path}.present.npy").tolist() if spec["sparse"] else [True] * n
+
+        keys = path.split(SEP)
+        for event, value, is_present in zip(events, values, present):
+            if not is_present:
+                continue
+            d = event
+            for key in keys[:-1]:
+                d = d.setdefault(key, {})
+            d[keys[-1]] = value
+    return rows, events
+
+
+def iter_chunks(path):
+    """
+    Yields the list of event dicts of every chunk of the archive `path`, in the order they were written.
+    """
+    with zipfile.ZipFile(path, 'r') as zf:
+        names = zf.namelist()
+        for chunk in _chunks(zf):
+            strings = _read_array(zf, f"{chunk}{SEP}strings.npy").tolist()
+            event_types = OrderedDict()
+            for name in names:
+                if name.startswith(chunk + SEP) and name.endswith(SEP + "schema.json"):
+                    event_types[name[len(chunk) + 1:-len("/schema.json")]] = None
+
+            events = {}
+            for event_type in event_types:
+                rows, table = _read_table(zf, f"{chunk}{SEP}{event_type}{SEP}", strings)
+                events.update(zip(rows, table))
+            yield [events[row] for row in sorted(events)]
+
+
+def load_events(path):
+    """
+    All the events of the archive `path` as a list of dicts (same schema as `base.Event`).
+    """
+    events = []
+    for chunk in iter_chunks(path):
+        events.extend(chunk)
+    return events
+
+
+class EventSink(object):
+    """
+    Events of the whole city, pushed at log time (hence ordered by `time`).
+    `flush` hands them over to a background thread that appends them to the
+    archive `dest`, or drops them without `dest`. The buffer holds less than
+    `capacity` events: once it is full, the events older than `retention` before
+    the last one pushed are flushed, and if they are not enough, the oldest events
+    down to half the capacity.
+    """
+
+    def __init__(self, dest=None, capacity=100000, retention=datetime.timedelta(days=2)):
+        self.dest = dest
+        self.capacity = capacity
+        self.retention = retention
+        self.buffer = deque()
+        self._chunks = queue.Queue(maxsize=2)
+        self._writer = None
+        self._error = None
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def push(self, event):
+        self.buffer.append(event)
+        if len(self.buffer) >= self.capacity:
+            self.flush(event['time'] - self.retention)
+            if len(self.buffer) >= self.capacity:
+                # the events of the retention do not fit
+                self._queue([self.buffer.popleft() for _ in range(len(self.buffer) - self.capacity // 2)])
+
+    def flush(self, watermark=None):
+        """
+        Removes the events older than `watermark` (all of them by default) from the
+        buffer, queues them for writing (without `dest`, drops them) and returns them.
+        """
+        events = []
+        while self.buffer and (watermark is None or self.buffer[0]['time'] < watermark):
+            events.append(self.buffer.popleft())
+        return self._queue(events)
+
+    def _queue(self, events):
+        """ queues `events` for writing (without `dest`, drops them) and returns them """
+        if events and self.dest is not None:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, daemon=True)
+                self._writer.start()
+            # blocks when the writer is behind, which bounds the memory
+            self._chunks.put(events)
+        return events
+
+    def join(self):
+        """ waits until all the flushed events are written, raises the error of the writer if any """
+        self._chunks.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self):
+        while True:
+            events = self._chunks.get()
+            try:
+                write_chunk(events, self.dest)
+            except Exception as error:
+                # the first one, raised by `join`
+                if self._error is None:
+                    self._error = error
+            finally:
+                self._chunks.task_done()
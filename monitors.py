@@ -1,4 +1,4 @@
-from config import TICK_MINUTE
+from config import TICK_MINUTE, EVENT_SINK, EVENT_SINK_CAPACITY
 from base import City
 from simulator import Human
 from matplotlib import pyplot as plt
@@ -7,8 +7,8 @@ import pylab as pl
 import pickle
 from datetime import datetime, timedelta
 import threading
-import zipfile
 from utils import _json_serialize
+from eventlog import write_chunk, EventSink
 import numpy as np
 
 class BaseMonitor(object):
@@ -69,22 +69,39 @@ class EventMonitor(BaseMonitor):
 
     def __init__(self, f=None, dest: str = None, chunk_size: int = None):
         super().__init__(f, dest, chunk_size)
+        self.city = None
         self._iothread = threading.Thread()
         self._iothread.start()
+        # the city pushes its events to `sink` (see `City(event_sink=...)`)
+        self.sink = None
+        if EVENT_SINK:
+            self.sink = EventSink(f"{dest}.zip" if dest else None, capacity=EVENT_SINK_CAPACITY)
 
     def run(self, env, city: City):
+        self.city = city
         while True:
             # Keep the last 2 days to make sure all events are sent to the
             # inference server before getting dumped
-            self.data = city.events
-            if self.chunk_size and len(city.events_slice(datetime.min,
-                                                         env.timestamp - timedelta(days=2))) > self.chunk_size:
-                self.data = city.pull_events_slice(env.timestamp - timedelta(days=2))
-                self.dump()
+            if self.sink is not None:
+                if self.chunk_size and len(self.sink) > self.chunk_size:
+                    self.sink.flush(env.timestamp - self.sink.retention)
+            elif self.chunk_size and city.n_events_before(env.timestamp - timedelta(days=2)) > self.chunk_size:
+                self._dump(city.pull_events_slice(env.timestamp - timedelta(days=2)))
 
             yield env.timeout(self.f / TICK_MINUTE)
 
     def dump(self):
+        if self.sink is not None:
+            events = self.sink.flush()
+            if self.dest is None:
+                print(json.dumps(events, indent=1, default=_json_serialize))
+            return
+
+        # remaining events of the humans
+        self._dump(self.city.pull_events_slice(datetime.max) if self.city is not None else [])
+
+    def _dump(self, data):
+        self.data = data
         if self.dest is None:
             print(json.dumps(self.data, indent=1, default=_json_serialize))
             return
@@ -94,13 +111,13 @@ class EventMonitor(BaseMonitor):
         self._iothread.start()
 
     def join_iothread(self):
+        if self.sink is not None:
+            self.sink.join()
         self._iothread.join()
 
     @staticmethod
     def dump_chunk(data, dest):
-        timestamp = datetime.utcnow().timestamp()
-        with zipfile.ZipFile(f"{dest}.zip", mode='a', compression=zipfile.ZIP_STORED) as zf:
-            zf.writestr(f"{timestamp}.pkl", pickle.dumps(data))
+        write_chunk(data, f"{dest}.zip")
 
 class TimeMonitor(BaseMonitor):
 
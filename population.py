@@ -0,0 +1,137 @@
+import datetime
+import numpy as np
+
+# compartments of the SEIR model
+SUSCEPTIBLE, EXPOSED, INFECTIOUS, REMOVED = 0, 1, 2, 3
+
+
+class Column(object):
+    """
+    Descriptor of a `Human` attribute that lives in a column of `human.population`.
+    Values are stored with `dtype` and converted back to python objects on access.
+    """
+    nullable = False
+
+    def __init__(self, dtype, default=0):
+        self.dtype = dtype
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, human, owner=None):
+        if human is None:
+            return self
+        return self.decode(human.population, human.population.columns[self.name][human.idx])
+
+    def __set__(self, human, value):
+        human.population.columns[self.name][human.idx] = self.encode(human.population, value)
+
+    def encode(self, population, value):
+        return value
+
+    def decode(self, population, value):
+        return value.item()
+
+
+class FloatColumn(Column):
+    """ float64 column where NaN stands for None """
+    nullable = True
+
+    def __init__(self):
+        super().__init__(np.float64, np.nan)
+
+    def encode(self, population, value):
+        return np.nan if value is None else value
+
+    def decode(self, population, value):
+        return None if np.isnan(value) else value.item()
+
+
+class TimestampColumn(FloatColumn):
+    """ datetime stored as float minutes since the start of the simulation, NaN for None """
+
+    def encode(self, population, value):
+        if value is None:
+            return np.nan
+        return (value - population.start_time).total_seconds() / 60
+
+    def decode(self, population, value):
+        if np.isnan(value):
+            return None
+        return population.start_time + datetime.timedelta(minutes=value.item())
+
+
+class CategoryColumn(Column):
+    """ one of `categories` stored as its index """
+
+    def __init__(self, categories):
+        super().__init__(np.int8, 0)
+        self.categories = categories
+        self.codes = {c: i for i, c in enumerate(categories)}
+
+    def encode(self, population, value):
+        return self.codes[value]
+
+    def decode(self, population, value):
+        return self.categories[value]
+
+
+class Population(object):
+    """
+    Struct-of-arrays store for the scalar attributes of the humans of a city.
+    Each human is a row `idx`; `Human` declares the stored attributes as `Column`s
+    so that reading and writing them is unchanged for the rest of the code.
+    """
+
+    def __init__(self, start_time, columns, capacity=1024):
+        self.start_time = start_time
+        self.fields = columns
+        self.size = 0
+        capacity = max(capacity, 1)
+        self.columns = {name: np.full(capacity, c.default, dtype=c.dtype) for name, c in columns.items()}
+
+    def __len__(self):
+        return self.size
+
+    def add(self):
+        """ Allocates a new row and returns its index """
+        capacity = len(next(iter(self.columns.values())))
+        if self.size == capacity:
+            for name, c in self.fields.items():
+                column = np.full(2 * capacity, c.default, dtype=c.dtype)
+                column[:capacity] = self.columns[name]
+                self.columns[name] = column
+
+        self.size += 1
+        return self.size - 1
+
+    def row(self, idx):
+        """ python values of row `idx` """
+        return {name: c.decode(self, self.columns[name][idx]) for name, c in self.fields.items()}
+
+    def rows(self, idx, names=None):
+        """ structured array of the rows `idx` (all the columns or `names`) """
+        names = list(self.fields) if names is None else names
+        rows = np.empty(len(idx), dtype=[(name, self.fields[name].dtype) for name in names])
+        for name in names:
+            rows[name] = self.columns[name][idx]
+        return rows
+
+    def set_rows(self, idx, rows):
+        """ writes the structured array `rows` (see `rows`) at the rows `idx` """
+        for name in rows.dtype.names:
+            self.columns[name][idx] = rows[name]
+
+    def compartments(self, now):
+        """
+        Compartment of every human at simpy tick `now`. The E->I transitions
+        that are due are applied to the column.
+        """
+        compartment = self.columns['compartment'][:self.size]
+        due = (compartment == EXPOSED) & (self.columns['infectious_tick'][:self.size] <= now)
+        compartment[due] = INFECTIOUS
+        return compartment
+
+    def nbytes(self):
+        return sum(column[:self.size].nbytes for column in self.columns.values())
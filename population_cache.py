@@ -0,0 +1,144 @@
+"""
+On-disk cache of the cities synthesized by `City.__init__` (locations, households,
+humans with their static attributes, progressions and habits, preferences).
+
+A city is stored in `{POPULATION_CACHE_DIR}/{key}/`: each column of its `Population`
+is a `.npy` file that is memory-mapped copy-on-write when the city is loaded, the
+rest of the city (and its rng) is pickled in `city.pkl`. The key hashes the arguments
+of the city, the settings of config but `POPULATION_CACHE_IGNORED` and the source
+of the modules that synthesize the city, so that a stale city is never loaded.
+"""
+import os
+import sys
+import shutil
+import hashlib
+import pickle
+import tempfile
+
+import numpy as np
+
+import config
+from base import City, Env
+from checkpoint import Pickler, Unpickler
+from sampling import BufferedRandomState, RandomStreams
+
+SOURCES = ["base.py", "simulator.py", "utils.py", "population.py", "spatial.py", "track.py", "allocation.py",
+           "synthesis.py", "sampling.py"]
+
+
+def make_city(n_people, seed, x_range, y_range, start_time, init_percent_sick, Human, event_sink=None):
+    """
+    `City` of `n_people` synthesized from `seed`, with its own `Env` (`city.env`)
+    and rng (`city.rng`, a `BufferedRandomState`), its humans and locations with their
+    own streams of `seed`. Loaded from the cache if `POPULATION_CACHE_DIR` is set.
+    """
+    args = n_people, seed, x_range, y_range, start_time, init_percent_sick, Human
+    if config.POPULATION_CACHE_DIR is None:
+        return _build(*args, event_sink=event_sink)
+
+    path = os.path.join(config.POPULATION_CACHE_DIR, key(*args))
+    if os.path.exists(path):
+        return load_city(path, event_sink)
+
+    city = _build(*args, event_sink=event_sink)
+    save(path, city)
+    return city
+
+
+def cached_city(cache_dir, n_people, seed, x_range, y_range, start_time, init_percent_sick, Human):
+    """
+    path of the city of these arguments (see `make_city`) in `cache_dir`, where it is
+    synthesized and saved first if it is not there, for `load_city`
+    """
+    args = n_people, seed, x_range, y_range, start_time, init_percent_sick, Human
+    path = os.path.join(cache_dir, key(*args))
+    if not os.path.exists(path):
+        save(path, _build(*args))
+    return path
+
+
+def load_city(path, event_sink=None):
+    """ city saved in `path`, ready to run (see `prepare_city`) """
+    print(f"Loading the city from {path} ...")
+    return prepare_city(load(path), event_sink)
+
+
+def prepare_city(city, event_sink=None):
+    """ `city` with its events pushed to `event_sink`, from its static info only """
+    city.event_sink = event_sink
+    for h in city.humans:
+        h._events, h._event_times = [], []
+    city.log_static_info()
+    return city
+
+
+def _build(n_people, seed, x_range, y_range, start_time, init_percent_sick, Human, event_sink=None):
+    env = Env(start_time)
+    return City(env, n_people, BufferedRandomState(seed), x_range, y_range, start_time, init_percent_sick, Human,
+                event_sink=event_sink, streams=RandomStreams(seed))
+
+
+def key(n_people, seed, x_range, y_range, start_time, init_percent_sick, Human):
+    h = hashlib.sha1()
+    # the lambdas are pickled as bytecode
+    h.update(repr((n_people, seed, x_range, y_range, start_time, init_percent_sick,
+                   Human.__module__, Human.__qualname__, sys.version)).encode())
+    for name in sorted(vars(config)):
+        if name.isupper() and name not in config.POPULATION_CACHE_IGNORED:
+            h.update(f"{name}={getattr(config, name)!r}\n".encode())
+
+    root = os.path.dirname(os.path.abspath(config.__file__))
+    for source in SOURCES:
+        with open(os.path.join(root, source), 'rb') as f:
+            h.update(f.read())
+    return f"n{n_people}_seed{seed}_{h.hexdigest()[:16]}"
+
+
+class _Pickler(Pickler):
+    """ pickles the columns of `population` as references to their `.npy` file """
+
+    def __init__(self, file, population, **kwargs):
+        super().__init__(file, **kwargs)
+        self.columns = {id(column): name for name, column in population.columns.items()}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, np.ndarray):
+            return self.columns.get(id(obj))
+        return super().persistent_id(obj)
+
+
+class _Unpickler(Unpickler):
+
+    def __init__(self, file, path):
+        super().__init__(file)
+        self.path = path
+
+    def persistent_load(self, pid):
+        if not isinstance(pid, str):
+            return super().persistent_load(pid)
+        # plain array on the mapping: indexing a np.memmap is slower
+        return np.load(os.path.join(self.path, f"{pid}.npy"), mmap_mode='c').view(np.ndarray)
+
+
+def save(path, city):
+    """ writes `city` to the directory `path`, unless another process did it first """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(path) or ".")
+    sink, city.event_sink = city.event_sink, None
+    try:
+        for name, column in city.population.columns.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), column)
+        with open(os.path.join(tmp, "city.pkl"), 'wb') as f:
+            _Pickler(f, city.population, protocol=pickle.HIGHEST_PROTOCOL).dump(city)
+        os.rename(tmp, path)
+    except OSError:
+        if not os.path.exists(path):
+            raise
+    finally:
+        city.event_sink = sink
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load(path):
+    with open(os.path.join(path, "city.pkl"), 'rb') as f:
+        return _Unpickler(f, path).load()
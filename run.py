@@ -5,14 +5,22 @@ import math
 import pickle
 import os
 import sys
+import csv
 import zipfile
+import itertools
+import multiprocessing
 
 from frozen.helper import SYMPTOMS_META
 from config import TICK_MINUTE
 from simulator import Human
+from stepped import SteppedEngine
+from sharded import run_sharded
+import checkpoint
+from population_cache import make_city
 from base import *
 from utils import log, _draw_random_discreet_gaussian, _get_random_age, _get_random_area
 from monitors import EventMonitor, TimeMonitor, SEIRMonitor
+from track import DAILY_SERIES
 
 
 @click.group()
@@ -29,15 +37,19 @@ def simu():
 @click.option('--seed', help='seed for the process', type=int, default=0)
 @click.option('--n_jobs', help='number of parallel procs to query the risk servers with', type=int, default=1)
 @click.option('--port', help='which port should we look for inference servers on', type=int, default=6688)
+@click.option('--engine', help='simpy: one process per human, stepped: the whole population advances one hour at a time', type=click.Choice(['simpy', 'stepped']), default='simpy')
+@click.option('--n_shards', help='number of processes the city is split across (stepped engine)', type=int, default=1)
+@click.option('--population_cache', help='directory of the cache of synthesized cities', type=str, default=None)
 def sim(n_people=None,
         init_percent_sick=0,
         start_time=datetime.datetime(2020, 2, 28, 0, 0),
         simulation_days=30,
         outdir=None, out_chunk_size=None,
-        seed=0, n_jobs=1, port=6688):
+        seed=0, n_jobs=1, port=6688, engine='simpy', n_shards=1, population_cache=None):
 
     import config
     config.COLLECT_LOGS = True
+    config.POPULATION_CACHE_DIR = population_cache
 
     if outdir is None:
         outdir = "output"
@@ -47,6 +59,22 @@ def sim(n_people=None,
     os.makedirs(outdir)
 
     outfile = os.path.join(outdir, "data")
+    logfile = os.path.join(f"{outdir}/logs.txt")
+    if n_shards > 1:
+        # one event log per shard: {outfile}.shard{k}.zip
+        tracker = run_sharded(
+            n_people=n_people,
+            init_percent_sick=init_percent_sick,
+            start_time=start_time,
+            simulation_days=simulation_days,
+            outfile=outfile, out_chunk_size=out_chunk_size,
+            print_progress=True,
+            seed=seed, port=port,
+            n_shards=n_shards,
+        )
+        tracker.write_metrics(logfile)
+        return
+
     monitors, tracker = run_simu(
         n_people=n_people,
         init_percent_sick=init_percent_sick,
@@ -55,14 +83,64 @@ def sim(n_people=None,
         outfile=outfile, out_chunk_size=out_chunk_size,
         print_progress=True,
         seed=seed, n_jobs=n_jobs, port=port,
+        engine=engine,
     )
     monitors[0].dump()
     monitors[0].join_iothread()
 
     # write metrics
-    logfile = os.path.join(f"{outdir}/logs.txt")
     tracker.write_metrics(logfile)
 
+@simu.command()
+@click.option('--n_people', help='population of the city', type=int, default=1000)
+@click.option('--init_percent_sick', help='% of population initially sick', type=float, default=0.01)
+@click.option('--simulation_days', help='number of days to run the simulation for', type=int, default=30)
+@click.option('--seeds', help='seeds to run, e.g. 0-63 or 0,2,5-9', type=str, default="0-9")
+@click.option('--workers', help='number of worker processes (default: number of cores)', type=int, default=None)
+@click.option('--engine', help='simpy: one process per human, stepped: the whole population advances one hour at a time', type=click.Choice(['simpy', 'stepped']), default='simpy')
+@click.option('--outfile', help='csv file of the daily series of every run', type=str, default="output/ensemble.csv")
+def ensemble(n_people, init_percent_sick, simulation_days, seeds, workers, engine, outfile):
+    """
+    Runs one simulation per seed on a pool of worker processes and writes the
+    daily series of their trackers to one table, a run at a time as they finish.
+    """
+    seeds = _parse_seeds(seeds)
+    kwargs = dict(n_people=n_people, init_percent_sick=init_percent_sick, simulation_days=simulation_days, engine=engine)
+
+    os.makedirs(os.path.dirname(outfile) or ".", exist_ok=True)
+    with open(outfile, 'w', newline='') as f, \
+            multiprocessing.Pool(workers, initializer=_init_ensemble_worker) as pool:
+        writer = csv.writer(f)
+        writer.writerow(["seed", "day"] + DAILY_SERIES)
+        for seed, series in pool.imap_unordered(_ensemble_run, [(seed, kwargs) for seed in seeds]):
+            for day, values in enumerate(zip(*[series[name] for name in DAILY_SERIES])):
+                writer.writerow([seed, day, *values])
+            f.flush()
+            print(f"seed {seed} done")
+
+
+def _parse_seeds(seeds):
+    """ "0-3,7" -> [0, 1, 2, 3, 7] """
+    result = []
+    for part in seeds.split(","):
+        first, _, last = part.partition("-")
+        result.extend(range(int(first), int(last or first) + 1))
+    return result
+
+
+def _init_ensemble_worker():
+    # the modules are imported once per worker, which then runs many seeds
+    import config
+    config.COLLECT_LOGS = False
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _ensemble_run(args):
+    seed, kwargs = args
+    _, tracker = run_simu(outfile=None, seed=seed, **kwargs)
+    return seed, {name: getattr(tracker, name) for name in DAILY_SERIES}
+
+
 @simu.command()
 def base():
     import pandas as pd
@@ -91,10 +169,12 @@ def base():
 @click.option('--n_people', help='population of the city', type=int, default=1000)
 @click.option('--simulation_days', help='number of days to run the simulation for', type=int, default=50)
 @click.option('--seed', help='seed for the process', type=int, default=0)
-def tune(n_people, simulation_days, seed):
+@click.option('--population_cache', help='directory of the cache of synthesized cities', type=str, default=None)
+def tune(n_people, simulation_days, seed, population_cache):
     # Force COLLECT_LOGS=False
     import config
     config.COLLECT_LOGS = False
+    config.POPULATION_CACHE_DIR = population_cache
 
     # extra packages required  - plotly-orca psutil networkx glob seaborn
     from simulator import Human
@@ -175,66 +255,99 @@ def tune(n_people, simulation_days, seed):
 @simu.command()
 @click.option('--n_people', help='population of the city', type=int, default=2000)
 @click.option('--days', help='number of days to run the simulation for', type=int, default=60)
-@click.option('--tracing', help='which tracing method', type=str, default="")
-@click.option('--order', help='trace to which depth?', type=int, default=1)
+@click.option('--tracing', help='which tracing method (repeat to compare several)', type=str, multiple=True, default=[""])
+@click.option('--order', help='trace to which depth? (repeat to compare several)', type=int, multiple=True, default=[1])
 @click.option('--symptoms', help='trace symptoms?', type=bool, default=False)
 @click.option('--risk', help='trace risk updates?', type=bool, default=False)
-@click.option('--noise', help='noise', type=float, default=0.5)
-def tracing(n_people, days, tracing, order, symptoms, risk, noise):
-    import config
-    config.COLLECT_LOGS = False
-
-    # switch off
-    config.COLLECT_TRAINING_DATA = False
-    config.USE_INFERENCE_SERVER = False
-    config.GET_RISK_PREDICTOR_METRICS = False
-
-    if tracing != "":
-
-        config.INTERVENTION_DAY = 20 # approx 512 will be infected by then
-        config.INTERVENTION = "Tracing"
-        config.RISK_MODEL = tracing
-
-        # noise
-        if tracing == "manual":
-            config.MANUAL_TRACING_NOISE = noise
-        else:
-            config.P_HAS_APP = noise
-
-        #symptoms (not used in risk_model = transformer)
-        config.TRACE_SYMPTOMS = symptoms
-
-        #risk (not used in risk_model = transformer)
-        config.TRACE_SYMPTOMS = risk
-
-        # order (not used in risk_model = transformer)
-        config.TRACING_ORDER = order
-
-        # set filename
-        if tracing != "transformer":
-            name = f"{tracing}-s{1*symptoms}-r{risk}-o{order}"
-        else:
-            name = "transformer"
+@click.option('--noise', help='noise (repeat to compare several)', type=float, multiple=True, default=[0.5])
+@click.option('--fork-from', 'fork_from', help='checkpoint of the days before the intervention (stepped engine) to branch the variants from, simulated first if the file does not exist', type=str, default=None)
+@click.option('--workers', help='number of variants run at the same time with --fork-from (default: number of cores)', type=int, default=None)
+@click.option('--population_cache', help='directory of the cache of synthesized cities', type=str, default=None)
+def tracing(n_people, days, tracing, order, symptoms, risk, noise, fork_from, workers, population_cache):
+    checkpoint.configure({
+        "COLLECT_LOGS": False,
+        "POPULATION_CACHE_DIR": population_cache,
+        # switch off
+        "COLLECT_TRAINING_DATA": False,
+        "USE_INFERENCE_SERVER": False,
+        "GET_RISK_PREDICTOR_METRICS": False,
+    })
+
+    variants = {}
+    for t, o, n in itertools.product(tracing, order, noise):
+        name, settings, data = _tracing_variant(t, o, symptoms, risk, n, days if fork_from else -1)
+        variants[name] = settings, data
+
+    kwargs = dict(n_people=n_people, init_percent_sick=0.0025,
+                  start_time=datetime.datetime(2020, 2, 28, 0, 0),
+                  simulation_days=days,
+                  outfile=None,
+                  print_progress=True, seed=1234, other_monitors=[])
+
+    if fork_from is None:
+        for name, (settings, data) in variants.items():
+            checkpoint.configure(settings)
+            monitors, tracker = run_simu(**kwargs)
+            _dump_tracing_data(n_people, name, data, tracker)
+        return
+
+    if not os.path.exists(fork_from):
+        # the checkpoint is taken at the intervention day
+        prefix = {"INTERVENTION_DAY": TRACING_INTERVENTION_DAY}
+        for key in checkpoint.PREFIX_SETTINGS:
+            values = {settings[key] for settings, _ in variants.values() if key in settings}
+            if len(values) > 1:
+                raise click.UsageError(f"the variants do not share the days before the intervention: {key} in {sorted(values)}")
+            prefix.update((key, value) for value in values)
+        checkpoint.configure(prefix)
+        run_simu(**{**kwargs, 'simulation_days': TRACING_INTERVENTION_DAY}, engine="stepped", save_checkpoint=fork_from)
+
+    def run_variant(prefix, name):
+        monitors, tracker = run_simu(**kwargs, resume=prefix)
+        _dump_tracing_data(n_people, name, variants[name][1], tracker)
+
+    checkpoint.branch(fork_from, {name: settings for name, (settings, _) in variants.items()}, run_variant, workers=workers)
+
+
+TRACING_INTERVENTION_DAY = 20 # approx 512 will be infected by then
+
+
+def _tracing_variant(tracing, order, symptoms, risk, noise, unmitigated_day):
+    """
+    name, config settings and description of a variant of the `tracing` command.
+    `unmitigated_day` is the INTERVENTION_DAY without intervention.
+    """
+    data = dict(tracing=tracing, symptoms=symptoms, order=order, noise=noise)
+    if tracing == "":
+        # no intervention
+        return "unmitigated", {"INTERVENTION_DAY": unmitigated_day}, data
+
+    settings = {
+        "INTERVENTION_DAY": TRACING_INTERVENTION_DAY,
+        "INTERVENTION": "Tracing",
+        "RISK_MODEL": tracing,
+        # symptoms, risk and order are not used in risk_model = transformer
+        "TRACE_SYMPTOMS": symptoms,
+        "TRACE_RISK_UPDATE": risk,
+        "TRACING_ORDER": order,
+    }
+    # noise
+    if tracing == "manual":
+        settings["MANUAL_TRACING_NOISE"] = noise
+    else:
+        settings["P_HAS_APP"] = noise
 
+    if tracing != "transformer":
+        name = f"{tracing}-s{1*symptoms}-r{risk}-o{order}-n{noise}"
     else:
-        # no intervention
-        config.INTERVENTION_DAY = -1
-        name = "unmitigated"
+        name = f"transformer-n{noise}"
+    return name, settings, data
 
-    monitors, tracker = run_simu(n_people=n_people, init_percent_sick=0.0025,
-                        start_time=datetime.datetime(2020, 2, 28, 0, 0),
-                        simulation_days=days,
-                        outfile=None,
-                        print_progress=True, seed=1234, other_monitors=[]
-                        )
 
-    timenow = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
-    data = dict()
-    data['tracing'] = tracing
-    data['symptoms'] = symptoms
-    data['order'] = order
+def _dump_tracing_data(n_people, name, data, tracker):
+    import config
+    data = dict(data)
     data['intervention_day'] = config.INTERVENTION_DAY
-    data['noise'] = noise
 
     data['mobility'] = tracker.mobility
     data['n_init_infected'] = tracker.n_infected_init
@@ -255,6 +368,7 @@ def tracing(n_people, days, tracing, order, symptoms, risk, noise):
     import dill
     timenow = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
     filename = f"tracing_data_n_{n_people}_{timenow}_{name}.pkl"
+    os.makedirs("logs/compare", exist_ok=True)
     with open(f"logs/compare/{filename}", 'wb') as f:
         dill.dump(data, f)
 
@@ -265,14 +379,27 @@ def run_simu(n_people=None, init_percent_sick=0.0,
              start_time=datetime.datetime(2020, 2, 28, 0, 0),
              simulation_days=10,
              outfile=None, out_chunk_size=None,
-             print_progress=False, seed=0, port=6688, n_jobs=1, other_monitors=[]):
-
-    rng = np.random.RandomState(seed)
-    env = Env(start_time)
-    city_x_range = (0,1000)
-    city_y_range = (0,1000)
-    city = City(env, n_people, rng, city_x_range, city_y_range, start_time, init_percent_sick, Human)
+             print_progress=False, seed=0, port=6688, n_jobs=1, other_monitors=[],
+             engine="simpy", resume=None, save_checkpoint=None):
+    """
+    `resume` is a `checkpoint.Checkpoint` to continue instead of creating a city
+    (`simulation_days` is still counted from `start_time`). `save_checkpoint` is
+    a path where to save the state at the end of the run (stepped engine).
+    """
     monitors = [EventMonitor(f=1800, dest=outfile, chunk_size=out_chunk_size), SEIRMonitor(f=1440)]
+    if save_checkpoint and engine != "stepped":
+        raise ValueError("checkpoints need the stepped engine")
+
+    if resume is None:
+        city_x_range = (0,1000)
+        city_y_range = (0,1000)
+        city = make_city(n_people, seed, city_x_range, city_y_range, start_time, init_percent_sick, Human,
+                         event_sink=monitors[0].sink)
+        env = city.env
+        stepped = SteppedEngine(env, city) if engine == "stepped" else None
+    else:
+        env, city, stepped = resume.env, resume.city, resume.engine
+        city.event_sink = monitors[0].sink
 
     # run the simulation
     if print_progress:
@@ -290,8 +417,11 @@ def run_simu(n_people=None, init_percent_sick=0.0,
     env.process(city.run(1440, outfile, start_time, all_possible_symptoms, port, n_jobs))
 
     # run humans
-    for human in city.humans:
-        env.process(human.run(city=city))
+    if stepped is not None:
+        env.process(stepped.run())
+    else:
+        for human in city.humans:
+            env.process(human.run(city=city))
 
     # run monitors
     for m in monitors:
@@ -299,6 +429,9 @@ def run_simu(n_people=None, init_percent_sick=0.0,
 
     env.run(until=simulation_days * 24 * 60 / TICK_MINUTE)
 
+    if save_checkpoint:
+        checkpoint.save(save_checkpoint, checkpoint.Checkpoint(env, city, stepped))
+
     return monitors, city.tracker
 
 
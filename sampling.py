@@ -0,0 +1,163 @@
+"""
+Alias tables (Walker's method) for the fixed discrete distributions drawn during the
+simulation, e.g. the durations of the excursions. A table is built once per distribution
+and then draws a value from one uniform of `rng`, where `rng.choice(values, p=p)` checks
+and accumulates `p` on every call.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+class AliasTable(object):
+    """
+    `values` with the probabilities `p` (normalized). `draw(rng)` draws one value,
+    `sample(rng, size)` draws `size` values as an array, with the same uniforms (and the
+    same values) as `size` calls to `draw`.
+    """
+
+    def __init__(self, values, p):
+        p = np.asarray(p, dtype=np.float64)
+        if len(values) != len(p) or len(p) == 0 or (p < 0).any() or p.sum() <= 0:
+            raise ValueError(f"invalid probabilities {p} for {len(values)} values")
+
+        n = len(p)
+        scaled = p * n / p.sum()
+        prob = np.ones(n)
+        alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # what is left has a probability of 1 up to rounding errors
+
+        self.n = n
+        self.values = list(values)
+        self.prob = prob.tolist()
+        self.alias = alias.tolist()
+        self._values = np.asarray(values)
+        self._prob = prob
+        self._alias = alias
+
+    def draw(self, rng):
+        u = rng.random_sample() * self.n
+        i = min(int(u), self.n - 1)
+        return self.values[i] if u - i < self.prob[i] else self.values[self.alias[i]]
+
+    def sample(self, rng, size):
+        u = rng.random_sample(size) * self.n
+        i = np.minimum(u.astype(np.int64), self.n - 1)
+        return self._values[np.where(u - i < self._prob[i], i, self._alias[i])]
+
+
+@lru_cache(500)
+def alias_table(values, p):
+    """ `AliasTable` of the tuples `values` and `p`, built once for all the callers """
+    return AliasTable(values, p)
+
+
+class BufferedRandomState(object):
+    """
+    `np.random.RandomState` that serves the scalar draws of the simulation (`random()`,
+    `rand()`, `random_sample()`, `uniform(low, high)`, `normal(loc, scale)` and
+    `randint(low, high)` without `size`) from blocks drawn in advance, which saves the
+    overhead of a numpy call per value.
+
+    Consumption order: the scalar uniforms (also used by `uniform` and `randint`) come in
+    order from a block of `block_size` uniforms of the generator, the scalar normals from a
+    block of `block_size` standard normals. A block is drawn when the previous one is used
+    up, between the draws of the other calls, which go to the generator directly (as do
+    all the other methods). A seed therefore gives the same values for the same sequence
+    of calls, but not the values of a plain `RandomState` of that seed.
+    """
+
+    def __init__(self, seed=None, block_size=4096):
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        reseeds the generator (anything `RandomState` takes, a bit generator too) and drops
+        the values drawn in advance
+        """
+        self._rng = np.random.RandomState(seed)
+        self._uniforms, self._normals = [], []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._rng, name)
+
+    def _uniform(self):
+        try:
+            return self._uniforms.pop()
+        except IndexError:
+            # reversed so that `pop` serves the values in their order
+            self._uniforms = self._rng.random_sample(self.block_size)[::-1].tolist()
+            return self._uniforms.pop()
+
+    def random_sample(self, size=None):
+        if size is None:
+            uniforms = self._uniforms
+            return uniforms.pop() if uniforms else self._uniform()
+        return self._rng.random_sample(size)
+
+    random = random_sample
+
+    def rand(self, *args):
+        if args:
+            return self._rng.rand(*args)
+        uniforms = self._uniforms
+        return uniforms.pop() if uniforms else self._uniform()
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        if size is None and type(low) in _SCALARS and type(high) in _SCALARS:
+            uniforms = self._uniforms
+            return low + (high - low) * (uniforms.pop() if uniforms else self._uniform())
+        return self._rng.uniform(low, high, size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        if size is None and type(loc) in _SCALARS and type(scale) in _SCALARS:
+            normals = self._normals
+            if not normals:
+                normals = self._normals = self._rng.standard_normal(self.block_size)[::-1].tolist()
+            return loc + scale * normals.pop()
+        return self._rng.normal(loc, scale, size)
+
+    def randint(self, low, high=None, size=None, dtype=int):
+        if size is None and type(low) in _SCALARS and (high is None or type(high) in _SCALARS):
+            if high is None:
+                low, high = 0, low
+            if high <= low:
+                raise ValueError("low >= high")
+            uniforms = self._uniforms
+            return int(low + (high - low) * (uniforms.pop() if uniforms else self._uniform()))
+        return self._rng.randint(low, high, size, dtype)
+
+
+class RandomStreams(object):
+    """
+    Independent streams of the entities of a simulation: `streams(purpose, entity)` is a
+    `BufferedRandomState` on a counter-based `Philox` generator keyed by (seed, purpose,
+    entity), e.g. ("human", 12) or ("location", "store:3"). The values an entity draws
+    depend on its own calls only, not on how they interleave with the draws of the other
+    entities. This makes a run reproducible for a seed, not the same across engines: the
+    stepped and sharded engines call the streams of a human in another order than
+    `Human.run` (see their docstrings), and do not reproduce a serial run bit-for-bit.
+    """
+
+    def __init__(self, seed, block_size=32):
+        self.seed = seed
+        # small blocks: there is one stream per human and location
+        self.block_size = block_size
+
+    def __call__(self, purpose, entity):
+        entropy = [self.seed, *f"{purpose}:{entity}".encode()]
+        return BufferedRandomState(np.random.Philox(np.random.SeedSequence(entropy)), self.block_size)
+
+
+# types of the parameters of the draws served from the blocks
+_SCALARS = frozenset([int, float, np.int32, np.int64, np.float32, np.float64])
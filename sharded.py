@@ -0,0 +1,401 @@
+"""
+Sharded time-stepped simulation over worker processes.
+
+The city is synthesized once, by the main process. With `os.fork`, the workers share
+it copy-on-write; otherwise it is saved in the cache of `population_cache` (a temporary
+one without `POPULATION_CACHE_DIR`) and every worker loads it, with its columns
+memory-mapped copy-on-write. A worker owns one vertical band of the city
+(`partition`): the households of the band, their residents and the other locations
+of the band. Only the owned humans are simulated, by a `ShardEngine` in the `Env` of
+the worker. The shards synchronize at every hour:
+
+    1. the infections of visitors during the previous hour, and the infections
+    they caused, are sent back to the shard of the visitor, which applies them to its human;
+    2. each shard decides the visits of its humans for the hour. The visits to
+    locations of other shards are sent to them as visit records, with the columns
+    of the visitor and the few attributes the encounters read (`GHOST_STATE`);
+    3. each shard plays the visits to its locations, of its humans and of the
+    visitors (played on the replica of the visitor), in time order.
+
+The daily series and the additive counters of the `Tracker` of every shard (owned
+humans) are merged by day; the other attributes of the `Tracker` are not available.
+
+Differences with `SteppedEngine`:
+    * the state of a visitor is the one at the start of the hour of the visit.
+    * contact books and tracing messages of visitors stay in the shard visited.
+    * hospital capacities and test capacities are per shard.
+    * the visits of an hour are decided at its start, before the encounters of the
+    hour draw from the stream of the human: the values are the same, not their use.
+    * a replica draws from the stream ("replica:<shard>", name), not from the stream of its human.
+
+Known limitation: a sharded run is reproducible for a seed and a number of shards (also
+when the workers load the city instead of sharing it), but not bit-for-bit the same as a
+serial run (`run_simu`, with either engine), even with one shard.
+"""
+import datetime
+import functools
+import heapq
+import multiprocessing
+import os
+import shutil
+import tempfile
+import traceback
+
+import numpy as np
+
+import config
+from config import TICK_MINUTE
+from frozen.helper import SYMPTOMS_META
+from simulator import Human
+from population_cache import make_city, cached_city, load_city, prepare_city
+from stepped import SteppedEngine
+from track import Tracker, DAILY_SERIES, merge_counters
+from monitors import EventMonitor
+from population import SUSCEPTIBLE
+from utils import log
+
+# attributes of a visitor, other than its columns, that its replica needs for the encounters
+# (None when the human does not have it)
+GHOST_STATE = ["all_symptoms", "covid_progression", "WEAR_MASK", "hygiene", "maintain_extra_distance",
+               "time_encounter_reduction_factor", "n_infectious_contacts"]
+# columns set by an infection
+INFECTION_COLUMNS = ["infection_timestamp", "initial_viral_load", "viral_load_plateau_height",
+                     "viral_load_plateau_start", "viral_load_plateau_end", "viral_load_recovered",
+                     "infectiousness_onset_days", "incubation_days", "recovery_days",
+                     "compartment", "infectious_tick", "incubated_tick"]
+
+VISIT_DTYPE = [("idx", np.int64), ("src", np.int64), ("dst", np.int64), ("start", np.float64), ("end", np.float64)]
+LEAVE, ENTER = 0, 1
+
+
+def partition(city, n_shards):
+    """ latitudes splitting `city` in `n_shards` bands with the same number of households """
+    lat = np.array([house.lat for house in city.households], dtype=np.float64)
+    return np.quantile(lat, np.linspace(0, 1, n_shards + 1)[1:-1])
+
+
+def shard_of(bounds, location):
+    return int(np.searchsorted(bounds, location.lat, side='right'))
+
+
+class MergedTracker(object):
+    """
+    Per-day series and `ADDITIVE_COUNTERS` of the trackers of all the shards, summed.
+    Reading another attribute of a `Tracker` raises an AttributeError.
+    """
+
+    def __init__(self, n_humans):
+        self.n_humans = n_humans
+        for name in DAILY_SERIES:
+            setattr(self, name, [])
+
+    def __getattr__(self, name):
+        # only called for the attributes that are not set
+        raise AttributeError(f"{name} of the Tracker is not merged over the shards")
+
+    def merge(self, messages):
+        """ merges the (series, counters) of every shard """
+        series, counters = zip(*messages)
+        for name in DAILY_SERIES:
+            setattr(self, name, np.sum([s[name] for s in series], axis=0).tolist())
+        for name, value in functools.reduce(merge_counters, counters).items():
+            setattr(self, name, value)
+
+    def write_metrics(self, logfile):
+        log("######## COVID SPREAD #########", logfile)
+        for name in DAILY_SERIES:
+            log(f"{name} {getattr(self, name)}", logfile)
+
+
+class ShardEngine(SteppedEngine):
+    """
+    `SteppedEngine` for the humans of one shard (`city.humans`), see the module docstring.
+    `all_humans` are the replicas of every human of the city, `exchange` sends a list
+    with a message per shard and returns the messages of every shard for this one.
+    """
+
+    def __init__(self, env, city, shard, bounds, all_humans, exchange):
+        super().__init__(env, city)
+        self.shard = shard
+        self.n_shards = len(bounds) + 1
+        self.owner = np.array([shard_of(bounds, location) for location in self.locations], dtype=np.int64)
+        self.replicas = {h.idx: h for h in all_humans}
+        self.exchange = exchange
+
+        self._outgoing = [[] for _ in range(self.n_shards)]
+        self._events = [] # heap of (tick, LEAVE/ENTER, seq, human, location, source, duration)
+        # replica idx -> [number of visits not over, susceptible, n_infectious_contacts]
+        self._visitors = {}
+
+    def run(self):
+        for human in self.humans:
+            human.household.place_human(human)
+
+        n_steps = 0
+        while True:
+            self.hour_end = (n_steps + 1) * self.step
+            self._receive_infections(self.exchange(self._infections()))
+
+            self._plan_hour()
+            self._receive_visits(self.exchange(self._visits()))
+
+            while self._events and self._events[0][0] < self.hour_end:
+                t = self._events[0][0]
+                if t > self.env.now:
+                    yield self.env.timeout(t - self.env.now)
+                self._play()
+
+            n_steps += 1
+            yield self.env.timeout(self.hour_end - self.env.now)
+
+    def _plan_hour(self):
+        # humans back from a visit during the last hour continue their plan
+        pending = np.flatnonzero(self.alive & (self.busy_until < self.hour_end))
+        for i in pending:
+            if self.plans[i]:
+                self._next_visit(i)
+        super()._plan_hour()
+
+    def _next_visit(self, i):
+        """ decides the visits of the plan of human `i` that start before the end of the hour """
+        human, plan = self.humans[i], self.plans[i]
+        human.location = self.locations[self.location[i]]
+        t = max(self.busy_until[i], self.env.now)
+        while plan and t < self.hour_end:
+            source = human.location
+            visit = self._visit(human, plan.popleft(), plan, now=t)
+            if visit is None: # no more hospitals
+                self.alive[i] = False
+                plan.clear()
+                return
+
+            location, duration = visit
+            end = t + duration / TICK_MINUTE
+            dst = self.location_idx[location]
+            if self.owner[dst] == self.shard:
+                self._push(t, ENTER, human, location, source, duration)
+                self._push(end, LEAVE, human, location)
+            else:
+                self._outgoing[self.owner[dst]].append((human.idx, self.location_idx[source], dst, t, end))
+
+            human.location = location
+            self.location[i] = dst
+            t = end
+        self.busy_until[i] = t
+
+    def _push(self, t, action, human, location, source=None, duration=None):
+        heapq.heappush(self._events, (t, action, self._seq, human, location, source, duration))
+        self._seq += 1
+
+    def _play(self):
+        while self._events and self._events[0][0] <= self.env.now:
+            _, action, _, human, location, source, duration = heapq.heappop(self._events)
+            if action == ENTER:
+                human.location = source
+                human.enter(location, self.city, duration)
+            else:
+                human.leave(location, self.city)
+                if human.idx in self._visitors:
+                    self._visitors[human.idx][0] -= 1
+
+    def _visits(self):
+        """ visit records of the hour for every shard """
+        population = self.city.population
+        messages = []
+        for visits in self._outgoing:
+            visits = np.array(visits, dtype=VISIT_DTYPE)
+            idx = np.unique(visits["idx"])
+            state = [[getattr(self.replicas[i], name, None) for name in GHOST_STATE] for i in idx.tolist()]
+            messages.append((visits, idx, population.rows(idx), state))
+        self._outgoing = [[] for _ in range(self.n_shards)]
+        return messages
+
+    def _receive_visits(self, messages):
+        population = self.city.population
+        for visits, idx, rows, state in messages:
+            population.set_rows(idx, rows)
+            for i, values in zip(idx.tolist(), state):
+                replica = self.replicas[i]
+                for name, value in zip(GHOST_STATE, values):
+                    if value is not None:
+                        setattr(replica, name, value)
+                replica.last_date['symptoms'] = self.env.day_index
+                replica._mark_carrier()
+                visitor = self._visitors.setdefault(i, [0, False, 0])
+                visitor[1:] = replica.compartment == SUSCEPTIBLE, replica.n_infectious_contacts
+
+            for i, src, dst, start, end in visits.tolist():
+                replica = self.replicas[i]
+                self._visitors[i][0] += 1
+                location = self.locations[dst]
+                self._push(start, ENTER, replica, location, self.locations[src], (end - start) * TICK_MINUTE)
+                self._push(end, LEAVE, replica, location)
+
+    def _infections(self):
+        """
+        For every shard, the columns and covid progression of its humans infected here as
+        visitors, and the number of humans they infected here.
+        """
+        population = self.city.population
+        infected = [[] for _ in range(self.n_shards)]
+        infectious_contacts = [{} for _ in range(self.n_shards)]
+        for i, visitor in list(self._visitors.items()):
+            n_visits, susceptible, n_infectious_contacts = visitor
+            replica = self.replicas[i]
+            shard = self.owner[self.location_idx[replica.household]]
+            if susceptible and replica.compartment != SUSCEPTIBLE:
+                infected[shard].append(i)
+                visitor[1] = False
+            if replica.n_infectious_contacts > n_infectious_contacts:
+                infectious_contacts[shard][i] = replica.n_infectious_contacts - n_infectious_contacts
+                visitor[2] = replica.n_infectious_contacts
+            if n_visits == 0:
+                del self._visitors[i]
+
+        messages = []
+        for idx, contacts in zip(infected, infectious_contacts):
+            idx = np.array(idx, dtype=np.int64)
+            progressions = [self.replicas[i].covid_progression for i in idx.tolist()]
+            messages.append((idx, population.rows(idx, INFECTION_COLUMNS), progressions, contacts))
+        return messages
+
+    def _receive_infections(self, messages):
+        population = self.city.population
+        for idx, rows, progressions, contacts in messages:
+            for k, i in enumerate(idx.tolist()):
+                human = self.replicas[i]
+                if human.compartment != SUSCEPTIBLE:
+                    continue
+                population.set_rows(idx[k:k + 1], rows[k:k + 1])
+                human.covid_progression = progressions[k]
+                human._mark_carrier()
+
+            for i, n in contacts.items():
+                self.replicas[i].n_infectious_contacts += n
+
+
+def _run_shard(shard, n_shards, conn, city, start_time, simulation_days, outfile, out_chunk_size, seed, port):
+    """ runs the shard `shard` of `city` (or of the city saved at the path `city`) """
+    try:
+        monitors = []
+        if outfile:
+            monitors.append(EventMonitor(f=1800, dest=f"{outfile}.shard{shard}", chunk_size=out_chunk_size))
+        sink = monitors[0].sink if monitors else None
+        city = load_city(city, sink) if isinstance(city, str) else prepare_city(city, sink)
+        env, rng = city.env, city.rng
+
+        bounds = partition(city, n_shards)
+        all_humans = city.humans
+        city.humans = []
+        for human in all_humans:
+            if shard_of(bounds, human.household) == shard:
+                city.humans.append(human)
+            else:
+                # the replica draws the visits to this shard from a stream of its own
+                human.rng = city.streams(f"replica:{shard}", human.name)
+        city.tracker = Tracker(env, city)
+        # the city is the same in every shard, not the rest of the simulation
+        rng.seed([seed, shard])
+
+        def exchange(messages):
+            conn.send(("exchange", messages))
+            return conn.recv()
+
+        def tracked():
+            return {name: getattr(city.tracker, name) for name in DAILY_SERIES}, city.tracker.counters()
+
+        def send_series():
+            while True:
+                conn.send(("series", tracked()))
+                yield env.timeout(24 * 60 / TICK_MINUTE)
+
+        all_possible_symptoms = [""] * len(SYMPTOMS_META)
+        for k, v in SYMPTOMS_META.items():
+            all_possible_symptoms[v] = k
+        env.process(city.run(1440, outfile, start_time, all_possible_symptoms, port, 1))
+        # the series of the day are sent before the first exchange of the day
+        env.process(send_series())
+        env.process(ShardEngine(env, city, shard, bounds, all_humans, exchange).run())
+        for m in monitors:
+            env.process(m.run(env, city=city))
+
+        env.run(until=simulation_days * 24 * 60 / TICK_MINUTE)
+        for m in monitors:
+            m.dump()
+            m.join_iothread()
+        conn.send(("done", (tracked(), len(city.humans))))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def run_sharded(n_people=None, init_percent_sick=0.0,
+                start_time=datetime.datetime(2020, 2, 28, 0, 0),
+                simulation_days=10,
+                outfile=None, out_chunk_size=None,
+                print_progress=False, seed=0, port=6688, n_shards=2):
+    """
+    Runs the simulation of the city over `n_shards` processes, see the module docstring.
+    Returns the `MergedTracker` of the shards.
+    """
+    args = n_people, seed, (0, 1000), (0, 1000), start_time, init_percent_sick, Human
+    if hasattr(os, "fork"):
+        return _run_shards(multiprocessing.get_context("fork"), make_city(*args), n_people, start_time,
+                           simulation_days, outfile, out_chunk_size, print_progress, seed, port, n_shards)
+
+    cache_dir = config.POPULATION_CACHE_DIR or tempfile.mkdtemp()
+    try:
+        return _run_shards(multiprocessing, cached_city(cache_dir, *args), n_people, start_time,
+                           simulation_days, outfile, out_chunk_size, print_progress, seed, port, n_shards)
+    finally:
+        if config.POPULATION_CACHE_DIR is None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def _run_shards(context, city, n_people, start_time, simulation_days, outfile, out_chunk_size, print_progress, seed,
+                port, n_shards):
+    """ `run_sharded` of `city`, or of the city saved at the path `city`, in processes of `context` """
+    conns, workers = [], []
+    for shard in range(n_shards):
+        conn, worker_conn = context.Pipe()
+        worker = context.Process(target=_run_shard, args=(shard, n_shards, worker_conn, city,
+            start_time, simulation_days, outfile, out_chunk_size, seed, port))
+        worker.start()
+        worker_conn.close()
+        conns.append(conn)
+        workers.append(worker)
+
+    def receive(kind):
+        messages = []
+        for conn in conns:
+            message_kind, message = conn.recv()
+            if message_kind == "error":
+                for worker in workers:
+                    worker.terminate()
+                raise RuntimeError(f"shard failed:\n{message}")
+            assert message_kind == kind, (message_kind, kind)
+            messages.append(message)
+        return messages
+
+    tracker = MergedTracker(n_people)
+    n_hours = simulation_days * 24
+    for hour in range(n_hours):
+        if hour % 24 == 0:
+            tracker.merge(receive("series"))
+            if print_progress:
+                print(start_time + datetime.timedelta(hours=hour),
+                      f"S:{tracker.s_per_day[-1]} E:{tracker.e_per_day[-1]} I:{tracker.i_per_day[-1]} R:{tracker.r_per_day[-1]}")
+
+        # infections of the last hour, then visits of this hour
+        for _ in range(2):
+            messages = receive("exchange")
+            for shard, conn in enumerate(conns):
+                conn.send([m[shard] for m in messages])
+
+    series, n_humans = zip(*receive("done"))
+    tracker.merge(series)
+    tracker.n_humans = sum(n_humans)
+    for worker in workers:
+        worker.join()
+    return tracker
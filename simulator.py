@@ -1,35 +1,59 @@
 # -*- coding: utf-8 -*-
+import bisect
 from collections import deque
 
 from frozen.clusters import Clusters
 from frozen.utils import create_new_uid, Message, UpdateMessage, encode_message, encode_update_message
 
-from utils import _normalize_scores, _get_random_sex, _get_covid_progression, \
-     _get_preexisting_conditions, _draw_random_discreet_gaussian, _sample_viral_load_piecewise, \
-     _get_cold_progression, _get_flu_progression, _get_allergy_progression, proba_to_risk_fn, _get_get_really_sick
+from utils import _get_covid_progression, _draw_random_discreet_gaussian, _sample_viral_load_piecewise, \
+     _get_cold_progression, _get_flu_progression, _get_allergy_progression, proba_to_risk_fn
 
 from base import *
 from interventions import GetTested, RiskBasedRecommendations
+from synthesis import draw_attributes, HABITS
+from sampling import alias_table
+from population import Population, Column, FloatColumn, TimestampColumn, CategoryColumn, \
+    SUSCEPTIBLE, EXPOSED, INFECTIOUS, REMOVED
 if COLLECT_LOGS is False:
     Event = DummyEvent
 
 _proba_to_risk_level = proba_to_risk_fn(np.exp(np.load(RISK_MAPPING_FILE)))
 
+# symptoms of a day of a progression -> the tuple shared by the progressions with that day
+_symptom_days = {}
+
+
+def _compact_progression(progression):
+    return tuple(_symptom_days.setdefault(tuple(day), tuple(day)) for day in progression)
+
+
+def _p_any(p, n):
+    """ probability of at least one success in `n` trials of probability `p` """
+    return p if n == 1 else 1 - (1 - min(p, 1)) ** n
+
+
 class Visits(object):
+    """
+    Visits of a human to the locations of each type ("park", "stores", "miscs"),
+    as integer counts per location with their running cumulative sum, so that the
+    next location is sampled with one uniform draw and a `searchsorted`.
+    """
 
     def __init__(self):
-        self.parks = defaultdict(int)
-        self.stores = defaultdict(int)
         self.hospitals = defaultdict(int)
-        self.miscs = defaultdict(int)
+        self.counts = {}
+        self.cumulative_counts = {}
+        self.n_visited = defaultdict(int)
+        # type -> (preferences, cumulative preferences of the locations not visited yet)
+        self._explore = {}
 
     @property
     def n_parks(self):
-        return len(self.parks)
+        return self.n_visited["park"]
 
     @property
     def n_stores(self):
-        return len(self.stores)
+        return self.n_visited["stores"]
 
     @property
     def n_hospitals(self):
@@ -37,16 +61,76 @@ class Visits(object):
 
     @property
     def n_miscs(self):
-        return len(self.miscs)
+        return self.n_visited["miscs"]
+
+    def _init(self, type, n):
+        if type not in self.counts:
+            self.counts[type] = np.zeros(n, dtype=np.int64)
+            self.cumulative_counts[type] = np.zeros(n, dtype=np.int64)
+
+    def explore_cdf(self, type, preferences):
+        self._init(type, len(preferences))
+        explore = self._explore.get(type)
+        if explore is None or explore[0] is not preferences:
+            cdf = np.cumsum(np.where(self.counts[type] == 0, preferences, 0))
+            explore = self._explore[type] = (preferences, cdf)
+        return explore[1]
+
+    def exploit_cdf(self, type, n):
+        self._init(type, n)
+        return self.cumulative_counts[type]
+
+    def add(self, type, i):
+        counts = self.counts[type]
+        if counts[i] == 0:
+            self.n_visited[type] += 1
+            self._explore.pop(type, None)
+        counts[i] += 1
+        self.cumulative_counts[type][i:] += 1
 
 
 class Human(object):
 
+    # scalar attributes stored in the columns of `city.population`
+    age = Column(np.int16)
+    sex = CategoryColumn(['female', 'male', 'other'])
+    carefulness = Column(np.float64)
+    has_app = Column(np.bool_, False)
+    infection_timestamp = TimestampColumn()
+    initial_viral_load = Column(np.float64)
+    viral_load_plateau_height = FloatColumn()
+    viral_load_plateau_start = FloatColumn()
+    viral_load_plateau_end = FloatColumn()
+    viral_load_recovered = FloatColumn()
+    infectiousness_onset_days = FloatColumn()
+    incubation_days = FloatColumn()
+    recovery_days = FloatColumn()
+    risk = Column(np.float64)
+    rec_level = Column(np.int8, -1)
+    # SEIR compartment and the simpy ticks of the scheduled transitions
+    compartment = Column(np.int8, SUSCEPTIBLE)
+    infectious_tick = Column(np.float64, np.inf)
+    incubated_tick = Column(np.float64, np.inf)
+    # process of the stay at home in progress (see `at_home` and `wake`)
+    _at_home = None
+
+    @classmethod
+    def columns(cls):
+        return {name: c for name, c in vars(cls).items() if isinstance(c, Column)}
+
     def __init__(self, env, city, name, age, rng, infection_timestamp, household, workplace, profession, rho=0.3, gamma=0.21, symptoms=[],
-                 test_results=None):
+                 test_results=None, attributes=None):
+        """
+        `attributes` are the static attributes of the human drawn by `synthesis.draw_attributes`
+        (with the other humans of the city), drawn for this human alone if None.
+        """
         self.env = env
         self.city = city
+        self.population = city.population
+        self.idx = self.population.add()
         self._events = []
+        # time of each event of `_events`, for bisecting
+        self._event_times = []
         self.name = f"human:{name}"
         self.rng = rng
         self.profession = profession
@@ -55,50 +139,48 @@ class Human(object):
         self.workplace = workplace
         self.rho = rho
         self.gamma = gamma
+        if attributes is None:
+            attributes = {name: values[0] for name, values in
+                          draw_attributes(rng, [age], [profession], [infection_timestamp is not None]).items()}
 
         self.age = age
-        self.sex = _get_random_sex(self.rng)
+        self.sex = attributes['sex']
         self.dead = False
-        self.preexisting_conditions = _get_preexisting_conditions(self.age, self.sex, self.rng)
+        self.preexisting_conditions = attributes['preexisting_conditions']
 
-        age_modifier = 2 if self.age > 40 or self.age < 12 else 2
         # &carefulness
-        if self.rng.rand() < P_CAREFUL_PERSON:
-            self.carefulness = (round(self.rng.normal(55, 10)) + self.age/2) / 100
-        else:
-            self.carefulness = (round(self.rng.normal(25, 10)) + self.age/2) / 100
+        self.carefulness = attributes['carefulness']
 
-        self.has_app = self.rng.rand() < (P_HAS_APP / age_modifier) + (self.carefulness / 2)
+        self.has_app = attributes['has_app']
 
         # allergies
-        self.has_allergies = self.rng.rand() < P_ALLERGIES
-        len_allergies = self.rng.normal(1/self.carefulness, 1)
-        self.len_allergies = 7 if len_allergies > 7 else np.ceil(len_allergies)
-        self.allergy_progression = _get_allergy_progression(self.rng)
+        self.has_allergies = attributes['has_allergies']
+        self.len_allergies = attributes['len_allergies']
+        self._allergy_progression = None
 
         # logged info can be quite different
-        self.has_logged_info = self.has_app and self.rng.rand() < self.carefulness
-        self.obs_is_healthcare_worker = True if self.is_healthcare_worker and rng.random()<0.9 else False # 90% of the time, healthcare workers will declare it
+        self.has_logged_info = attributes['has_logged_info']
+        self.obs_is_healthcare_worker = attributes['obs_is_healthcare_worker'] # 90% of the time, healthcare workers will declare it
         self.obs_age = self.age if self.has_app and self.has_logged_info else None
         self.obs_sex = self.sex if self.has_app and self.has_logged_info else None
         self.obs_preexisting_conditions = self.preexisting_conditions if self.has_app and self.has_logged_info else []
 
         self.rest_at_home = False # to track mobility due to symptoms
         self.visits = Visits()
-        self.travelled_recently = self.rng.rand() > P_TRAVELLED_INTERNATIONALLY_RECENTLY
+        self.travelled_recently = attributes['travelled_recently']
 
         # &symptoms, &viral-load
         # probability of being asymptomatic is basically 50%, but a bit less if you're older and a bit more if you're younger
-        self.is_asymptomatic = self.rng.rand() < BASELINE_P_ASYMPTOMATIC - (self.age - 50) * 0.5 / 100 # e.g. 70: baseline-0.1, 20: baseline+0.15
+        self.is_asymptomatic = attributes['is_asymptomatic'] # e.g. 70: baseline-0.1, 20: baseline+0.15
         self.asymptomatic_infection_ratio = ASYMPTOMATIC_INFECTION_RATIO if self.is_asymptomatic else 0.0 # draw a beta with the distribution in documents
 
         # Indicates whether this person will show severe signs of illness.
-        self.cold_timestamp = self.env.timestamp if self.rng.random() < P_COLD else None
-        self.flu_timestamp = self.env.timestamp if self.rng.random() < P_FLU else None # different from asymptomatic
-        self.allergy_timestamp = self.env.timestamp if self.rng.random() < P_HAS_ALLERGIES_TODAY else None
-        self.can_get_really_sick = _get_get_really_sick(self.age, self.sex, self.rng)
-        self.can_get_extremely_sick = self.can_get_really_sick and self.rng.random() >= 0.7 # &severe; 30% of severe cases need ICU
-        self.never_recovers = self.rng.random() <= P_NEVER_RECOVERS[min(math.floor(self.age/10),8)]
+        self.cold_timestamp = self.env.timestamp if attributes['has_cold'] else None
+        self.flu_timestamp = self.env.timestamp if attributes['has_flu'] else None # different from asymptomatic
+        self.allergy_timestamp = self.env.timestamp if attributes['has_allergy_today'] else None
+        self.can_get_really_sick = attributes['can_get_really_sick']
+        self.can_get_extremely_sick = attributes['can_get_extremely_sick'] # &severe; 30% of severe cases need ICU
+        self.never_recovers = attributes['never_recovers']
         self.obs_hospitalized = False
         self.obs_in_icu = False
 
@@ -111,7 +193,7 @@ class Human(object):
         self.recovery_days = None # self.infectiousness_onset_days + self.viral_load_recovered
         self.test_result, self.test_type = None, None
         self.infection_timestamp = infection_timestamp
-        self.initial_viral_load = self.rng.rand() if infection_timestamp is not None else 0
+        self.initial_viral_load = attributes['initial_viral_load']
         if self.infection_timestamp is not None:
             self.compute_covid_properties()
             print(f"{self} is infected")
@@ -121,7 +203,7 @@ class Human(object):
         self.has_logged_symptoms = False
         self.last_state = self.state
         self.n_infectious_contacts = 0
-        self.last_date = defaultdict(lambda : self.env.initial_timestamp.date())
+        self.last_date = defaultdict(lambda : self.env.day_index) # env.day_index of the last update
         self.last_location = self.location
         self.last_duration = 0
 
@@ -169,54 +251,28 @@ class Human(object):
 
         # symptoms
         self.symptom_start_time = None
-        self.cold_progression = _get_cold_progression(self.age, self.rng, self.carefulness, self.preexisting_conditions, self.can_get_really_sick, self.can_get_extremely_sick)
-        self.flu_progression = _get_flu_progression(self.age, self.rng, self.carefulness, self.preexisting_conditions, self.can_get_really_sick, self.can_get_extremely_sick)
+        # drawn the first time the human has them (see the properties)
+        self._cold_progression, self._flu_progression, self._covid_progression = None, None, None
         self.all_symptoms, self.cold_symptoms, self.flu_symptoms, self.covid_symptoms, self.allergy_symptoms = [], [], [], [], []
 
         # habits
-        self.avg_shopping_time = _draw_random_discreet_gaussian(AVG_SHOP_TIME_MINUTES, SCALE_SHOP_TIME_MINUTES, self.rng)
-        self.scale_shopping_time = _draw_random_discreet_gaussian(AVG_SCALE_SHOP_TIME_MINUTES,
-                                                                  SCALE_SCALE_SHOP_TIME_MINUTES, self.rng)
-
-        self.avg_exercise_time = _draw_random_discreet_gaussian(AVG_EXERCISE_MINUTES, SCALE_EXERCISE_MINUTES, self.rng)
-        self.scale_exercise_time = _draw_random_discreet_gaussian(AVG_SCALE_EXERCISE_MINUTES,
-                                                                  SCALE_SCALE_EXERCISE_MINUTES, self.rng)
-
-        self.avg_working_minutes = _draw_random_discreet_gaussian(AVG_WORKING_MINUTES, SCALE_WORKING_MINUTES, self.rng)
-        self.scale_working_minutes = _draw_random_discreet_gaussian(AVG_SCALE_WORKING_MINUTES, SCALE_SCALE_WORKING_MINUTES, self.rng)
-
-        self.avg_misc_time = _draw_random_discreet_gaussian(AVG_MISC_MINUTES, SCALE_MISC_MINUTES, self.rng)
-        self.scale_misc_time = _draw_random_discreet_gaussian(AVG_SCALE_MISC_MINUTES, SCALE_SCALE_MISC_MINUTES, self.rng)
-
-        #getting the number of shopping days and hours from a distribution
-        self.number_of_shopping_days = _draw_random_discreet_gaussian(AVG_NUM_SHOPPING_DAYS, SCALE_NUM_SHOPPING_DAYS, self.rng)
-        self.number_of_shopping_hours = _draw_random_discreet_gaussian(AVG_NUM_SHOPPING_HOURS, SCALE_NUM_SHOPPING_HOURS, self.rng)
-
-        #getting the number of exercise days and hours from a distribution
-        self.number_of_exercise_days = _draw_random_discreet_gaussian(AVG_NUM_EXERCISE_DAYS, SCALE_NUM_EXERCISE_DAYS, self.rng)
-        self.number_of_exercise_hours = _draw_random_discreet_gaussian(AVG_NUM_EXERCISE_HOURS, SCALE_NUM_EXERCISE_HOURS, self.rng)
+        for name in HABITS:
+            setattr(self, name, attributes[name])
 
         #Multiple shopping days and hours
-        self.shopping_days = self.rng.choice(range(7), self.number_of_shopping_days)
-        self.shopping_hours = self.rng.choice(range(7, 20), self.number_of_shopping_hours)
+        self.shopping_days = attributes['shopping_days']
+        self.shopping_hours = attributes['shopping_hours']
 
         #Multiple exercise days and hours
-        self.exercise_days = self.rng.choice(range(7), self.number_of_exercise_days)
-        self.exercise_hours = self.rng.choice(range(7, 20), self.number_of_exercise_hours)
+        self.exercise_days = attributes['exercise_days']
+        self.exercise_hours = attributes['exercise_hours']
 
-        #Limiting the number of hours spent shopping per week
-        self.max_misc_per_week = _draw_random_discreet_gaussian(AVG_MAX_NUM_MISC_PER_WEEK, SCALE_MAX_NUM_MISC_PER_WEEK, self.rng)
         self.count_misc=0
-
-        # Limiting the number of hours spent exercising per week
-        self.max_exercise_per_week = _draw_random_discreet_gaussian(AVG_MAX_NUM_EXERCISE_PER_WEEK, SCALE_MAX_NUM_EXERCISE_PER_WEEK, self.rng)
         self.count_exercise=0
-
-        #Limiting the number of hours spent shopping per week
-        self.max_shop_per_week = _draw_random_discreet_gaussian(AVG_MAX_NUM_SHOP_PER_WEEK, SCALE_MAX_NUM_SHOP_PER_WEEK, self.rng)
         self.count_shop=0
 
-        self.work_start_hour = self.rng.choice(range(7, 17), 3)
+        self.work_start_hour = attributes['work_start_hour']
+        self.agenda = self._compile_agenda()
 
 
 
@@ -234,26 +290,23 @@ class Human(object):
     def events(self):
         return self._events
 
-    def events_slice(self, begin, end):
-        end_i = len(self._events)
-        begin_i = end_i
-        for i, event in enumerate(self._events):
-            if i < begin_i and event['time'] >= begin:
-                begin_i = i
-            elif event['time'] > end:
-                end_i = i
-                break
+    def log_event(self, event):
+        # events are logged at the current time, so `_event_times` stays sorted
+        self._events.append(event)
+        self._event_times.append(event['time'])
 
+    def events_slice(self, begin, end):
+        begin_i = bisect.bisect_left(self._event_times, begin)
+        end_i = bisect.bisect_right(self._event_times, end)
         return self._events[begin_i:end_i]
 
-    def pull_events_slice(self, end):
-        end_i = len(self._events)
-        for i, event in enumerate(self._events):
-            if event['time'] >= end:
-                end_i = i
-                break
+    def n_events_before(self, end):
+        return bisect.bisect_left(self._event_times, end)
 
+    def pull_events_slice(self, end):
+        end_i = bisect.bisect_left(self._event_times, end)
         events_slice, self._events = self._events[:end_i], self._events[end_i:]
+        self._event_times = self._event_times[end_i:]
 
         return events_slice
 
@@ -269,28 +322,47 @@ class Human(object):
 
     @property
     def is_susceptible(self):
-        return not self.is_exposed and not self.is_infectious and not self.is_removed and not self.is_immune
+        return self.current_compartment() == SUSCEPTIBLE and not self.is_immune
 
     @property
     def is_exposed(self):
-        return self.infection_timestamp is not None and self.env.timestamp - self.infection_timestamp < datetime.timedelta(days=self.infectiousness_onset_days)
+        return self.current_compartment() == EXPOSED
 
     @property
     def is_infectious(self):
-        return self.infection_timestamp is not None and self.env.timestamp - self.infection_timestamp >= datetime.timedelta(days=self.infectiousness_onset_days)
+        return self.current_compartment() == INFECTIOUS
 
     @property
     def is_removed(self):
-        return self.recovered_timestamp == datetime.datetime.max
+        return self.current_compartment() == REMOVED
 
     @property
     def is_incubated(self):
-        return (not self.is_asymptomatic and self.infection_timestamp is not None and
-                self.env.timestamp - self.infection_timestamp >= datetime.timedelta(days=self.incubation_days))
+        return self.env.now >= self.incubated_tick
 
     @property
     def state(self):
-        return [int(self.is_susceptible), int(self.is_exposed), int(self.is_infectious), int(self.is_removed)]
+        compartment = self.current_compartment()
+        return [int(compartment == SUSCEPTIBLE and not self.is_immune), int(compartment == EXPOSED),
+                int(compartment == INFECTIOUS), int(compartment == REMOVED)]
+
+    def current_compartment(self):
+        """ SEIR compartment, moves to infectious once the onset tick is reached """
+        compartment = self.compartment
+        if compartment == EXPOSED and self.env.now >= self.infectious_tick:
+            compartment = self.compartment = INFECTIOUS
+        return compartment
+
+    @property
+    def is_carrier(self):
+        """ has covid (exposed or infectious), a cold or a flu, i.e. can transmit one in an encounter """
+        return self.infection_timestamp is not None or self.cold_timestamp is not None or self.flu_timestamp is not None
+
+    def _mark_carrier(self):
+        """ adds this human to the carriers of the location it is in if it is one (after a transmission) """
+        location = self.location
+        if location is not None and self in location.humans and self.is_carrier:
+            location.carriers.add(self)
 
     @property
     def has_cold(self):
@@ -328,6 +400,45 @@ class Human(object):
             return
         return (self.env.timestamp-self.allergy_timestamp).days
 
+    # The progressions are lists of the symptoms of each day, drawn the first time they are
+    # needed (most humans never catch a cold or the flu) and stored with `_compact_progression`.
+    @property
+    def cold_progression(self):
+        if self._cold_progression is None:
+            self._cold_progression = _compact_progression(_get_cold_progression(
+                self.age, self.rng, self.carefulness, self.preexisting_conditions, self.can_get_really_sick,
+                self.can_get_extremely_sick))
+        return self._cold_progression
+
+    @property
+    def flu_progression(self):
+        if self._flu_progression is None:
+            self._flu_progression = _compact_progression(_get_flu_progression(
+                self.age, self.rng, self.carefulness, self.preexisting_conditions, self.can_get_really_sick,
+                self.can_get_extremely_sick))
+        return self._flu_progression
+
+    @property
+    def allergy_progression(self):
+        if self._allergy_progression is None:
+            self._allergy_progression = _compact_progression(_get_allergy_progression(self.rng))
+        return self._allergy_progression
+
+    @property
+    def covid_progression(self):
+        """ None before the human is infected """
+        if self._covid_progression is None and self.infection_timestamp is not None:
+            self._covid_progression = _compact_progression(_get_covid_progression(
+                self.initial_viral_load, self.viral_load_plateau_start, self.viral_load_plateau_end,
+                self.viral_load_recovered, age=self.age, incubation_days=self.incubation_days,
+                really_sick=self.can_get_really_sick, extremely_sick=self.can_get_extremely_sick,
+                rng=self.rng, preexisting_conditions=self.preexisting_conditions, carefulness=self.carefulness))
+        return self._covid_progression
+
+    @covid_progression.setter
+    def covid_progression(self, progression):
+        self._covid_progression = progression
+
     @property
     def is_really_sick(self):
         return self.can_get_really_sick and 'severe' in self.symptoms
@@ -388,8 +499,8 @@ class Human(object):
 
     @property
     def symptoms(self):
-        if self.last_date['symptoms'] != self.env.timestamp.date():
-            self.last_date['symptoms'] = self.env.timestamp.date()
+        if self.last_date['symptoms'] != self.env.day_index:
+            self.last_date['symptoms'] = self.env.day_index
             self.update_symptoms()
         return self.all_symptoms
 
@@ -429,7 +540,7 @@ class Human(object):
         if self.allergy_timestamp is not None:
             self.allergy_symptoms = self.allergy_progression[0]
 
-        all_symptoms = set(self.flu_symptoms + self.cold_symptoms + self.allergy_symptoms + self.covid_symptoms)
+        all_symptoms = set().union(self.flu_symptoms, self.cold_symptoms, self.allergy_symptoms, self.covid_symptoms)
         # self.new_symptoms = list(all_symptoms - set(self.all_symptoms))
         self.all_symptoms = list(all_symptoms)
 
@@ -445,10 +556,13 @@ class Human(object):
         self.incubation_days = self.infectiousness_onset_days + self.viral_load_plateau_start + self.rng.normal(loc=SYMPTOM_ONSET_WRT_VIRAL_LOAD_PEAK_AVG, scale=SYMPTOM_ONSET_WRT_VIRAL_LOAD_PEAK_STD)
         self.recovery_days = self.infectiousness_onset_days + self.viral_load_recovered
 
-        self.covid_progression = _get_covid_progression(self.initial_viral_load, self.viral_load_plateau_start, self.viral_load_plateau_end,
-                                        self.viral_load_recovered, age=self.age, incubation_days=self.incubation_days,
-                                        really_sick=self.can_get_really_sick, extremely_sick=self.can_get_extremely_sick,
-                                        rng=self.rng, preexisting_conditions=self.preexisting_conditions, carefulness=self.carefulness)
+        # schedule the transitions (simpy ticks)
+        ticks_per_day = 24 * 60 / TICK_MINUTE
+        infection_tick = (self.infection_timestamp - self.env.initial_timestamp).total_seconds() / 60 / TICK_MINUTE
+        self.compartment = EXPOSED
+        self.infectious_tick = infection_tick + self.infectiousness_onset_days * ticks_per_day
+        self.incubated_tick = np.inf if self.is_asymptomatic else infection_tick + self.incubation_days * ticks_per_day
+        self._covid_progression = None
 
     def get_tested(self, city, source="illness"):
         if not city.tests_available:
@@ -577,100 +691,19 @@ class Human(object):
             else:
                 intervention.modify_behavior(self)
             self.notified = True
+            self.wake()
 
     def run(self, city):
         """
            1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19 20 21 22 23 24
            State  h h h h h h h h h sh sh h  h  h  ac h  h  h  h  h  h  h  h  h
         """
-        self.household.humans.add(self)
+        self.household.place_human(self)
         while True:
-            hour, day = self.env.hour_of_day(), self.env.day_of_week()
-            if day==0:
-                self.count_exercise=0
-                self.count_shop=0
-
-            if self.last_date['run'] != self.env.timestamp.date():
-                self.last_date['run'] = self.env.timestamp.date()
-                self.update_symptoms()
-                self.update_risk(symptoms=self.symptoms)
-                self.infectiousnesses.appendleft(self.infectiousness)
-                Event.log_daily(self, self.env.timestamp)
-                city.tracker.track_symptoms(self)
-
-                # keep only past N_DAYS contacts
-                if self.tracing:
-                    for type_contacts in ['n_contacts_tested_positive', 'n_contacts_symptoms', \
-                    'n_risk_increased', 'n_risk_decreased', "n_risk_mag_decreased", "n_risk_mag_increased"]:
-                        for order in self.message_info[type_contacts]:
-                            if len(self.message_info[type_contacts][order]) > TRACING_N_DAYS_HISTORY:
-                                self.message_info[type_contacts][order] = self.message_info[type_contacts][order][1:]
-                            self.message_info[type_contacts][order].append(0)
-
-                # if self.tracing and self.message_info['traced']:
-                #     if (self.env.timestamp - self.message_info['receipt']).days >= self.message_info['delay']:
-                #         # print(f"{self.tracing_method}: Traced {self}")
-                #         self.update_risk(value=True)
-
-            # recover from cold/flu/allergies if it's time
-            self.recover_health()
-
-            # track symptoms
-            if self.is_incubated and self.symptom_start_time is None:
-                self.symptom_start_time = self.env.timestamp
-                city.tracker.track_generation_times(self.name) # it doesn't count environmental infection or primary case or asymptomatic/presymptomatic infections; refer the definition
-
-            # log test
-            # TODO: needs better conditions; log test based on some condition on symptoms
-            if self.test_recommended or  \
-                (self.is_incubated and
-                self.test_result != "positive" and
-                self.env.timestamp - self.symptom_start_time >= datetime.timedelta(days=TEST_DAYS)):
-                # make testing a function of age/hospitalization/travel
-                if self.get_tested(city):
-                    Event.log_test(self, self.env.timestamp)
-                    self.test_time = self.env.timestamp
-                    city.tracker.track_tested_results(self, self.test_result, self.test_type)
-                    self.update_risk(test_results=True)
-
-            # recover
-            if self.is_infectious and self.days_since_covid >= self.recovery_days:
-                city.tracker.track_recovery(self.n_infectious_contacts, self.recovery_days)
-                self.infection_timestamp = None # indicates they are no longer infected
-                if self.never_recovers:
-                    self.recovered_timestamp = datetime.datetime.max
-                    self.dead = True
-                else:
-                    if not REINFECTION_POSSIBLE:
-                        self.recovered_timestamp = datetime.datetime.max
-                        self.is_immune = not REINFECTION_POSSIBLE
-                    else:
-                        self.recovered_timestamp = self.env.timestamp
-                        self.test_result, self.test_type = None, None
-                    self.never_recovers = self.rng.random() <= P_NEVER_RECOVERS[min(math.floor(self.age/10),8)]
-                    self.dead = False
-
-                self.update_risk(recovery=True)
-                self.infection_timestamp = None # indicates they are no longer infected
-                self.all_symptoms, self.covid_symptoms = [], []
-                Event.log_recovery(self, self.env.timestamp, self.dead)
-                if self.dead:
-                    yield self.env.timeout(np.inf)
-
-            self.assert_state_changes()
-
-            # Mobility
-            # self.how_am_I_feeling = 1.0 (great) --> rest_at_home = False
-            if not self.rest_at_home:
-                # set it once for the rest of the disease path
-                if self.rng.random() > self.how_am_I_feeling():
-                    self.rest_at_home = True
-
-            # happens when recovered
-            elif self.rest_at_home and self.how_am_I_feeling() == 1.0:
-                self.rest_at_home = False
-
-            # if self.name == "human:69":print(f"{self} rest_at_home: {self.rest_at_home} S:{len(self.symptoms)} flu:{self.has_flu} cold:{self.has_cold}")
+            hour, day = self.env.hour, self.env.weekday
+            self.update_health(city, day)
+            if self.dead:
+                yield self.env.timeout(np.inf)
 
             if self.is_extremely_sick:
                 city.tracker.track_hospitalization(self, "icu")
@@ -680,34 +713,177 @@ class Human(object):
                 city.tracker.track_hospitalization(self)
                 yield self.env.process(self.excursion(city, "hospital"))
 
-            if (not self.env.is_weekend() and
-                hour in self.work_start_hour and
-                not self.rest_at_home):
-                yield self.env.process(self.excursion(city, "work"))
+            type = self.choose_activity(hour, day)
+            if type is not None:
+                yield self.env.process(self.excursion(city, type))
 
-            elif ( hour in self.shopping_hours and
-                   day in self.shopping_days and
-                   self.count_shop<=self.max_shop_per_week and
-                   not self.rest_at_home):
-                self.count_shop+=1
-                yield self.env.process(self.excursion(city, "shopping"))
+            yield self.env.process(self.at_home(city, self.hours_at_home()))
 
+    def _compile_agenda(self):
+        """
+        Sorted hours of the week (weekday * 24 + hour) at which `choose_activity` can send
+        the human to work, shopping or exercise.
+        """
+        hours = set()
+        for day in range(7):
+            if day not in Env.WEEKEND_DAYS:
+                hours.update(day * 24 + int(hour) for hour in self.work_start_hour)
+        hours.update(int(day) * 24 + int(hour) for day in self.shopping_days for hour in self.shopping_hours)
+        hours.update(int(day) * 24 + int(hour) for day in self.exercise_days for hour in self.exercise_hours)
+        return sorted(hours)
+
+    def hours_at_home(self):
+        """
+        Hours `run` can sleep at home: until the next hour of the agenda or the first hour of
+        the next day (daily health update). One hour while the human is infected or has
+        symptoms (hourly health updates), has a test recommended (tried every hour), or can
+        go on leisure (every weekend hour), and with the "hourly" HOUSEHOLD_CONTACTS. A
+        change of the recommendations or of the intervention ends the sleep (`wake`).
+        """
+        if (HOUSEHOLD_CONTACTS == "hourly" or self.infection_timestamp is not None or self.all_symptoms or
+                self.test_recommended):
+            return 1
+
+        # same condition as the leisure of `choose_activity`, inverted there too: only the
+        # humans over `max_misc_per_week` go on leisure
+        if self.env.is_weekend() and self.count_misc > self.max_misc_per_week:
+            return 1
+
+        hour = self.env.hour
+        hour_of_week = self.env.weekday * 24 + hour
+        i = bisect.bisect_right(self.agenda, hour_of_week)
+        if i < len(self.agenda):
+            return min(self.agenda[i] - hour_of_week, 24 - hour)
+        if self.agenda:
+            return min(self.agenda[0] + 7 * 24 - hour_of_week, 24 - hour)
+        return 24 - hour
+
+    def update_health(self, city, day):
+        """
+        Hourly update of the health state (symptoms, tests, recovery) and of the
+        mobility restrictions that follow from it. Sets `self.dead` if the human
+        dies at this hour.
+        """
+        if day==0:
+            self.count_exercise=0
+            self.count_shop=0
+
+        if self.last_date['run'] != self.env.day_index:
+            self.last_date['run'] = self.env.day_index
+            self.update_symptoms()
+            self.update_risk(symptoms=self.symptoms)
+            self.infectiousnesses.appendleft(self.infectiousness)
+            Event.log_daily(self, self.env.timestamp)
+            city.tracker.track_symptoms(self)
+
+            # keep only past N_DAYS contacts
+            if self.tracing:
+                for type_contacts in ['n_contacts_tested_positive', 'n_contacts_symptoms', \
+                'n_risk_increased', 'n_risk_decreased', "n_risk_mag_decreased", "n_risk_mag_increased"]:
+                    for order in self.message_info[type_contacts]:
+                        if len(self.message_info[type_contacts][order]) > TRACING_N_DAYS_HISTORY:
+                            self.message_info[type_contacts][order] = self.message_info[type_contacts][order][1:]
+                        self.message_info[type_contacts][order].append(0)
+
+            # if self.tracing and self.message_info['traced']:
+            #     if (self.env.timestamp - self.message_info['receipt']).days >= self.message_info['delay']:
+            #         # print(f"{self.tracing_method}: Traced {self}")
+            #         self.update_risk(value=True)
+
+        # recover from cold/flu/allergies if it's time
+        self.recover_health()
+
+        # track symptoms
+        if self.is_incubated and self.symptom_start_time is None:
+            self.symptom_start_time = self.env.timestamp
+            city.tracker.track_generation_times(self.name) # it doesn't count environmental infection or primary case or asymptomatic/presymptomatic infections; refer the definition
+
+        # log test
+        # TODO: needs better conditions; log test based on some condition on symptoms
+        if self.test_recommended or  \
+            (self.is_incubated and
+            self.test_result != "positive" and
+            self.env.timestamp - self.symptom_start_time >= datetime.timedelta(days=TEST_DAYS)):
+            # make testing a function of age/hospitalization/travel
+            if self.get_tested(city):
+                Event.log_test(self, self.env.timestamp)
+                self.test_time = self.env.timestamp
+                city.tracker.track_tested_results(self, self.test_result, self.test_type)
+                self.update_risk(test_results=True)
+
+        # recover
+        if self.is_infectious and self.days_since_covid >= self.recovery_days:
+            city.tracker.track_recovery(self.n_infectious_contacts, self.recovery_days)
+            self.infection_timestamp = None # indicates they are no longer infected
+            if self.never_recovers:
+                self.recovered_timestamp = datetime.datetime.max
+                self.dead = True
+            else:
+                if not REINFECTION_POSSIBLE:
+                    self.recovered_timestamp = datetime.datetime.max
+                    self.is_immune = not REINFECTION_POSSIBLE
+                else:
+                    self.recovered_timestamp = self.env.timestamp
+                    self.test_result, self.test_type = None, None
+                self.never_recovers = self.rng.random() <= P_NEVER_RECOVERS[min(math.floor(self.age/10),8)]
+                self.dead = False
+
+            self.compartment = REMOVED if self.recovered_timestamp == datetime.datetime.max else SUSCEPTIBLE
+            self.infectious_tick, self.incubated_tick = np.inf, np.inf
+
+            self.update_risk(recovery=True)
+            self.infection_timestamp = None # indicates they are no longer infected
+            self.all_symptoms, self.covid_symptoms = [], []
+            Event.log_recovery(self, self.env.timestamp, self.dead)
+            if self.dead:
+                return
+
+        self.assert_state_changes()
+
+        # Mobility
+        # self.how_am_I_feeling = 1.0 (great) --> rest_at_home = False
+        if not self.rest_at_home:
+            # set it once for the rest of the disease path
+            if self.rng.random() > self.how_am_I_feeling():
+                self.rest_at_home = True
 
-            elif ( hour in self.exercise_hours and
-                    day in self.exercise_days and
-                    self.count_exercise<=self.max_exercise_per_week and
-                    not self.rest_at_home):
-                self.count_exercise+=1
-                yield  self.env.process(self.excursion(city, "exercise"))
+        # happens when recovered
+        elif self.rest_at_home and self.how_am_I_feeling() == 1.0:
+            self.rest_at_home = False
+
+        # if self.name == "human:69":print(f"{self} rest_at_home: {self.rest_at_home} S:{len(self.symptoms)} flu:{self.has_flu} cold:{self.has_cold}")
+
+    def choose_activity(self, hour, day):
+        """
+        Type of the excursion to go on at this hour, None to stay home.
+        """
+        if (not self.env.is_weekend() and
+            hour in self.work_start_hour and
+            not self.rest_at_home):
+            return "work"
+
+        elif ( hour in self.shopping_hours and
+               day in self.shopping_days and
+               self.count_shop<=self.max_shop_per_week and
+               not self.rest_at_home):
+            self.count_shop+=1
+            return "shopping"
+
+        elif ( hour in self.exercise_hours and
+                day in self.exercise_days and
+                self.count_exercise<=self.max_exercise_per_week and
+                not self.rest_at_home):
+            self.count_exercise+=1
+            return "exercise"
 
-            elif (self.env.is_weekend() and
-                    self.rng.random() < 0.5 and
-                    not self.rest_at_home and
-                    not self.count_misc<=self.max_misc_per_week):
-                self.count_misc+=1
-                yield  self.env.process(self.excursion(city, "leisure"))
+        elif (self.env.is_weekend() and
+                self.rng.random() < 0.5 and
+                not self.rest_at_home and
+                not self.count_misc<=self.max_misc_per_week):
+            self.count_misc+=1
+            return "leisure"
 
-            yield self.env.process(self.at(self.household, city, 60))
+        return None
 
     ############################## MOBILITY ##################################
     @property
@@ -736,18 +912,18 @@ class Human(object):
 
         if type == "shopping":
             grocery_store = self._select_location(location_type="stores", city=city)
-            t = _draw_random_discreet_gaussian(self.avg_shopping_time, self.scale_shopping_time, self.rng)
+            t = self.visit_duration(type)
             with grocery_store.request() as request:
                 yield request
                 yield self.env.process(self.at(grocery_store, city, t))
 
         elif type == "exercise":
             park = self._select_location(location_type="park", city=city)
-            t = _draw_random_discreet_gaussian(self.avg_exercise_time, self.scale_exercise_time, self.rng)
+            t = self.visit_duration(type)
             yield self.env.process(self.at(park, city, t))
 
         elif type == "work":
-            t = _draw_random_discreet_gaussian(self.avg_working_minutes, self.scale_working_minutes, self.rng)
+            t = self.visit_duration(type)
             yield self.env.process(self.at(self.workplace, city, t))
 
         elif type == "hospital":
@@ -756,14 +932,11 @@ class Human(object):
             if hospital is None: # no more hospitals
                 self.dead = True
                 self.recovered_timestamp = datetime.datetime.max
+                self.compartment = REMOVED
                 yield self.env.timeout(np.inf)
 
             self.obs_hospitalized = True
-            if self.infection_timestamp is not None:
-                t = self.recovery_days - (self.env.timestamp - self.infection_timestamp).total_seconds() / 86400 # DAYS
-                t = max(t * 24 * 60,0)
-            else:
-                t = len(self.symptoms)/10 * 60 # FIXME: better model
+            t = self.visit_duration(type)
             yield self.env.process(self.at(hospital, city, t))
 
         elif type == "hospital-icu":
@@ -772,15 +945,11 @@ class Human(object):
             if icu is None:
                 self.dead = True
                 self.recovered_timestamp = datetime.datetime.max
+                self.compartment = REMOVED
                 yield self.env.timeout(np.inf)
 
-            if len(self.preexisting_conditions) < 2:
-                extra_time = self.rng.choice([1, 2, 3], p=[0.5, 0.3, 0.2])
-            else:
-                extra_time = self.rng.choice([1, 2, 3], p=[0.2, 0.3, 0.5]) # DAYS
-            t = self.viral_load_plateau_end - self.viral_load_plateau_start + extra_time
-
-            yield self.env.process(self.at(icu, city, t * 24 * 60))
+            t = self.visit_duration(type)
+            yield self.env.process(self.at(icu, city, t))
 
         elif type == "leisure":
             S = 0
@@ -795,13 +964,83 @@ class Human(object):
                 p_exp = self.rho * S ** (-self.gamma * self.adjust_gamma)
                 with loc.request() as request:
                     yield request
-                    t = _draw_random_discreet_gaussian(self.avg_misc_time, self.scale_misc_time, self.rng)
+                    t = self.visit_duration(type)
                     yield self.env.process(self.at(loc, city, t))
         else:
             raise ValueError(f'Unknown excursion type:{type}')
 
+    def visit_duration(self, type):
+        """
+        Draws the time (minutes) spent at one location of an excursion of type `type`.
+        """
+        if type == "shopping":
+            return _draw_random_discreet_gaussian(self.avg_shopping_time, self.scale_shopping_time, self.rng)
+
+        elif type == "exercise":
+            return _draw_random_discreet_gaussian(self.avg_exercise_time, self.scale_exercise_time, self.rng)
+
+        elif type == "work":
+            return _draw_random_discreet_gaussian(self.avg_working_minutes, self.scale_working_minutes, self.rng)
+
+        elif type == "hospital":
+            if self.infection_timestamp is not None:
+                t = self.recovery_days - (self.env.timestamp - self.infection_timestamp).total_seconds() / 86400 # DAYS
+                return max(t * 24 * 60,0)
+            return len(self.symptoms)/10 * 60 # FIXME: better model
+
+        elif type == "hospital-icu":
+            if len(self.preexisting_conditions) < 2:
+                extra_time = alias_table((1, 2, 3), (0.5, 0.3, 0.2)).draw(self.rng)
+            else:
+                extra_time = alias_table((1, 2, 3), (0.2, 0.3, 0.5)).draw(self.rng) # DAYS
+            t = self.viral_load_plateau_end - self.viral_load_plateau_start + extra_time
+            return t * 24 * 60
+
+        elif type == "leisure":
+            return _draw_random_discreet_gaussian(self.avg_misc_time, self.scale_misc_time, self.rng)
+
+        raise ValueError(f'Unknown excursion type:{type}')
+
     def at(self, location, city, duration):
-        city.tracker.track_trip(from_location=self.location.location_type, to_location=location.location_type, age=self.age, hour=self.env.hour_of_day())
+        self.enter(location, city, duration)
+        yield self.env.timeout(duration / TICK_MINUTE)
+        self.leave(location, city)
+
+    def at_home(self, city, hours):
+        """
+        `hours` at home as one visit, with the contacts (see `_household_encounters`) and the
+        draws of `leave` of each of its hours (what `hours` visits of an hour would have).
+        `wake` ends it at the end of its current hour, with the draws of the hours spent.
+        """
+        self.enter(self.household, city, 60 * hours, rounds=hours)
+        step = 60 / TICK_MINUTE
+        start = self.env.now
+        self._at_home = self.env.active_process
+        try:
+            yield self.env.timeout(hours * step)
+        except simpy.Interrupt:
+            hours = max(math.ceil((self.env.now - start) / step), 1)
+            yield self.env.timeout(start + hours * step - self.env.now)
+        finally:
+            self._at_home = None
+        self.leave(self.household, city, rounds=hours)
+
+    def wake(self):
+        """
+        Ends the stay at home in progress (if any) at the end of the current hour, for `run`
+        to update the health and the activities of the human with its new behavior.
+        """
+        if self._at_home is not None and self._at_home is not self.env.active_process:
+            self._at_home.interrupt()
+            self._at_home = None
+
+    def enter(self, location, city, duration, rounds=1):
+        """
+        Arrival at `location` for `duration` minutes: tracks the trip and evaluates
+        the encounters with the humans already there (over the `rounds` hours of
+        the visit at home if there is more than one).
+        """
+        city.tracker.track_trip(from_location=self.location.location_type, to_location=location.location_type, age=self.age, hour=self.env.hour)
 
         # add the human to the location
         self.location = location
@@ -828,6 +1067,56 @@ class Human(object):
             city.tracker.track_social_mixing(location=location, duration=self.last_duration)
 
         # Report all the encounters (epi transmission)
+        if rounds > 1:
+            self._household_encounters(location, city, area, rounds)
+        elif CONTACT_SAMPLING_MIN_OCCUPANTS is not None and location != self.household and \
+                len(location.humans) > CONTACT_SAMPLING_MIN_OCCUPANTS:
+            self._sampled_encounters(location, city, area)
+        elif ENCOUNTER_ENGINE == "vectorized":
+            self._vectorized_encounters(location, city, area)
+        else:
+            self._sequential_encounters(location, city, area)
+
+    def leave(self, location, city, rounds=1):
+        """
+        Departure from `location`: environmental transmission and the random
+        cold, flu and allergies caught during the visit (or during any of its
+        `rounds` hours).
+        """
+        # environmental transmission
+        p_infection = ENVIRONMENTAL_INFECTION_KNOB * location.contamination_probability * (1-self.mask_efficacy) # &prob_infection
+        p_infection = _p_any(p_infection, rounds)
+        # initial_viral_load += p_infection
+        x_environment = location.contamination_probability > 0 and self.rng.random() < p_infection
+        if x_environment and self.is_susceptible:
+            self.infection_timestamp = self.env.timestamp
+            self.initial_viral_load = self.rng.random()
+            self.compute_covid_properties()
+            Event.log_exposed(self, location,  self.env.timestamp)
+            city.tracker.track_infection('env', from_human=None, to_human=self, location=location, timestamp=self.env.timestamp)
+            city.tracker.track_covid_properties(self)
+            # print(f"{self.name} is infected at {location}")
+
+        # Catch a random cold
+        if self.cold_timestamp is None and self.rng.random() < _p_any(P_COLD, rounds):
+            self.cold_timestamp  = self.env.timestamp
+
+        # Catch a random flu
+        if self.flu_timestamp is None and self.rng.random() < _p_any(P_FLU, rounds):
+            self.flu_timestamp = self.env.timestamp
+
+        # Have random allergy symptoms
+        if self.has_allergies and self.rng.random() < _p_any(P_HAS_ALLERGIES_TODAY, rounds):
+            self.allergy_timestamp = self.env.timestamp
+
+        location.remove_human(self)
+
+    def _sequential_encounters(self, location, city, area):
+        """
+        Evaluates the encounters of this arrival one occupant at a time. Every
+        random number is drawn when it is needed, which reproduces the random
+        stream of the original implementation.
+        """
         for h in location.humans:
             if h == self:
                 continue
@@ -844,132 +1133,303 @@ class Human(object):
             # TODO: Add GPS measurements as conditions; refer JF's docs
             if MIN_MESSAGE_PASSING_DISTANCE < distance <  MAX_MESSAGE_PASSING_DISTANCE:
                 if self.tracing:
-                    self.contact_book.add(human=h, timestamp=self.env.timestamp, self_human=self)
-                    h.contact_book.add(human=self, timestamp=self.env.timestamp, self_human=h)
-                    cur_day = (self.env.timestamp - self.env.initial_timestamp).days
-                    if self.has_app and h.has_app and (cur_day >= INTERVENTION_DAY):
-                        self.contact_book.messages.append(h.cur_message(cur_day))
-                        h.contact_book.messages.append(self.cur_message(cur_day))
-                        self.contact_book.messages_by_day[cur_day].append(h.cur_message(cur_day))
-                        h.contact_book.messages_by_day[cur_day].append(self.cur_message(cur_day))
-
-                        h.contact_book.sent_messages_by_day[cur_day].append(h.cur_message(cur_day))
-                        self.contact_book.sent_messages_by_day[cur_day].append(self.cur_message(cur_day))
-
+                    self._exchange_messages(h)
 
                 # FIXME: ideally encounter should be here. this will generate a lot of encounters
 
             t_overlap = min(self.leaving_time, getattr(h, "leaving_time", 60)) - max(self.start_time, getattr(h, "start_time", 60))
             t_near = self.rng.random() * t_overlap * self.time_encounter_reduction_factor
 
-            city.tracker.track_social_mixing(human1=self, human2=h, duration=t_near, timestamp = self.env.timestamp)
+            city.tracker.track_social_mixing(human1=self, human2=h, duration=t_near)
             contact_condition = distance <= INFECTION_RADIUS and t_near > INFECTION_DURATION
 
             # Conditions met for possible infection
-            if contact_condition:
-                proximity_factor = 1
-                if INFECTION_DISTANCE_FACTOR or INFECTION_DURATION_FACTOR:
-                    proximity_factor = INFECTION_DISTANCE_FACTOR * (1 - distance/INFECTION_RADIUS) + INFECTION_DURATION_FACTOR * min((t_near - INFECTION_DURATION)/INFECTION_DURATION, 1)
-                mask_efficacy = (self.mask_efficacy + h.mask_efficacy)*2
-
-                # TODO: merge the two clauses into one (follow cold and flu)
-                infectee = None
-                if self.is_infectious:
-                    ratio = self.asymptomatic_infection_ratio  if self.is_asymptomatic else 1.0
-                    p_infection = self.infectiousness * ratio * proximity_factor
-                    # FIXME: remove hygiene from severity multiplier; init hygiene = 0; use sum here instead
-                    reduction_factor = CONTAGION_KNOB + sum(getattr(x, "_hygiene", 0) for x in [self, h]) + mask_efficacy
-                    p_infection *= np.exp(-reduction_factor * self.n_infectious_contacts)
-
-                    x_human = self.rng.random() < p_infection
-
-                    if x_human and h.is_susceptible:
-                        h.infection_timestamp = self.env.timestamp
-                        h.initial_viral_load = h.rng.random()
-                        h.compute_covid_properties()
-                        infectee = h.name
-
-                        self.n_infectious_contacts+=1
-                        Event.log_exposed(h, self, self.env.timestamp)
-                        h.exposure_message = encode_message(self.cur_message((self.env.timestamp - self.env.initial_timestamp).days))
-                        city.tracker.track_infection('human', from_human=self, to_human=h, location=location, timestamp=self.env.timestamp)
-                        city.tracker.track_covid_properties(h)
-                        # print(f"{self.name} infected {h.name} at {location}")
-
-                elif h.is_infectious:
-                    ratio = h.asymptomatic_infection_ratio  if h.is_asymptomatic else 1.0
-                    p_infection = h.infectiousness * ratio * proximity_factor # &prob_infectious
-                    # FIXME: remove hygiene from severity multiplier; init hygiene = 0; use sum here instead
-                    reduction_factor = CONTAGION_KNOB + sum(getattr(x, "_hygiene", 0) for x in [self, h]) + mask_efficacy
-                    p_infection *= np.exp(-reduction_factor * h.n_infectious_contacts) # hack to control R0
-                    x_human = self.rng.random() < p_infection
-
-                    if x_human and self.is_susceptible:
-                        self.infection_timestamp = self.env.timestamp
-                        self.initial_viral_load = self.rng.random()
-                        self.compute_covid_properties()
-                        infectee = self.name
-
-                        h.n_infectious_contacts+=1
-                        Event.log_exposed(self, h, self.env.timestamp)
-                        city.tracker.track_infection('human', from_human=h, to_human=self, location=location, timestamp=self.env.timestamp)
-                        city.tracker.track_covid_properties(self)
-                        # print(f"{h.name} infected {self.name} at {location}")
-
-                # other transmissions
-                if self.cold_timestamp is not None or h.cold_timestamp is not None:
-                    cold_infector, cold_infectee = h, self
-                    if self.cold_timestamp is not None:
-                        cold_infector, cold_infectee = self, h
-
-                    if self.rng.random() < COLD_CONTAGIOUSNESS:
-                        cold_infectee.cold_timestamp = self.env.timestamp
-
-                if self.flu_timestamp is not None or h.flu_timestamp is not None:
-                    flu_infector, flu_infectee = h, self
-                    if self.cold_timestamp is not None:
-                        flu_infector, flu_infectee = self, h
-
-                    if self.rng.random() < FLU_CONTAGIOUSNESS:
-                        flu_infectee.flu_timestamp = self.env.timestamp
-
-                city.tracker.track_encounter_events(human1=self, human2=h, location=location, distance=distance, duration=t_near)
-                Event.log_encounter(self, h,
-                                    location=location,
-                                    duration=t_near,
-                                    distance=distance,
-                                    infectee=infectee,
-                                    time=self.env.timestamp
-                                    )
-
-        yield self.env.timeout(duration / TICK_MINUTE)
-
-        # environmental transmission
-        p_infection = ENVIRONMENTAL_INFECTION_KNOB * location.contamination_probability * (1-self.mask_efficacy) # &prob_infection
-        # initial_viral_load += p_infection
-        x_environment = location.contamination_probability > 0 and self.rng.random() < p_infection
-        if x_environment and self.is_susceptible:
-            self.infection_timestamp = self.env.timestamp
-            self.initial_viral_load = self.rng.random()
-            self.compute_covid_properties()
-            Event.log_exposed(self, location,  self.env.timestamp)
-            city.tracker.track_infection('env', from_human=None, to_human=self, location=location, timestamp=self.env.timestamp)
-            city.tracker.track_covid_properties(self)
-            # print(f"{self.name} is infected at {location}")
+            if contact_condition and location.carriers:
+                self._encounter(h, location, city, distance, t_near)
+            elif contact_condition:
+                self._record_encounter(h, location, city, distance, t_near)
 
-        # Catch a random cold
-        if self.cold_timestamp is None and self.rng.random() < P_COLD:
-            self.cold_timestamp  = self.env.timestamp
+    def _vectorized_encounters(self, location, city, area, others=None, weight=1, transmit=True):
+        """
+        Evaluates the encounters of this arrival with all the current occupants
+        (or `others`, each of them standing for `weight` occupants) as numpy arrays. The random numbers are drawn in blocks and always in
+        the same order (age mixing, distance, time near, infection) so that a
+        seed still determines the whole simulation. Only the pairs that can
+        have side effects (contact or message passing) are visited in python,
+        and only recorded when no carrier is there (nothing to transmit).
+        Returns the sum over `others` of the probabilities of a covid transmission from
+        `self` (see `_encounter`, with `transmit`).
+        """
+        if others is None:
+            others = [h for h in location.humans if h is not self]
+        if not others:
+            return 0
+
+        n = len(others)
+        ages = np.fromiter((h.age for h in others), dtype=np.int64, count=n)
+
+        # age mixing #FIXME: find a better way
+        # places other than the household, you mix with everyone
+        if location != self.household:
+            mixing = self.rng.random_sample(n) < (0.1 * np.abs(self.age - ages) + 1) ** -1
+            idx = np.flatnonzero(mixing)
+            if idx.size == 0:
+                return 0
+            others = [others[i] for i in idx]
+            ages = ages[idx]
+            n = idx.size
+
+        distance = np.sqrt(int(area/len(self.location.humans))) + \
+                        self.rng.randint(MIN_DIST_ENCOUNTER, MAX_DIST_ENCOUNTER, size=n) + \
+                        self.maintain_extra_distance
+
+        leaving_time = np.fromiter((getattr(h, "leaving_time", 60) for h in others), dtype=np.float64, count=n)
+        start_time = np.fromiter((getattr(h, "start_time", 60) for h in others), dtype=np.float64, count=n)
+        t_overlap = np.minimum(self.leaving_time, leaving_time) - np.maximum(self.start_time, start_time)
+        t_near = self.rng.random_sample(n) * t_overlap * self.time_encounter_reduction_factor
+        p_draws = self.rng.random_sample(n)
+
+        city.tracker.track_social_mixing_pairs(self, ages, t_near, weight=weight)
+
+        # Conditions met for possible infection
+        contact_condition = (distance <= INFECTION_RADIUS) & (t_near > INFECTION_DURATION)
+        transmission = bool(location.carriers)
+        if self.tracing:
+            # risk model
+            # TODO: Add GPS measurements as conditions; refer JF's docs
+            message_passing = (MIN_MESSAGE_PASSING_DISTANCE < distance) & (distance < MAX_MESSAGE_PASSING_DISTANCE)
+            visit = np.flatnonzero(contact_condition | message_passing)
+        else:
+            message_passing = None
+            visit = np.flatnonzero(contact_condition)
+
+        p_total = 0
+        for i in visit:
+            h = others[i]
+            if message_passing is not None and message_passing[i]:
+                self._exchange_messages(h)
+
+            if contact_condition[i] and transmission:
+                p_total += self._encounter(h, location, city, distance[i], float(t_near[i]), p_draw=p_draws[i],
+                                           weight=weight, transmit=transmit)
+            elif contact_condition[i]:
+                self._record_encounter(h, location, city, distance[i], float(t_near[i]), weight=weight)
+        return p_total
+
+    def _sampled_encounters(self, location, city, area):
+        """
+        Evaluates the encounters of this arrival at a large location with a Poisson number
+        (mean CONTACT_SAMPLE_SIZE) of occupants drawn uniformly with replacement. Each of
+        them stands for occupants / CONTACT_SAMPLE_SIZE occupants: its contact has their weight
+        in the tracker and the encounter log, so that the expected contacts are those of
+        meeting every occupant, and its transmission to this human has the probability of
+        any of theirs (a little fewer transmissions than with every occupant when these
+        probabilities are high, as the probability of any is concave in the contacts).
+
+        An infectious human does not infect the sampled occupants: every susceptible occupant
+        is tried, in random order, with the mean probability of a transmission to the sampled
+        ones, lowered after each infection as `_encounter` does with `n_infectious_contacts`.
+        The failures between two infections are a geometric number of occupants, so that
+        only the infections are drawn in python. They are logged as exposures, not in the
+        encounter events.
+        """
+        occupants = location.occupants
+        weight = len(occupants) / CONTACT_SAMPLE_SIZE
+        picks = self.rng.randint(0, len(occupants), size=self.rng.poisson(CONTACT_SAMPLE_SIZE))
+        others = [h for h in map(occupants.__getitem__, picks.tolist()) if h is not self]
+        infectious = self.is_infectious
+        p_total = self._vectorized_encounters(location, city, area, others=others, weight=weight,
+                                              transmit=not infectious)
+        if infectious and others:
+            susceptible = [h for h in occupants if h is not self and h.is_susceptible]
+            p = min(p_total / len(others), 1)
+            decay = np.exp(-np.mean([self._reduction_factor(h) for h in others]))
+            untried = len(susceptible)
+            while p > 0:
+                untried -= self.rng.geometric(p)
+                if untried < 0:
+                    break
+                # the infectee is any of the susceptible occupants not infected yet
+                i = self.rng.randint(len(susceptible))
+                susceptible[i], susceptible[-1] = susceptible[-1], susceptible[i]
+                self._infect(susceptible.pop(), location, city)
+                p *= decay
 
-        # Catch a random flu
-        if self.flu_timestamp is None and self.rng.random() < P_FLU:
-            self.flu_timestamp = self.env.timestamp
+    def _household_encounters(self, household, city, area, hours):
+        """
+        Evaluates the contacts with the other residents at home during the `hours` hours of
+        this stay at once. The contact condition of each hour is drawn as for a visit of 60
+        minutes, with the residents still there at that hour. A resident met in k hours has
+        one encounter, with the probability of a transmission in any of the k hours, and one
+        record of the total time near; a resident near in no hour is not a social mixing
+        contact. The transmissions, encounters and their events are those of the arrival,
+        at the current time and with the infectiousness of that hour: a resident infectious
+        from a later hour of the stay only transmits at the next stay.
+        """
+        others = [h for h in household.humans if h is not self]
+        if not others:
+            return
 
-        # Have random allergy symptoms
-        if self.has_allergies and self.rng.random() < P_HAS_ALLERGIES_TODAY:
-            self.allergy_timestamp = self.env.timestamp
+        n = len(others)
+        ages = np.fromiter((h.age for h in others), dtype=np.int64, count=n)
+        starts = self.env.now + np.arange(hours) * 60 / TICK_MINUTE
+        leaving_time = np.fromiter((getattr(h, "leaving_time", 60) for h in others), dtype=np.float64, count=n)[:, None]
+        start_time = np.fromiter((getattr(h, "start_time", 60) for h in others), dtype=np.float64, count=n)[:, None]
+        present = leaving_time > starts
+        present[:, 0] = True
+
+        distance = np.sqrt(int(area/len(household.humans))) + \
+                        self.rng.randint(MIN_DIST_ENCOUNTER, MAX_DIST_ENCOUNTER, size=(n, hours)) + \
+                        self.maintain_extra_distance
+        t_overlap = np.maximum(np.minimum(starts + 60, leaving_time) - np.maximum(starts, start_time), 0)
+        t_near = np.where(present, self.rng.random_sample((n, hours)) * t_overlap * self.time_encounter_reduction_factor, 0)
+        p_draws = self.rng.random_sample(n)
+
+        durations = t_near.sum(axis=1)
+        met = durations > 0
+        city.tracker.track_social_mixing_pairs(self, ages[met], durations[met])
+
+        contact = present & (distance <= INFECTION_RADIUS) & (t_near > INFECTION_DURATION)
+        n_contacts = contact.sum(axis=1)
+        transmission = bool(household.carriers)
+        if self.tracing:
+            message_passing = (present & (MIN_MESSAGE_PASSING_DISTANCE < distance) &
+                               (distance < MAX_MESSAGE_PASSING_DISTANCE)).any(axis=1)
+            visit = np.flatnonzero((n_contacts > 0) | message_passing)
+        else:
+            message_passing = None
+            visit = np.flatnonzero(n_contacts)
+
+        for i in visit:
+            h = others[i]
+            if message_passing is not None and message_passing[i]:
+                self._exchange_messages(h)
+
+            if n_contacts[i] and transmission:
+                self._encounter(h, household, city, float(distance[i, contact[i]].mean()),
+                                float(t_near[i, contact[i]].mean()), p_draw=p_draws[i], n_contacts=int(n_contacts[i]))
+            elif n_contacts[i]:
+                self._record_encounter(h, household, city, float(distance[i, contact[i]].mean()),
+                                       float(t_near[i, contact[i]].mean()) * int(n_contacts[i]))
+
+    def _exchange_messages(self, h):
+        self.contact_book.add(human=h, timestamp=self.env.timestamp, self_human=self)
+        h.contact_book.add(human=self, timestamp=self.env.timestamp, self_human=h)
+        cur_day = self.env.day_index
+        if self.has_app and h.has_app and (cur_day >= INTERVENTION_DAY):
+            self.contact_book.messages.append(h.cur_message(cur_day))
+            h.contact_book.messages.append(self.cur_message(cur_day))
+            self.contact_book.messages_by_day[cur_day].append(h.cur_message(cur_day))
+            h.contact_book.messages_by_day[cur_day].append(self.cur_message(cur_day))
+
+            h.contact_book.sent_messages_by_day[cur_day].append(h.cur_message(cur_day))
+            self.contact_book.sent_messages_by_day[cur_day].append(self.cur_message(cur_day))
+
+    def _encounter(self, h, location, city, distance, t_near, p_draw=None, n_contacts=1, weight=1, transmit=True):
+        """
+        Possible transmissions between `self` and `h` once the contact condition is met.
+        `p_draw` is the uniform number used for the covid transmission; it is drawn
+        here when it is not given. With `n_contacts` > 1, the condition was met in as
+        many hours of a stay at home, of mean `distance` and `t_near`: the transmissions
+        have the probability of any of them. A sampled contact standing for `weight`
+        contacts has the probability of any of the `weight` contacts (`weight` need not be
+        an integer). Returns the probability of a covid transmission from `self` to `h` in
+        one contact, which is not drawn without `transmit`.
+        """
+        p_contact = 0
+        proximity_factor = 1
+        if INFECTION_DISTANCE_FACTOR or INFECTION_DURATION_FACTOR:
+            proximity_factor = INFECTION_DISTANCE_FACTOR * (1 - distance/INFECTION_RADIUS) + INFECTION_DURATION_FACTOR * min((t_near - INFECTION_DURATION)/INFECTION_DURATION, 1)
 
-        location.remove_human(self)
+        # TODO: merge the two clauses into one (follow cold and flu)
+        infectee = None
+        if self.is_infectious:
+            ratio = self.asymptomatic_infection_ratio  if self.is_asymptomatic else 1.0
+            p_infection = self.infectiousness * ratio * proximity_factor
+            p_infection *= np.exp(-self._reduction_factor(h) * self.n_infectious_contacts)
+            p_contact = min(p_infection, 1)
+            p_infection = _p_any(p_infection, n_contacts * weight)
+
+            x_human = transmit and (self.rng.random() if p_draw is None else p_draw) < p_infection
+
+            if x_human and h.is_susceptible:
+                self._infect(h, location, city)
+                infectee = h.name
+
+        elif h.is_infectious:
+            ratio = h.asymptomatic_infection_ratio  if h.is_asymptomatic else 1.0
+            p_infection = h.infectiousness * ratio * proximity_factor # &prob_infectious
+            p_infection *= np.exp(-self._reduction_factor(h) * h.n_infectious_contacts) # hack to control R0
+            p_infection = _p_any(p_infection, n_contacts * weight)
+            x_human = (self.rng.random() if p_draw is None else p_draw) < p_infection
+
+            if x_human and self.is_susceptible:
+                self.infection_timestamp = self.env.timestamp
+                self.initial_viral_load = self.rng.random()
+                self.compute_covid_properties()
+                self._mark_carrier()
+                infectee = self.name
+
+                h.n_infectious_contacts+=1
+                Event.log_exposed(self, h, self.env.timestamp)
+                city.tracker.track_infection('human', from_human=h, to_human=self, location=location, timestamp=self.env.timestamp)
+                city.tracker.track_covid_properties(self)
+                # print(f"{h.name} infected {self.name} at {location}")
+
+        # other transmissions
+        if self.cold_timestamp is not None or h.cold_timestamp is not None:
+            cold_infector, cold_infectee = h, self
+            if self.cold_timestamp is not None:
+                cold_infector, cold_infectee = self, h
+
+            if self.rng.random() < _p_any(COLD_CONTAGIOUSNESS, n_contacts * weight):
+                cold_infectee.cold_timestamp = self.env.timestamp
+                cold_infectee._mark_carrier()
+
+        if self.flu_timestamp is not None or h.flu_timestamp is not None:
+            flu_infector, flu_infectee = h, self
+            if self.cold_timestamp is not None:
+                flu_infector, flu_infectee = self, h
+
+            if self.rng.random() < _p_any(FLU_CONTAGIOUSNESS, n_contacts * weight):
+                flu_infectee.flu_timestamp = self.env.timestamp
+                flu_infectee._mark_carrier()
+
+        self._record_encounter(h, location, city, distance, t_near * n_contacts, infectee, weight)
+        return p_contact
+
+    def _reduction_factor(self, h):
+        """ decay rate of the transmissions between `self` and `h` with the infectious contacts of the infector """
+        mask_efficacy = (self.mask_efficacy + h.mask_efficacy)*2
+        # FIXME: remove hygiene from severity multiplier; init hygiene = 0; use sum here instead
+        return CONTAGION_KNOB + sum(getattr(x, "_hygiene", 0) for x in [self, h]) + mask_efficacy
+
+    def _infect(self, h, location, city):
+        """ covid transmission from `self` to `h` at `location` """
+        h.infection_timestamp = self.env.timestamp
+        h.initial_viral_load = h.rng.random()
+        h.compute_covid_properties()
+        h._mark_carrier()
+
+        self.n_infectious_contacts+=1
+        Event.log_exposed(h, self, self.env.timestamp)
+        h.exposure_message = encode_message(self.cur_message(self.env.day_index))
+        city.tracker.track_infection('human', from_human=self, to_human=h, location=location, timestamp=self.env.timestamp)
+        city.tracker.track_covid_properties(h)
+        # print(f"{self.name} infected {h.name} at {location}")
+
+    def _record_encounter(self, h, location, city, distance, duration, infectee=None, weight=1):
+        """ statistics (of `weight` encounters) and log of an encounter """
+        city.tracker.track_encounter_events(human1=self, human2=h, location=location, distance=distance,
+                                            duration=duration, weight=weight)
+        Event.log_encounter(self, h,
+                            location=location,
+                            duration=duration,
+                            distance=distance,
+                            infectee=infectee,
+                            time=self.env.timestamp,
+                            weight=weight
+                            )
 
     def _select_location(self, location_type, city):
         """
@@ -982,25 +1442,23 @@ class Human(object):
             self.adjust_gamma = 1.0
             pool_pref = self.parks_preferences
             locs = city.parks
-            visited_locs = self.visits.parks
 
         elif location_type == "stores":
             S = self.visits.n_stores
             self.adjust_gamma = 1.0
             pool_pref = self.stores_preferences
             locs = city.stores
-            visited_locs = self.visits.stores
 
         elif location_type == "hospital":
             hospital = None
-            for hospital in sorted(city.hospitals, key=lambda x:compute_distance(self.location, x)):
+            for hospital in city.spatial_index.by_distance('hospital', self.location):
                 if len(hospital.humans) < hospital.capacity:
                     return hospital
             return None
 
         elif location_type == "hospital-icu":
             icu = None
-            for hospital in sorted(city.hospitals, key=lambda x:compute_distance(self.location, x)):
+            for hospital in city.spatial_index.by_distance('hospital', self.location):
                 if len(hospital.icu.humans) < hospital.icu.capacity:
                     return hospital.icu
             return None
@@ -1008,11 +1466,8 @@ class Human(object):
         elif location_type == "miscs":
             S = self.visits.n_miscs
             self.adjust_gamma = 1.0
-            pool_pref = [(compute_distance(self.location, m) + 1e-1) ** -1 for m in city.miscs if
-                         m != self.location]
-            pool_locs = [m for m in city.miscs if m != self.location]
+            pool_pref = city.spatial_index.preferences_from('misc', self.location)
             locs = city.miscs
-            visited_locs = self.visits.miscs
 
         else:
             raise ValueError(f'Unknown location_type:{location_type}')
@@ -1022,28 +1477,31 @@ class Human(object):
         else:
             p_exp = self.rho * S ** (-self.gamma * self.adjust_gamma)
 
+        cdf = None
         if self.rng.random() < p_exp and S != len(locs):
-            # explore
-            cands = [i for i in locs if i not in visited_locs]
-            cands = [(loc, pool_pref[i]) for i, loc in enumerate(cands)]
-        else:
-            # exploit
-            cands = [(i, count) for i, count in visited_locs.items()]
+            # explore the locations not visited yet, by preference
+            cdf = self.visits.explore_cdf(location_type, pool_pref)
+        if cdf is None or cdf[-1] == 0:
+            # exploit, by number of visits
+            cdf = self.visits.exploit_cdf(location_type, len(locs))
 
-        cands, scores = zip(*cands)
-        loc = self.rng.choice(cands, p=_normalize_scores(scores))
-        visited_locs[loc] += 1
-        return loc
+        i = np.searchsorted(cdf, self.rng.random() * cdf[-1], side='right')
+        self.visits.add(location_type, i)
+        return locs[i]
 
     def __getstate__(self):
         # Copy the object's state from self.__dict__ which contains
         # all our instance attributes. Always use the dict.copy()
         # method to avoid modifying the original state.
         state = self.__dict__.copy()
+        del state['population']
+        del state['idx']
+        state.update(self.population.row(self.idx))
         # Remove the unpicklable entries.
         if state.get("env"):
             del state['env']
             del state['_events']
+            del state['_event_times']
             del state['visits']
             del state['household']
             del state['location']
@@ -1078,7 +1536,19 @@ class Human(object):
         return state
 
     def __setstate__(self, state):
+        if 'population' in state:
+            # whole state of a checkpoint (see `checkpoint.Pickler`)
+            self.__dict__.update(state)
+            return
+
         # Restore instance attributes.
+        # The columns are restored in a population of its own
+        columns = self.columns()
+        self.population = Population(datetime.datetime.min, columns, capacity=1)
+        self.idx = self.population.add()
+        for name in columns:
+            if name in state:
+                setattr(self, name, state.pop(name))
         self.__dict__.update(state)
 
 
@@ -1140,7 +1610,7 @@ class Human(object):
     def update_risk_level(self):
         if not self.is_removed and self.tracing_method.risk_model == "transformer":
             assert(self.risk_history is not None)
-            cur_day = (self.env.timestamp - self.env.initial_timestamp).days
+            cur_day = self.env.day_index
             for day in range(cur_day, TRACING_N_DAYS_HISTORY + cur_day -1):
                 old_risk_level_on_day = _proba_to_risk_level(self.prev_risk_history[day-cur_day])
                 new_risk_level_on_day = _proba_to_risk_level(self.risk_history[day-cur_day+1])
@@ -1159,6 +1629,7 @@ class Human(object):
             if new_risk_level != self.risk_level:
                 self.risk_level = new_risk_level
                 self.tracing_method.modify_behavior(self)
+                self.wake()
         else:
             new_risk_level = _proba_to_risk_level(self.risk)
             if new_risk_level != self.risk_level:
@@ -1168,6 +1639,7 @@ class Human(object):
                 self.risk_level = new_risk_level
 
                 self.tracing_method.modify_behavior(self)
+                self.wake()
 
     def update_risk(self, recovery=False, test_results=False, update_messages=None, symptoms=None):
         if not self.tracing:
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SpatialIndex(object):
+    """
+    Coordinates of the locations of a city by type, for vectorized distance queries.
+    The locations never move, so the answers that only depend on the querying
+    location (hospitals by distance, preferences from a location) are cached by its
+    name, for the `cache_size` locations queried last.
+    """
+
+    def __init__(self, locations, cache_size=4096, chunk_size=1024):
+        self.locations = locations
+        self.coordinates = {type: np.array([(l.lat, l.lon) for l in locs], dtype=np.float64).reshape(-1, 2)
+                            for type, locs in locations.items()}
+        self.cache_size = cache_size
+        # sources per block of the distance computations, which bounds their temporaries
+        self.chunk_size = chunk_size
+        self._by_distance = OrderedDict()
+        self._preferences = OrderedDict()
+
+    def distances(self, type, sources):
+        """ (len(sources), n) matrix of the distances from `sources` to the n locations of `type` """
+        sources = np.array([(s.lat, s.lon) for s in sources], dtype=np.float64).reshape(-1, 2)
+        coordinates = self.coordinates[type]
+        out = np.empty((len(sources), len(coordinates)))
+        for begin in range(0, len(sources), self.chunk_size):
+            delta = sources[begin:begin + self.chunk_size, None, :] - coordinates[None, :, :]
+            out[begin:begin + self.chunk_size] = np.sqrt(delta[:, :, 0] ** 2 + delta[:, :, 1] ** 2)
+        return out
+
+    def preferences(self, type, sources):
+        """ inverse distance preferences of each of `sources` for the locations of `type` """
+        pref = self.distances(type, sources)
+        pref += 1e-1
+        return np.reciprocal(pref, out=pref)
+
+    def by_distance(self, type, source):
+        """ locations of `type` from the closest to the farthest of `source` """
+        key = (type, source.name)
+        locs = self._cached(self._by_distance, key)
+        if locs is None:
+            order = np.argsort(self.distances(type, [source])[0], kind="stable")
+            locs = self._cache(self._by_distance, key, [self.locations[type][i] for i in order])
+        return locs
+
+    def preferences_from(self, type, source):
+        """ preferences of `source` for the locations of `type` (0 for `source` itself) """
+        key = (type, source.name)
+        pref = self._cached(self._preferences, key)
+        if pref is None:
+            pref = self.preferences(type, [source])[0]
+            itself = [l is source for l in self.locations[type]]
+            pref[itself] = 0
+            self._cache(self._preferences, key, pref)
+        return pref
+
+    def _cached(self, cache, key):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def _cache(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return value
@@ -0,0 +1,165 @@
+import heapq
+import math
+import datetime
+import numpy as np
+from collections import deque
+
+from config import TICK_MINUTE, LOCATION_DISTRIBUTION
+from population import REMOVED
+
+
+class SteppedEngine(object):
+    """
+    Time-stepped alternative to running one simpy process per human.
+
+    A single simpy process advances the whole population one hour at a time.
+    At the start of every hour, the humans that are back home update their health
+    and plan the excursions of the hour (same `Human` methods as `Human.run`).
+    The visits of the hour are then played in time order from a heap of departures,
+    so that the encounters, environmental transmission and `Tracker` metrics are
+    computed by `Human.enter` and `Human.leave` exactly as in the simpy engine.
+
+    Differences with the simpy engine:
+        * humans start their excursions at hour boundaries and the last stay at
+        home of an hour lasts until the next boundary.
+        * stores and miscs capacities (`Location.request`) are not enforced.
+    """
+
+    def __init__(self, env, city):
+        self.env = env
+        self.city = city
+        self.humans = city.humans
+        self.step = 60 / TICK_MINUTE
+
+        self.locations = list(city.households)
+        for type in LOCATION_DISTRIBUTION:
+            if type != "household":
+                self.locations.extend(getattr(city, f"{type}s"))
+        self.locations.extend(hospital.icu for hospital in city.hospitals)
+        self.location_idx = {location: i for i, location in enumerate(self.locations)}
+
+        n = len(self.humans)
+        self.alive = np.ones(n, dtype=bool)
+        self.busy_until = np.zeros(n) # simpy ticks
+        self.location = np.array([self.location_idx[h.household] for h in self.humans], dtype=np.int64)
+        self.plans = [deque() for _ in range(n)]
+        self._departures = [] # heap of (tick, seq, human index, location)
+        self._seq = 0
+
+    def run(self):
+        for human in self.humans:
+            human.household.place_human(human)
+
+        # also resumes a checkpoint, at an hour boundary
+        n_steps = round(self.env.now / self.step)
+        while True:
+            self._depart()
+            self._plan_hour()
+
+            n_steps += 1
+            end = n_steps * self.step
+            while self._departures and self._departures[0][0] < end:
+                t = self._departures[0][0]
+                if t > self.env.now:
+                    yield self.env.timeout(t - self.env.now)
+                self._depart()
+
+            yield self.env.timeout(end - self.env.now)
+
+    def _plan_hour(self):
+        hour, day = self.env.hour, self.env.weekday
+        free = np.flatnonzero(self.alive & (self.busy_until <= self.env.now))
+        for i in free:
+            human = self.humans[i]
+            human.update_health(self.city, day)
+            if human.dead:
+                self.alive[i] = False
+                continue
+
+            plan = self.plans[i]
+            if human.is_extremely_sick:
+                self.city.tracker.track_hospitalization(human, "icu")
+                plan.append("hospital-icu")
+
+            elif human.is_really_sick:
+                self.city.tracker.track_hospitalization(human)
+                plan.append("hospital")
+
+            type = human.choose_activity(hour, day)
+            if type == "leisure":
+                plan.append(("leisure", 0, 1.0))
+            elif type is not None:
+                plan.append(type)
+
+            plan.append("home")
+            self._next_visit(i)
+
+    def _depart(self):
+        while self._departures and self._departures[0][0] <= self.env.now:
+            _, _, i, location = heapq.heappop(self._departures)
+            self.humans[i].leave(location, self.city)
+            self._next_visit(i)
+
+    def _next_visit(self, i):
+        plan = self.plans[i]
+        if not plan:
+            return
+
+        visit = self._visit(self.humans[i], plan.popleft(), plan)
+        if visit is None: # no more hospitals
+            self.alive[i] = False
+            plan.clear()
+            return
+
+        location, duration = visit
+        self.humans[i].enter(location, self.city, duration)
+        self.location[i] = self.location_idx[location]
+        self.busy_until[i] = self.env.now + duration / TICK_MINUTE
+        heapq.heappush(self._departures, (self.busy_until[i], self._seq, i, location))
+        self._seq += 1
+
+    def _visit(self, human, stage, plan, now=None):
+        """
+        Location and duration (minutes) of the next visit of `stage` starting at
+        tick `now` (default: the current tick), mirrors `Human.excursion`.
+        """
+        city = self.city
+        now = self.env.now if now is None else now
+        if stage == "home":
+            # stay home for an hour, until the next step
+            next_step = math.ceil((now + 60 / TICK_MINUTE) / self.step) * self.step
+            return human.household, (next_step - now) * TICK_MINUTE
+
+        if isinstance(stage, tuple):
+            type, S, p_exp = stage
+            if human.rng.random() > p_exp:  # return home
+                return human.household, 60
+
+            loc = human._select_location(location_type='miscs', city=city)
+            S += 1
+            plan.appendleft((type, S, human.rho * S ** (-human.gamma * human.adjust_gamma)))
+            return loc, human.visit_duration(type)
+
+        if stage in ["hospital", "hospital-icu"]:
+            loc = human._select_location(location_type=stage, city=city)
+            if loc is None:
+                human.dead = True
+                human.recovered_timestamp = datetime.datetime.max
+                human.compartment = REMOVED
+                return None
+            if stage == "hospital":
+                human.obs_hospitalized = True
+
+        elif stage == "shopping":
+            loc = human._select_location(location_type="stores", city=city)
+
+        elif stage == "exercise":
+            loc = human._select_location(location_type="park", city=city)
+
+        elif stage == "work":
+            loc = human.workplace
+
+        else:
+            raise ValueError(f'Unknown excursion type:{stage}')
+
+        return loc, human.visit_duration(stage)
@@ -0,0 +1,150 @@
+"""
+Batched synthesis of the static attributes of the humans.
+
+`draw_attributes` draws, for a group of humans at once and as numpy arrays, the
+attributes that `Human.__init__` used to draw one scalar at a time: sex, preexisting
+conditions, carefulness, app, allergies, severity flags, habits, shopping/exercise
+days and hours and work start hours. The distributions are the ones of the scalar
+helpers of utils (`_get_random_sex`, `_get_preexisting_conditions`,
+`_get_get_really_sick`, `_draw_random_discreet_gaussian`).
+"""
+import numpy as np
+
+from config import P_CAREFUL_PERSON, P_HAS_APP, P_ALLERGIES, P_TRAVELLED_INTERNATIONALLY_RECENTLY, \
+    BASELINE_P_ASYMPTOMATIC, P_COLD, P_FLU, P_HAS_ALLERGIES_TODAY, P_NEVER_RECOVERS, \
+    AVG_SHOP_TIME_MINUTES, SCALE_SHOP_TIME_MINUTES, AVG_SCALE_SHOP_TIME_MINUTES, SCALE_SCALE_SHOP_TIME_MINUTES, \
+    AVG_EXERCISE_MINUTES, SCALE_EXERCISE_MINUTES, AVG_SCALE_EXERCISE_MINUTES, SCALE_SCALE_EXERCISE_MINUTES, \
+    AVG_WORKING_MINUTES, SCALE_WORKING_MINUTES, AVG_SCALE_WORKING_MINUTES, SCALE_SCALE_WORKING_MINUTES, \
+    AVG_MISC_MINUTES, SCALE_MISC_MINUTES, AVG_SCALE_MISC_MINUTES, SCALE_SCALE_MISC_MINUTES, \
+    AVG_NUM_SHOPPING_DAYS, SCALE_NUM_SHOPPING_DAYS, AVG_NUM_SHOPPING_HOURS, SCALE_NUM_SHOPPING_HOURS, \
+    AVG_NUM_EXERCISE_DAYS, SCALE_NUM_EXERCISE_DAYS, AVG_NUM_EXERCISE_HOURS, SCALE_NUM_EXERCISE_HOURS, \
+    AVG_MAX_NUM_MISC_PER_WEEK, SCALE_MAX_NUM_MISC_PER_WEEK, AVG_MAX_NUM_EXERCISE_PER_WEEK, \
+    SCALE_MAX_NUM_EXERCISE_PER_WEEK, AVG_MAX_NUM_SHOP_PER_WEEK, SCALE_MAX_NUM_SHOP_PER_WEEK
+from utils import PREEXISTING_CONDITIONS, _get_discreet_gaussian_table
+
+SEXES = ['female', 'male', 'other']
+
+# _get_get_really_sick: probability for the ages below each bound (the last one for the ages above)
+REALLY_SICK = {
+    'female': ([10, 20, 40, 50, 60, 70, 80, 90], [0.02, 0.002, 0.05, 0.13, 0.18, 0.16, 0.24, 0.17, 0.03]),
+    'male': ([10, 20, 30, 40, 50, 60, 80, 90], [0.002, 0.02, 0.03, 0.07, 0.13, 0.17, 0.22, 0.15, 0.03]),
+    'other': ([20, 30, 40, 50, 60, 80, 90], [0.02, 0.04, 0.07, 0.13, 0.18, 0.24, 0.18, 0.03]),
+}
+
+# attribute: (avg, scale) of its discrete gaussian
+HABITS = {
+    'avg_shopping_time': (AVG_SHOP_TIME_MINUTES, SCALE_SHOP_TIME_MINUTES),
+    'scale_shopping_time': (AVG_SCALE_SHOP_TIME_MINUTES, SCALE_SCALE_SHOP_TIME_MINUTES),
+    'avg_exercise_time': (AVG_EXERCISE_MINUTES, SCALE_EXERCISE_MINUTES),
+    'scale_exercise_time': (AVG_SCALE_EXERCISE_MINUTES, SCALE_SCALE_EXERCISE_MINUTES),
+    'avg_working_minutes': (AVG_WORKING_MINUTES, SCALE_WORKING_MINUTES),
+    'scale_working_minutes': (AVG_SCALE_WORKING_MINUTES, SCALE_SCALE_WORKING_MINUTES),
+    'avg_misc_time': (AVG_MISC_MINUTES, SCALE_MISC_MINUTES),
+    'scale_misc_time': (AVG_SCALE_MISC_MINUTES, SCALE_SCALE_MISC_MINUTES),
+    'number_of_shopping_days': (AVG_NUM_SHOPPING_DAYS, SCALE_NUM_SHOPPING_DAYS),
+    'number_of_shopping_hours': (AVG_NUM_SHOPPING_HOURS, SCALE_NUM_SHOPPING_HOURS),
+    'number_of_exercise_days': (AVG_NUM_EXERCISE_DAYS, SCALE_NUM_EXERCISE_DAYS),
+    'number_of_exercise_hours': (AVG_NUM_EXERCISE_HOURS, SCALE_NUM_EXERCISE_HOURS),
+    'max_misc_per_week': (AVG_MAX_NUM_MISC_PER_WEEK, SCALE_MAX_NUM_MISC_PER_WEEK),
+    'max_exercise_per_week': (AVG_MAX_NUM_EXERCISE_PER_WEEK, SCALE_MAX_NUM_EXERCISE_PER_WEEK),
+    'max_shop_per_week': (AVG_MAX_NUM_SHOP_PER_WEEK, SCALE_MAX_NUM_SHOP_PER_WEEK),
+}
+
+
+def draw_attributes(rng, ages, professions, infected):
+    """
+    Static attributes of the humans of `ages`, `professions` and initially `infected`
+    (sequences of the same length n), as a dict of lists of length n.
+    """
+    ages = np.asarray(ages)
+    n = len(ages)
+    a = {}
+
+    sex = np.searchsorted([.4, .8], rng.random_sample(n), side='right')
+    a['sex'] = [SEXES[s] for s in sex]
+    a['preexisting_conditions'] = draw_preexisting_conditions(rng, ages, sex)
+
+    careful = rng.random_sample(n) < P_CAREFUL_PERSON
+    carefulness = (np.round(rng.normal(np.where(careful, 55, 25), 10)) + ages / 2) / 100
+    a['carefulness'] = carefulness.tolist()
+    age_modifier = 2
+    has_app = rng.random_sample(n) < (P_HAS_APP / age_modifier) + (carefulness / 2)
+    a['has_app'] = has_app.tolist()
+
+    a['has_allergies'] = (rng.random_sample(n) < P_ALLERGIES).tolist()
+    len_allergies = rng.normal(1 / carefulness, 1)
+    a['len_allergies'] = np.where(len_allergies > 7, 7, np.ceil(len_allergies)).tolist()
+
+    a['has_logged_info'] = (has_app & (rng.random_sample(n) < carefulness)).tolist()
+    # 90% of the time, healthcare workers will declare it
+    a['obs_is_healthcare_worker'] = ((np.asarray(professions) == "healthcare") & (rng.random_sample(n) < 0.9)).tolist()
+    a['travelled_recently'] = (rng.random_sample(n) > P_TRAVELLED_INTERNATIONALLY_RECENTLY).tolist()
+    a['is_asymptomatic'] = (rng.random_sample(n) < BASELINE_P_ASYMPTOMATIC - (ages - 50) * 0.5 / 100).tolist()
+
+    a['has_cold'] = (rng.random_sample(n) < P_COLD).tolist()
+    a['has_flu'] = (rng.random_sample(n) < P_FLU).tolist()
+    a['has_allergy_today'] = (rng.random_sample(n) < P_HAS_ALLERGIES_TODAY).tolist()
+    p_really_sick = np.empty(n)
+    for s, (bounds, p) in enumerate(REALLY_SICK.values()):
+        p_really_sick[sex == s] = np.take(p, np.searchsorted(bounds, ages[sex == s], side='right'))
+    really_sick = rng.random_sample(n) < p_really_sick
+    a['can_get_really_sick'] = really_sick.tolist()
+    # &severe; 30% of severe cases need ICU
+    a['can_get_extremely_sick'] = (really_sick & (rng.random_sample(n) >= 0.7)).tolist()
+    p_never_recovers = np.take(P_NEVER_RECOVERS, np.minimum(np.floor(ages / 10).astype(int), 8))
+    a['never_recovers'] = (rng.random_sample(n) <= p_never_recovers).tolist()
+    a['initial_viral_load'] = np.where(infected, rng.random_sample(n), 0).tolist()
+
+    for name, (avg, scale) in HABITS.items():
+        a[name] = _get_discreet_gaussian_table(avg, scale).sample(rng, n).tolist()
+
+    # multiple shopping and exercise days and hours
+    for name, number, low, high in [('shopping_days', 'number_of_shopping_days', 0, 7),
+                                    ('shopping_hours', 'number_of_shopping_hours', 7, 20),
+                                    ('exercise_days', 'number_of_exercise_days', 0, 7),
+                                    ('exercise_hours', 'number_of_exercise_hours', 7, 20)]:
+        values = rng.randint(low, high, size=(n, max(a[number], default=0)))
+        a[name] = [row[:k] for row, k in zip(values, a[number])]
+    a['work_start_hour'] = list(rng.randint(7, 17, size=(n, 3)))
+    return a
+
+
+def draw_preexisting_conditions(rng, ages, sex):
+    """ `_get_preexisting_conditions` of each human """
+    n = len(ages)
+    first_letter = np.array([s[0] for s in SEXES])[sex]
+    conditions = [[] for _ in range(n)]
+    n_conditions = np.zeros(n)
+    has = {}
+    # Conditions in PREEXISTING_CONDITIONS are ordered to fulfil dependencies
+    for c_name, c_prob in PREEXISTING_CONDITIONS.items():
+        rand = rng.random_sample(n)
+        modifier = np.ones(n)
+        if c_name == 'heart_disease':
+            modifier = np.where(has['diabetes'] | has['smoker'], 2, 0.5)
+        if c_name in ('cancer', 'COPD'):
+            modifier = np.where(has['smoker'], 1.3, 0.95)
+        if c_name == 'stroke':
+            modifier = n_conditions.copy()
+        if c_name == 'immuno-suppressed':
+            modifier = np.where(has['cancer'], 1.2, 0.98)
+
+        # the first row of c_prob for the age and sex
+        row = np.full(n, -1)
+        for j, p in reversed(list(enumerate(c_prob))):
+            row[(ages < p.age) & ((p.sex == 'a') | (first_letter == p.sex))] = j
+        probability = np.take([p.probability for p in c_prob] + [0], row)
+        has[c_name] = (row >= 0) & (rand < modifier * probability)
+        n_conditions += has[c_name]
+        for i in np.flatnonzero(has[c_name]):
+            conditions[i].append(c_prob[row[i]].name)
+
+    # TODO PUT IN QUICKLY WITHOUT VERIFICATION OF NUMBERS
+    for i in np.flatnonzero(has['asthma'] | has['COPD']):
+        conditions[i].append('lung_disease')
+
+    p_pregnant = rng.normal(27, 5, size=n)
+    pregnant = (first_letter == 'f') & (ages > 18) & (ages < 50) & (rng.random_sample(n) < p_pregnant)
+    for i in np.flatnonzero(pregnant):
+        conditions[i].append('pregnant')
+    return conditions
@@ -0,0 +1,48 @@
+import unittest
+
+import numpy as np
+
+from allocation import HouseholdAllocator, Choice
+
+
+class HouseholdAllocatorTest(unittest.TestCase):
+
+    def test_find(self):
+        """
+            the house found is the first house with vacancies where the average age stays above the minimum
+        """
+        rng = np.random.RandomState(0)
+        allocator = HouseholdAllocator(15, capacity=2)
+        houses = [] # [ages, vacancies] in creation order
+        for _ in range(2000):
+            age = rng.randint(0, 90)
+            expected = None
+            for i, (ages, vacancies) in enumerate(houses):
+                if vacancies > 0 and (age + sum(ages)) / (len(ages) + 1) > 15:
+                    expected = i
+                    break
+
+            self.assertEqual(allocator.find(age), expected)
+            if expected is None:
+                cap = rng.randint(1, 6)
+                houses.append([[age], cap - 1])
+                allocator.add(f"household:{len(houses)}", cap - 1, [age])
+            else:
+                houses[expected][0].append(age)
+                houses[expected][1] -= 1
+                allocator.assign(expected, age)
+            self.assertEqual(len(allocator), sum(vacancies > 0 for _, vacancies in houses))
+
+
+class ChoiceTest(unittest.TestCase):
+
+    def test_same_draws(self):
+        """
+            the values and the state of the rng are the ones of rng.choice
+        """
+        p = [0.30, 0.30, 0.15, 0.15, 0.1]
+        choice = Choice(range(1, 6), p)
+        rng1, rng2 = np.random.RandomState(0), np.random.RandomState(0)
+        self.assertEqual([choice(rng1) for _ in range(1000)],
+                         [rng2.choice(range(1, 6), p=p, size=1).item() for _ in range(1000)])
+        self.assertEqual(rng1.random_sample(), rng2.random_sample())
@@ -0,0 +1,101 @@
+import datetime
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from eventlog import write_chunk, load_events, iter_chunks, EventSink
+
+
+class EventLogTest(unittest.TestCase):
+
+    def setUp(self):
+        t = datetime.datetime(2020, 2, 28, 0, 0)
+        self.events = [
+            {'human_id': 'human:1', 'event_type': 'encounter', 'time': t,
+             'payload': {'observed': {}, 'unobserved': {'duration': 12.5, 'human1': {'age': 40, 'symptoms': ['cough', 'fever'],
+                                                                                      'infection_timestamp': None, 'is_exposed': True}}}},
+            {'human_id': 'human:2', 'event_type': 'test', 'time': t + datetime.timedelta(minutes=2),
+             'payload': {'observed': {'result': 'positive'}, 'unobserved': {'result': None}}},
+            {'human_id': 'human:2', 'event_type': 'encounter', 'time': t + datetime.timedelta(hours=1),
+             'payload': {'observed': {'duration': 3}, 'unobserved': {'duration': 3.0, 'human1': {'age': 12, 'symptoms': [],
+                                                                                                  'infection_timestamp': t, 'is_exposed': False}}}},
+        ]
+
+    def test_round_trip(self):
+        """
+            events read back from the archive are equal to the events written, in the same order
+        """
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, "data.zip")
+            write_chunk(self.events, path)
+            write_chunk(self.events[:1], path)
+            write_chunk([], path)
+
+            self.assertEqual([len(chunk) for chunk in iter_chunks(path)], [3, 1])
+            self.assertEqual(load_events(path), self.events + self.events[:1])
+
+    def test_deterministic(self):
+        """
+            the same events give the same archive
+        """
+        with TemporaryDirectory() as d:
+            paths = [os.path.join(d, "data1.zip"), os.path.join(d, "data2.zip")]
+            for path in paths:
+                write_chunk(self.events, path)
+
+            with open(paths[0], 'rb') as f1, open(paths[1], 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_sink(self):
+        """
+            the sink writes the events older than the watermark, and those older than the retention once its capacity is reached
+        """
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, "data.zip")
+            sink = EventSink(path, capacity=3, retention=datetime.timedelta(minutes=30))
+            for event in self.events:
+                sink.push(event)
+            self.assertEqual(list(sink.buffer), self.events[2:])
+
+            self.assertEqual(sink.flush(self.events[2]['time']), [])
+            self.assertEqual(sink.flush(), self.events[2:])
+            self.assertEqual(len(sink), 0)
+            sink.join()
+
+            self.assertEqual([len(chunk) for chunk in iter_chunks(path)], [2, 1])
+            self.assertEqual(load_events(path), self.events)
+
+    def test_sink_without_dest(self):
+        """
+            without destination, the sink drops the events older than the retention once its capacity is reached
+        """
+        sink = EventSink(capacity=3, retention=datetime.timedelta(minutes=30))
+        for event in self.events:
+            sink.push(event)
+        self.assertEqual(list(sink.buffer), self.events[2:])
+
+    def test_sink_capacity(self):
+        """
+            the sink holds less than `capacity` events, even when they are all within the retention
+        """
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, "data.zip")
+            sink = EventSink(path, capacity=4, retention=datetime.timedelta(days=2))
+            events = [dict(self.events[1], time=self.events[1]['time'] + datetime.timedelta(minutes=i)) for i in range(10)]
+            for event in events:
+                sink.push(event)
+                self.assertLess(len(sink), 4)
+            sink.flush()
+            sink.join()
+            self.assertEqual(load_events(path), events)
+
+    def test_sink_error(self):
+        """
+            an error of the writer is raised by join
+        """
+        with TemporaryDirectory() as d:
+            sink = EventSink(os.path.join(d, "missing", "data.zip"))
+            sink.push(self.events[0])
+            sink.flush()
+            with self.assertRaises(FileNotFoundError):
+                sink.join()
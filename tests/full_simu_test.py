@@ -1,12 +1,24 @@
+import csv
 import datetime
 import hashlib
+import multiprocessing
+import os
 import pickle
 import unittest
 import zipfile
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 
-from run import run_simu
+import numpy as np
+from click.testing import CliRunner
+
+import checkpoint
+from run import run_simu, simu
+from sharded import run_sharded, _run_shards
+from population_cache import cached_city
+from simulator import Human
+from track import DAILY_SERIES
 from base import Event
+from eventlog import load_events
 
 class FullUnitTest(unittest.TestCase):
 
@@ -29,10 +41,7 @@ class FullUnitTest(unittest.TestCase):
             f.seek(0)
 
             # Ensure
-            data = []
-            with zipfile.ZipFile(f"{f.name}.zip", 'r') as zf:
-                for pkl in zf.namelist():
-                    data.extend(pickle.loads(zf.read(pkl)))
+            data = load_events(f"{f.name}.zip")
 
             self.assertTrue(len(data) > 0)
 
@@ -42,6 +51,185 @@ class FullUnitTest(unittest.TestCase):
             self.assertTrue(len({d['human_id'] for d in data}) > n_people / 2)
 
 
+class SteppedEngineTest(unittest.TestCase):
+
+    def test_simu_run(self):
+        """
+            run one simulation with the time-stepped engine and ensure most of the users have activity
+        """
+        with NamedTemporaryFile() as f:
+            n_people = 100
+            monitors, tracker = run_simu(
+                n_people=n_people,
+                init_percent_sick=0.1,
+                start_time=datetime.datetime(2020, 2, 28, 0, 0),
+                simulation_days=10,
+                outfile=f.name,
+                out_chunk_size=500,
+                engine="stepped"
+            )
+            monitors[0].dump()
+            monitors[0].join_iothread()
+            f.seek(0)
+
+            data = load_events(f"{f.name}.zip")
+
+            self.assertTrue(Event.encounter in {d['event_type'] for d in data})
+            self.assertTrue(len({d['human_id'] for d in data if d['event_type'] == Event.encounter}) > n_people / 2)
+            self.assertEqual(tracker.s_per_day[-1] + tracker.e_per_day[-1] + tracker.i_per_day[-1] + tracker.r_per_day[-1], tracker.n_humans)
+
+    def test_same_curves(self):
+        """
+            the daily S/E/I/R of the stepped engine are those of the simpy engine, on average over 4 seeds
+        """
+        n_people = 200
+
+        def curves(engine, seed):
+            _, tracker = run_simu(
+                n_people=n_people,
+                init_percent_sick=0.1,
+                start_time=datetime.datetime(2020, 2, 28, 0, 0),
+                simulation_days=10,
+                outfile=None,
+                seed=seed,
+                engine=engine
+            )
+            return np.array([tracker.s_per_day, tracker.e_per_day, tracker.i_per_day, tracker.r_per_day])
+
+        simpy_curves = np.mean([curves("simpy", seed) for seed in range(4)], axis=0)
+        stepped_curves = np.mean([curves("stepped", seed) for seed in range(4)], axis=0)
+        self.assertGreater(simpy_curves[0, 0] - simpy_curves[0, -1], 0.2 * n_people) # the epidemic spreads
+        np.testing.assert_allclose(stepped_curves, simpy_curves, atol=0.1 * n_people)
+
+
+class ShardedSimuTest(unittest.TestCase):
+
+    def test_simu_run(self):
+        """
+            run one simulation over two shards and ensure the merged counters cover the whole population
+        """
+        n_people = 1000
+        tracker = run_sharded(
+            n_people=n_people,
+            init_percent_sick=0.1,
+            start_time=datetime.datetime(2020, 2, 28, 0, 0),
+            simulation_days=5,
+            n_shards=2
+        )
+
+        self.assertEqual(tracker.n_humans, n_people)
+        self.assertEqual(len(tracker.s_per_day), 6)
+        for s, e, i, r in zip(tracker.s_per_day, tracker.e_per_day, tracker.i_per_day, tracker.r_per_day):
+            self.assertEqual(s + e + i + r, tracker.n_humans)
+
+        # the additive counters are merged too, the others are not available
+        self.assertGreater(tracker.contacts['all_encounters'].sum(), 0)
+        self.assertEqual(tracker.contacts['human_infection'].sum() + tracker.n_env_infection, sum(tracker.cases_per_day))
+        with self.assertRaises(AttributeError):
+            tracker.mobility
+
+    def test_same_series(self):
+        """
+            the workers draw the same values whether they share the city or load it from the cache
+        """
+        n_people, start_time, simulation_days = 400, datetime.datetime(2020, 2, 28, 0, 0), 4
+        shared = run_sharded(n_people=n_people, init_percent_sick=0.1, start_time=start_time,
+                             simulation_days=simulation_days, seed=1, n_shards=2)
+
+        with TemporaryDirectory() as d:
+            city = cached_city(d, n_people, 1, (0, 1000), (0, 1000), start_time, 0.1, Human)
+            loaded = _run_shards(multiprocessing.get_context("fork"), city, n_people, start_time,
+                                 simulation_days, None, None, False, 1, 6688, 2)
+
+        self.assertGreater(shared.cases_per_day[-1] + shared.e_per_day[-1], 0)
+        for name in DAILY_SERIES:
+            self.assertEqual(getattr(shared, name), getattr(loaded, name), name)
+
+
+class EnsembleTest(unittest.TestCase):
+
+    def test_ensemble(self):
+        """
+            run two seeds on two workers and ensure the table holds the daily series of both runs
+        """
+        with TemporaryDirectory() as d:
+            outfile = os.path.join(d, "ensemble.csv")
+            result = CliRunner().invoke(simu, ["ensemble", "--n_people", "100", "--simulation_days", "3",
+                                               "--seeds", "0-1", "--workers", "2", "--outfile", outfile])
+            self.assertEqual(result.exit_code, 0, result.output)
+
+            with open(outfile, newline='') as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(sorted({row['seed'] for row in rows}), ['0', '1'])
+            self.assertEqual(len(rows), 2 * 4)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.kwargs = dict(n_people=100, init_percent_sick=0.1, start_time=datetime.datetime(2020, 2, 28, 0, 0),
+                           seed=0, engine="stepped")
+
+    def test_resume(self):
+        """
+            resume a checkpoint and ensure the simulation continues as if it had not stopped
+        """
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, "prefix.pkl")
+            run_simu(simulation_days=3, save_checkpoint=path, **self.kwargs)
+            _, resumed = run_simu(simulation_days=6, resume=checkpoint.load(path), **self.kwargs)
+        _, tracker = run_simu(simulation_days=6, **self.kwargs)
+
+        for name in ["s_per_day", "e_per_day", "i_per_day", "r_per_day", "cases_per_day"]:
+            self.assertEqual(getattr(resumed, name), getattr(tracker, name))
+
+    def test_branch(self):
+        """
+            branch two variants from one checkpoint and ensure each of them runs with its own settings
+        """
+        def run(prefix, name):
+            import base
+            _, tracker = run_simu(simulation_days=4, resume=prefix, **self.kwargs)
+            with open(os.path.join(d, name), 'w') as f:
+                f.write(f"{base.INTERVENTION_DAY} {len(tracker.s_per_day)}")
+
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, "prefix.pkl")
+            run_simu(simulation_days=2, save_checkpoint=path, **self.kwargs)
+            checkpoint.branch(path, {"a": {"INTERVENTION_DAY": 2}, "b": {"INTERVENTION_DAY": 3}}, run, workers=2)
+            with self.assertRaises(ValueError):
+                checkpoint.branch(path, {"c": {"INTERVENTION_DAY": 1}}, run)
+
+            for name, day in [("a", 2), ("b", 3)]:
+                with open(os.path.join(d, name)) as f:
+                    self.assertEqual(f.read(), f"{day} 5")
+
+    def test_python_version(self):
+        """
+            a checkpoint saved by another version of Python is rejected before its bytecode is read
+        """
+        with TemporaryDirectory() as d:
+            path = os.path.join(d, "prefix.pkl")
+            with open(path, 'wb') as f:
+                pickle.dump(("checkpoint", "3.0.0"), f)
+                f.write(b"bytecode of another version")
+            with self.assertRaises(ValueError):
+                checkpoint.load(path)
+
+    def test_configure(self):
+        """
+            configure sets a setting in config and in the modules that imported it, and only in them
+        """
+        import config, base, spatial
+        checkpoint.configure({"POPULATION_CACHE_DIR": "cache"})
+        try:
+            self.assertEqual((config.POPULATION_CACHE_DIR, base.POPULATION_CACHE_DIR), ("cache", "cache"))
+            self.assertNotIn("POPULATION_CACHE_DIR", vars(spatial))
+        finally:
+            checkpoint.configure({"POPULATION_CACHE_DIR": None})
+        self.assertNotIn("POPULATION_CACHE_DIR", vars(spatial))
+
+
 class SeedUnitTest(unittest.TestCase):
 
     def setUp(self):
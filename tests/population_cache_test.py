@@ -0,0 +1,47 @@
+import datetime
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+import config
+from population_cache import make_city
+from simulator import Human
+
+
+class PopulationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.args = (50, 0, (0, 1000), (0, 1000), datetime.datetime(2020, 2, 28, 0, 0), 0.1, Human)
+        self.cache_dir = config.POPULATION_CACHE_DIR
+
+    def tearDown(self):
+        config.POPULATION_CACHE_DIR = self.cache_dir
+
+    def test_cached_city(self):
+        """
+            a city loaded from the cache is the city synthesized from the same seed
+        """
+        config.POPULATION_CACHE_DIR = None
+        city = make_city(*self.args)
+        with TemporaryDirectory() as d:
+            config.POPULATION_CACHE_DIR = d
+            make_city(*self.args)
+            self.assertEqual(len(os.listdir(d)), 1)
+            cached = make_city(*self.args)
+
+            for name, column in city.population.columns.items():
+                np.testing.assert_array_equal(cached.population.columns[name], column)
+            self.assertEqual([h.name for h in cached.humans], [h.name for h in city.humans])
+            self.assertEqual([h.household.name for h in cached.humans], [h.household.name for h in city.humans])
+            for attr in ["age", "carefulness", "has_app", "infection_timestamp"]:
+                self.assertEqual([getattr(h, attr) for h in cached.humans], [getattr(h, attr) for h in city.humans])
+            for attr in ["work_start_hour", "stores_preferences"]:
+                np.testing.assert_array_equal([getattr(h, attr) for h in cached.humans], [getattr(h, attr) for h in city.humans])
+            self.assertEqual(cached.rng.random(), city.rng.random())
+            self.assertIs(cached.humans[0].env, cached.env)
+
+            # another seed is another city
+            make_city(*self.args[:1], 1, *self.args[2:])
+            self.assertEqual(len(os.listdir(d)), 2)
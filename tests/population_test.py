@@ -0,0 +1,55 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from population import Population, Column, FloatColumn, TimestampColumn, CategoryColumn
+
+
+class Person(object):
+    age = Column(np.int16)
+    sex = CategoryColumn(['female', 'male', 'other'])
+    risk = FloatColumn()
+    infection_timestamp = TimestampColumn()
+
+    def __init__(self, population):
+        self.population = population
+        self.idx = population.add()
+
+
+class PopulationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.start_time = datetime.datetime(2020, 2, 28, 0, 0)
+        columns = {name: c for name, c in vars(Person).items() if isinstance(c, Column)}
+        self.population = Population(self.start_time, columns, capacity=2)
+
+    def test_columns(self):
+        """
+            values written through a human are stored in the columns and read back unchanged
+        """
+        p = Person(self.population)
+        self.assertIsNone(p.risk)
+        self.assertIsNone(p.infection_timestamp)
+
+        p.age, p.sex, p.risk = 42, 'other', 0.25
+        p.infection_timestamp = self.start_time + datetime.timedelta(days=3, minutes=14)
+        self.assertEqual((p.age, p.sex, p.risk), (42, 'other', 0.25))
+        self.assertEqual(p.infection_timestamp, self.start_time + datetime.timedelta(days=3, minutes=14))
+        self.assertEqual(self.population.columns['infection_timestamp'][p.idx], 3 * 24 * 60 + 14)
+
+        p.infection_timestamp = None
+        self.assertIsNone(p.infection_timestamp)
+
+    def test_growth(self):
+        """
+            rows keep their values when the columns are reallocated
+        """
+        people = [Person(self.population) for _ in range(10)]
+        for i, p in enumerate(people[:3]):
+            p.age = i
+        people.extend(Person(self.population) for _ in range(10))
+
+        self.assertEqual(len(self.population), 20)
+        self.assertEqual([p.age for p in people[:3]], [0, 1, 2])
+        self.assertEqual(self.population.row(1)['age'], 1)
@@ -0,0 +1,92 @@
+import pickle
+import unittest
+from collections import Counter
+
+import numpy as np
+
+from sampling import AliasTable, alias_table, BufferedRandomState, RandomStreams
+
+
+class AliasTableTest(unittest.TestCase):
+
+    def test_frequencies(self):
+        """
+            the values are drawn with their probabilities
+        """
+        rng = np.random.RandomState(0)
+        for p in [[0.5, 0.3, 0.2], [0.1, 0, 0.9], [1, 1, 1, 1, 1, 1, 1], [0.125, 1/3, 1, 2, 3]]:
+            table = AliasTable(list(range(len(p))), p)
+            counts = Counter(table.sample(rng, 100000).tolist())
+            for value, expected in enumerate(np.array(p) / np.sum(p)):
+                self.assertAlmostEqual(counts[value] / 100000, expected, delta=0.005)
+
+    def test_sample_is_draw(self):
+        """
+            `sample` draws the values of as many calls to `draw`, from as many uniforms
+        """
+        table = AliasTable(["a", "b", "c", "d"], [0.1, 0.2, 0.3, 0.4])
+        rng1, rng2 = np.random.RandomState(0), np.random.RandomState(0)
+        self.assertEqual(table.sample(rng1, 1000).tolist(), [table.draw(rng2) for _ in range(1000)])
+        self.assertEqual(rng1.random_sample(), rng2.random_sample())
+
+    def test_shared(self):
+        """
+            alias_table builds one table per distribution and checks the probabilities
+        """
+        self.assertIs(alias_table((1, 2, 3), (0.5, 0.3, 0.2)), alias_table((1, 2, 3), (0.5, 0.3, 0.2)))
+        with self.assertRaises(ValueError):
+            AliasTable([1, 2], [0.5, -0.5])
+
+
+class BufferedRandomStateTest(unittest.TestCase):
+
+    def draws(self, rng):
+        return [rng.random(), rng.rand(), rng.normal(2, 3), rng.randint(5), rng.randint(7, 20), rng.uniform(1, 2),
+                rng.random_sample(3).tolist(), rng.normal([0, 10], 1).tolist(), rng.choice(10)]
+
+    def test_reproducible(self):
+        """
+            the same seed and the same calls give the same values, also after a pickle or a reseed
+        """
+        rng = BufferedRandomState(0, block_size=5)
+        expected = [self.draws(rng) for _ in range(20)]
+        rng.seed(0)
+        self.assertEqual([self.draws(rng) for _ in range(20)], expected)
+
+        rng = BufferedRandomState(0, block_size=5)
+        first = [self.draws(rng) for _ in range(7)]
+        rng = pickle.loads(pickle.dumps(rng))
+        self.assertEqual(first + [self.draws(rng) for _ in range(13)], expected)
+
+    def test_distributions(self):
+        """
+            the scalar draws have the distributions of RandomState's
+        """
+        rng = BufferedRandomState(0)
+        uniforms = [rng.uniform(2, 4) for _ in range(50000)]
+        self.assertTrue(all(2 <= u < 4 for u in uniforms))
+        self.assertAlmostEqual(np.mean(uniforms), 3, delta=0.01)
+        normals = [rng.normal(1, 2) for _ in range(50000)]
+        self.assertAlmostEqual(np.mean(normals), 1, delta=0.03)
+        self.assertAlmostEqual(np.std(normals), 2, delta=0.03)
+        counts = Counter(rng.randint(7, 10) for _ in range(30000))
+        self.assertEqual(set(counts), {7, 8, 9})
+        for value in counts:
+            self.assertAlmostEqual(counts[value] / 30000, 1 / 3, delta=0.01)
+
+
+class RandomStreamsTest(unittest.TestCase):
+
+    def test_independent(self):
+        """
+            the values of a stream depend on (seed, purpose, entity) only
+        """
+        streams = RandomStreams(0)
+        first, second = streams("human", 1), streams("human", 2)
+        interleaved = [(first.random(), second.normal(0, 1)) for _ in range(100)]
+        alone = RandomStreams(0)("human", 1)
+        self.assertEqual([alone.random() for _ in range(100)], [x for x, _ in interleaved])
+
+        values = [s.random() for s in [RandomStreams(0)("human", 1), RandomStreams(1)("human", 1),
+                                       RandomStreams(0)("human", 2), RandomStreams(0)("location", 1)]]
+        self.assertEqual(len(set(values)), 4)
@@ -0,0 +1,241 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from checkpoint import configure
+from config import TICK_MINUTE
+from population_cache import make_city
+from simulator import Human
+
+WEEK = 7 * 24
+
+
+class AgendaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.city = make_city(50, 0, (0, 1000), (0, 1000), datetime.datetime(2020, 2, 28, 0, 0), 0, Human)
+        self.env = self.city.env
+
+    def advance(self, hour):
+        if hour > 0:
+            self.env.run(until=hour * 60 / TICK_MINUTE)
+        return self.env.weekday * 24 + self.env.hour
+
+    def test_agenda(self):
+        """
+            the agenda has the hours of the week where choose_activity sends the human out
+        """
+        activities = {h: set() for h in self.city.humans}
+        for hour in range(WEEK):
+            hour_of_week = self.advance(hour)
+            for human in self.city.humans:
+                human.count_shop = human.count_exercise = 0
+                if human.choose_activity(self.env.hour, self.env.weekday) is not None:
+                    activities[human].add(hour_of_week)
+
+        for human, hours in activities.items():
+            self.assertEqual(set(human.agenda), hours)
+
+    def test_hours_at_home(self):
+        """
+            hours_at_home sleeps until the next hour of the agenda or the first hour of the next day
+        """
+        for hour in range(WEEK):
+            hour_of_week = self.advance(hour)
+            for human in self.city.humans:
+                expected = 1
+                while (hour_of_week + expected) % WEEK not in human.agenda and self.env.hour + expected < 24:
+                    expected += 1
+                self.assertEqual(human.hours_at_home(), expected)
+
+    def test_leisure(self):
+        """
+            humans that can go on leisure wake up every weekend hour only
+        """
+        for human in self.city.humans:
+            human.count_misc = human.max_misc_per_week + 1
+        for hour in range(WEEK):
+            hour_of_week = self.advance(hour)
+            for human in self.city.humans:
+                expected = 1
+                while (not self.env.is_weekend() and (hour_of_week + expected) % WEEK not in human.agenda and
+                       self.env.hour + expected < 24):
+                    expected += 1
+                self.assertEqual(human.hours_at_home(), expected)
+
+    def test_test_recommended(self):
+        """
+            humans with a test recommended wake up every hour to try it
+        """
+        for human in self.city.humans:
+            human.test_recommended = True
+        self.assertEqual({human.hours_at_home() for human in self.city.humans}, {1})
+
+    def test_wake(self):
+        """
+            a change of behavior ends the stay at home at the end of its current hour
+        """
+        human = self.city.humans[0]
+        step = 60 / TICK_MINUTE
+        stay = self.env.process(human.at_home(self.city, 10))
+
+        def change():
+            yield self.env.timeout(3.5 * step)
+            human.wake()
+
+        self.env.process(change())
+        self.env.run(until=stay)
+        self.assertEqual(self.env.now, 4 * step)
+        self.assertNotIn(human, human.household.humans)
+
+    def test_hourly_household_contacts(self):
+        """
+            with the "hourly" HOUSEHOLD_CONTACTS, humans go home one hour at a time
+        """
+        configure({"HOUSEHOLD_CONTACTS": "hourly"})
+        try:
+            self.assertEqual({human.hours_at_home() for human in self.city.humans}, {1})
+        finally:
+            configure({"HOUSEHOLD_CONTACTS": "aggregated"})
+
+
+class HouseholdContactsTest(unittest.TestCase):
+
+    def test_one_encounter_per_stay(self):
+        """
+            a stay at home has one encounter with each resident met, over all the hours of the stay
+        """
+        city = make_city(50, 0, (0, 1000), (0, 1000), datetime.datetime(2020, 2, 28, 0, 0), 0, Human)
+        household = next(h for h in city.households if len(h.residents) >= 2)
+        first, second = household.residents[:2]
+        for human in (first, second):
+            human.maintain_extra_distance = -10 ** 6 # always close enough
+
+        records = []
+        city.tracker.track_encounter_events = lambda human1, human2, location, distance, duration, weight=1: \
+            records.append((human1, human2, duration))
+        city.env.process(first.at_home(city, 10))
+        city.env.process(second.at_home(city, 10))
+        city.env.run(until=1)
+
+        self.assertEqual([(human1, human2) for human1, human2, _ in records], [(second, first)])
+        # at most 60 minutes near per hour, more than INFECTION_DURATION in some of them
+        self.assertTrue(15 < records[0][2] <= 10 * 60)
+
+    def test_no_overlap(self):
+        """
+            a resident at home without overlap with the stay is not a social mixing contact
+        """
+        city = make_city(50, 0, (0, 1000), (0, 1000), datetime.datetime(2020, 2, 28, 0, 0), 0, Human)
+        household = next(h for h in city.households if len(h.residents) >= 2)
+        first, second = household.residents[:2]
+
+        def arrive():
+            first.start_time = 10 ** 6
+            yield city.env.process(second.at_home(city, 10))
+
+        city.env.process(first.at_home(city, 10))
+        city.env.process(arrive())
+        n = city.tracker.contacts['duration']['n'].copy()
+        histogram = list(city.tracker.contacts['histogram_duration'])
+        city.env.run(until=1)
+
+        np.testing.assert_array_equal(city.tracker.contacts['duration']['n'], n)
+        self.assertEqual(list(city.tracker.contacts['histogram_duration']), histogram)
+
+
+class CarriersTest(unittest.TestCase):
+
+    def test_carriers(self):
+        """
+            the carriers of a location are among its occupants and include all those that can transmit,
+            the occupants list holds the occupants
+        """
+        city = make_city(100, 0, (0, 1000), (0, 1000), datetime.datetime(2020, 2, 28, 0, 0), 0.2, Human)
+        for human in city.humans:
+            city.env.process(human.run(city=city))
+
+        def check():
+            while True:
+                yield city.env.timeout(60 / TICK_MINUTE)
+                for location in set(city.households) | {human.location for human in city.humans}:
+                    occupants = set(location.humans)
+                    self.assertEqual(len(location.occupants), len(occupants))
+                    self.assertEqual(set(location.occupants), occupants)
+                    self.assertLessEqual(location.carriers, occupants)
+                    self.assertLessEqual({h for h in occupants if h.is_carrier}, location.carriers)
+
+        initial = sum(human.infection_timestamp is not None for human in city.humans)
+        city.env.process(check())
+        city.env.run(until=3 * 24 * 60 / TICK_MINUTE)
+        self.assertGreater(sum(human.infection_timestamp is not None for human in city.humans), initial)
+
+
+class SampledContactsTest(unittest.TestCase):
+
+    def contacts(self, settings, repeats):
+        """ contact matrix of the arrivals of 400 humans at a store, averaged over `repeats` """
+        configure(settings)
+        try:
+            city = make_city(400, 0, (0, 1000), (0, 1000), datetime.datetime(2020, 2, 28, 0, 0), 0, Human)
+            store = city.stores[0]
+            before = city.tracker.contacts['all_encounters'].copy()
+            for _ in range(repeats):
+                for human in city.humans:
+                    human.enter(store, city, 60)
+                for human in city.humans:
+                    store.remove_human(human)
+            return (city.tracker.contacts['all_encounters'] - before) / repeats
+        finally:
+            configure({"CONTACT_SAMPLING_MIN_OCCUPANTS": None})
+
+    def test_contact_matrices(self):
+        """
+            the sampled contacts have the contact matrix of the exact mode (by age groups of 20 years)
+        """
+        exact = self.contacts({"CONTACT_SAMPLING_MIN_OCCUPANTS": None}, 1)
+        sampled = self.contacts({"CONTACT_SAMPLING_MIN_OCCUPANTS": 50}, 3)
+        self.assertAlmostEqual(sampled.sum() / exact.sum(), 1, delta=0.05)
+
+        groups = np.arange(0, 150, 20)
+        exact = np.add.reduceat(np.add.reduceat(exact, groups, axis=0), groups, axis=1)
+        sampled = np.add.reduceat(np.add.reduceat(sampled, groups, axis=0), groups, axis=1)
+        large = exact >= 1000
+        self.assertGreater(large.sum(), 5)
+        np.testing.assert_allclose(sampled[large], exact[large], rtol=0.1)
+
+    def transmissions(self, settings, seeds, init_percent_sick=0.03):
+        """ transmissions of the arrivals of 400 humans, some infected 4 days ago, at a store, summed over `seeds` """
+        configure(settings)
+        try:
+            n = 0
+            for seed in seeds:
+                city = make_city(400, seed, (0, 1000), (0, 1000), datetime.datetime(2020, 2, 28, 0, 0), init_percent_sick, Human)
+                city.env.run(until=4 * 24 * 60 / TICK_MINUTE)
+                before = sum(human.infection_timestamp is not None for human in city.humans)
+                store = city.stores[0]
+                for human in city.humans:
+                    human.enter(store, city, 60)
+                n += sum(human.infection_timestamp is not None for human in city.humans) - before
+            return n
+        finally:
+            configure({"CONTACT_SAMPLING_MIN_OCCUPANTS": None})
+
+    def test_transmissions(self):
+        """
+            the sampled contacts have about the transmissions of the exact mode
+        """
+        exact = self.transmissions({"CONTACT_SAMPLING_MIN_OCCUPANTS": None}, range(4))
+        sampled = self.transmissions({"CONTACT_SAMPLING_MIN_OCCUPANTS": 50}, range(4))
+        self.assertGreater(exact, 50)
+        self.assertAlmostEqual(sampled / exact, 1, delta=0.15)
+
+    def test_transmissions_many_infectious(self):
+        """
+            the infectious arrivals infect about as many of the other occupants in both modes
+        """
+        exact = self.transmissions({"CONTACT_SAMPLING_MIN_OCCUPANTS": None}, range(3), 0.2)
+        sampled = self.transmissions({"CONTACT_SAMPLING_MIN_OCCUPANTS": 50}, range(3), 0.2)
+        self.assertGreater(exact, 500)
+        self.assertAlmostEqual(sampled / exact, 1, delta=0.15)
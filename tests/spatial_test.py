@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+
+from spatial import SpatialIndex
+from utils import compute_distance
+
+
+class Place(object):
+    def __init__(self, name, lat, lon):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.stores = [Place(f"store:{i}", *rng.randint(0, 1000, size=2)) for i in range(20)]
+        self.homes = [Place(f"household:{i}", *rng.randint(0, 1000, size=2)) for i in range(5)]
+        self.index = SpatialIndex({'store': self.stores})
+
+    def test_preferences(self):
+        """
+            vectorized preferences are the inverse distances computed one pair at a time
+        """
+        pref = self.index.preferences('store', self.homes)
+        expected = [[(compute_distance(h, s) + 1e-1) ** -1 for s in self.stores] for h in self.homes]
+        np.testing.assert_array_equal(pref, expected)
+
+        others = self.index.preferences_from('store', self.stores[3])
+        expected = [(compute_distance(self.stores[3], s) + 1e-1) ** -1 if s is not self.stores[3] else 0 for s in self.stores]
+        np.testing.assert_array_equal(others, expected)
+
+    def test_by_distance(self):
+        """
+            locations are sorted by distance like `sorted` with `compute_distance` as key
+        """
+        for h in self.homes:
+            expected = sorted(self.stores, key=lambda s: compute_distance(h, s))
+            self.assertEqual(self.index.by_distance('store', h), expected)
+
+    def test_chunks_and_cache(self):
+        """
+            the distances computed by chunks of sources are the same, and the caches keep the last locations queried
+        """
+        index = SpatialIndex({'store': self.stores}, cache_size=3, chunk_size=2)
+        np.testing.assert_array_equal(index.preferences('store', self.homes), self.index.preferences('store', self.homes))
+
+        for s in self.stores:
+            self.assertEqual(index.by_distance('store', s), self.index.by_distance('store', s))
+            index.preferences_from('store', s)
+        self.assertEqual(list(index._by_distance), [('store', s.name) for s in self.stores[-3:]])
+        self.assertEqual(len(index._preferences), 3)
@@ -0,0 +1,61 @@
+import unittest
+from collections import Counter
+
+import numpy as np
+
+from synthesis import draw_attributes, draw_preexisting_conditions, HABITS, SEXES
+from utils import _get_random_sex, _get_preexisting_conditions, _get_get_really_sick
+
+
+class DrawAttributesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.n = 20000
+        self.rng = np.random.RandomState(0)
+
+    def assertFrequencies(self, batched, scalar):
+        batched, scalar = Counter(batched), Counter(scalar)
+        for value in set(batched) | set(scalar):
+            self.assertAlmostEqual(batched[value] / self.n, scalar[value] / self.n, delta=0.015, msg=value)
+
+    def test_sex(self):
+        """
+            the sexes are drawn like _get_random_sex
+        """
+        attributes = draw_attributes(self.rng, [30] * self.n, ["others"] * self.n, [False] * self.n)
+        self.assertFrequencies(attributes['sex'], [_get_random_sex(self.rng) for _ in range(self.n)])
+
+    def test_preexisting_conditions(self):
+        """
+            the conditions are drawn like _get_preexisting_conditions
+        """
+        for age, sex in [(5, 'male'), (35, 'female'), (75, 'male'), (85, 'other')]:
+            batched = draw_preexisting_conditions(self.rng, np.full(self.n, age), np.full(self.n, SEXES.index(sex)))
+            scalar = [_get_preexisting_conditions(age, sex, self.rng) for _ in range(self.n)]
+            self.assertFrequencies(sum(batched, []), sum(scalar, []))
+
+    def test_really_sick(self):
+        """
+            can_get_really_sick is drawn like _get_get_really_sick
+        """
+        for age in [5, 15, 45, 65, 85, 95]:
+            attributes = draw_attributes(self.rng, [age] * self.n, ["others"] * self.n, [False] * self.n)
+            for sex in SEXES:
+                batched = [r for s, r in zip(attributes['sex'], attributes['can_get_really_sick']) if s == sex]
+                scalar = [_get_get_really_sick(age, sex, self.rng) for _ in range(len(batched))]
+                self.assertAlmostEqual(np.mean(batched), np.mean(scalar), delta=0.02, msg=(age, sex))
+
+    def test_habits(self):
+        """
+            the days and hours of the habits have the drawn number of values, in their ranges
+        """
+        attributes = draw_attributes(self.rng, self.rng.randint(0, 100, 100), ["others"] * 100, [True] * 100)
+        for name in HABITS:
+            self.assertEqual(len(attributes[name]), 100)
+        for i in range(100):
+            self.assertEqual(len(attributes['shopping_days'][i]), attributes['number_of_shopping_days'][i])
+            self.assertEqual(len(attributes['exercise_hours'][i]), attributes['number_of_exercise_hours'][i])
+            self.assertTrue(all(0 <= d < 7 for d in attributes['shopping_days'][i]))
+            self.assertTrue(all(7 <= h < 20 for h in attributes['exercise_hours'][i]))
+            self.assertTrue(all(7 <= h < 17 for h in attributes['work_start_hour'][i]))
+            self.assertTrue(0 <= attributes['initial_viral_load'][i] < 1)
@@ -1,10 +1,11 @@
 import unittest
 
 import numpy as np
+from scipy.stats import truncnorm
 
 from frozen.helper import PREEXISTING_CONDITIONS_META, SYMPTOMS_META
 from utils import _get_covid_progression, _get_cold_progression, _get_flu_progression, \
-    _get_preexisting_conditions, PREEXISTING_CONDITIONS, SYMPTOMS, SYMPTOMS_CONTEXTS
+    _get_preexisting_conditions, PREEXISTING_CONDITIONS, SYMPTOMS, SYMPTOMS_CONTEXTS, TruncatedNormal
 
 
 class Symptoms(unittest.TestCase):
@@ -589,3 +590,15 @@ class PreexistingConditions(unittest.TestCase):
                                        delta=0 if not expected_prob else max(0.015, expected_prob * 0.05),
                                        msg=f"Computation of the preexisting conditions [{c_name}] yielded an "
                                        f"unexpected probability for age {age} and sex {sex}")
+
+
+class TruncatedNormalTest(unittest.TestCase):
+    def test_same_draws(self):
+        """
+            the values and the state of the rng are the ones of scipy's truncnorm
+        """
+        for low, high, mean, std in [(2, 3, 2.5, 0.25), (3., 9., 5.5, 1), (2.5, 10, 6, 1), (0, 1, 2, 0.5)]:
+            rng1, rng2 = np.random.RandomState(0), np.random.RandomState(0)
+            expected = truncnorm((low - mean) / std, (high - mean) / std, loc=mean, scale=std).rvs(1000, random_state=rng2)
+            np.testing.assert_allclose(TruncatedNormal(low, high, mean, std).rvs(rng1, 1000), expected, rtol=1e-9)
+            self.assertEqual(rng1.random_sample(), rng2.random_sample())
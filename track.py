@@ -2,10 +2,46 @@ import pandas as pd
 import numpy as np
 import math
 from collections import defaultdict
-from config import HUMAN_DISTRIBUTION, LOCATION_DISTRIBUTION, INFECTION_RADIUS, INFECTION_DURATION, EFFECTIVE_R_WINDOW
+from config import HUMAN_DISTRIBUTION, LOCATION_DISTRIBUTION, INFECTION_RADIUS, INFECTION_DURATION, EFFECTIVE_R_WINDOW, TICK_MINUTE
 import networkx as nx
 from utils import log
 
+# series of the `Tracker` with one value per day
+DAILY_SERIES = ["s_per_day", "e_per_day", "i_per_day", "r_per_day", "cases_per_day",
+                "cases_positive_per_day", "hospitalization_per_day", "critical_per_day"]
+# counters of the `Tracker` that add up over disjoint sets of humans (see `merge_counters`)
+ADDITIVE_COUNTERS = ["contacts", "infection_graph", "n_contacts", "n_infectious_contacts", "n_env_infection",
+                     "n_recovery", "r_0", "dist_encounters", "time_encounters", "symptoms", "transition_probability"]
+# entries of `Tracker.contacts` that are not additive: averages of the days, reset every day
+DAILY_CONTACTS = ["duration", "n_contacts"]
+
+
+def _plain(value):
+    """ `value` with its (nested) defaultdicts as dicts, which can be pickled """
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    return value
+
+
+def merge_counters(a, b):
+    """
+    Sum of the counters `a` and `b` of two trackers: numbers and arrays are added, lists
+    (histograms) are added bin by bin, sets and graphs are united, dicts are merged by key.
+    """
+    if isinstance(a, dict):
+        merged = dict(a)
+        for k, v in b.items():
+            merged[k] = merge_counters(merged[k], v) if k in merged else v
+        return merged
+    if isinstance(a, list):
+        n = max(len(a), len(b))
+        return [x + y for x, y in zip(a + [0] * (n - len(a)), b + [0] * (n - len(b)))]
+    if isinstance(a, set):
+        return a | b
+    if isinstance(a, nx.Graph):
+        return nx.compose(a, b)
+    return a + b
+
 def get_nested_dict(nesting):
     if nesting == 1:
         return defaultdict(int)
@@ -54,7 +90,7 @@ class Tracker(object):
         self.covid_properties = defaultdict(lambda : [0,0])
 
         # cumulative incidence
-        day = self.env.timestamp.strftime("%d %b")
+        day = self.env.day_index
         self.last_day = {'track_recovery':day, "track_infection":day, 'social_mixing':day}
         self.cumulative_incidence = []
         self.cases_per_day = [0]
@@ -69,10 +105,12 @@ class Tracker(object):
         # demographics
         self.age_bins = sorted(HUMAN_DISTRIBUTION.keys(), key = lambda x:x[0])
         self.n_humans = len(self.city.humans)
+        # population rows of the tracked humans
+        self.rows = np.array([h.idx for h in self.city.humans], dtype=np.int64)
 
         # track encounters
-        self.last_encounter_day = self.env.day_of_week()
-        self.last_encounter_hour = self.env.hour_of_day()
+        self.last_encounter_day = self.env.weekday
+        self.last_encounter_hour = self.env.hour
         self.day_encounters = defaultdict(lambda : [0.,0.,0.])
         self.hour_encounters = defaultdict(lambda : [0.,0.,0.])
         self.daily_age_group_encounters = defaultdict(lambda :[0.,0.,0.])
@@ -98,6 +136,13 @@ class Tracker(object):
         self.risk_values = []
         self.avg_infectiousness_per_day = []
 
+    def counters(self):
+        """ the `ADDITIVE_COUNTERS`, as plain dicts """
+        counters = {name: _plain(getattr(self, name)) for name in ADDITIVE_COUNTERS}
+        for name in DAILY_CONTACTS:
+            counters["contacts"].pop(name)
+        return counters
+
     def summarize_population(self):
         self.n_infected_init = sum([h.is_exposed for h in self.city.humans])
         print(f"initial infection {self.n_infected_init}")
@@ -122,7 +167,7 @@ class Tracker(object):
     def get_R(self):
         # https://web.stanford.edu/~jhj1/teachingdocs/Jones-on-R0.pdf; vlaid over a long time horizon
         # average infectious contacts (transmission) * average number of contacts * average duration of infection
-        time_since_start =  (self.env.timestamp - self.env.initial_timestamp).total_seconds() / 86400 # DAYS
+        time_since_start =  self.env.now * TICK_MINUTE / 1440 # DAYS
         if time_since_start == 0:
             return -1
 
@@ -164,10 +209,12 @@ class Tracker(object):
 
         self.cases_per_day.append(0)
 
-        self.s_per_day.append(sum(h.is_susceptible for h in self.city.humans))
-        self.e_per_day.append(sum(h.is_exposed for h in self.city.humans))
-        self.i_per_day.append(sum(h.is_infectious for h in self.city.humans))
-        self.r_per_day.append(sum(h.is_removed for h in self.city.humans))
+        compartments = self.city.population.compartments(self.env.now)[self.rows]
+        s, e, i, r = np.bincount(compartments, minlength=4).tolist()
+        self.s_per_day.append(s)
+        self.e_per_day.append(e)
+        self.i_per_day.append(i)
+        self.r_per_day.append(r)
         self.ei_per_day.append(self.e_per_day[-1] + self.i_per_day[-1])
 
         # Rt
@@ -360,26 +407,10 @@ class Tracker(object):
                 self.contacts['histogram_duration'].extend([0 for _ in range(bin - x + 1)])
             self.contacts['histogram_duration'][bin] += 1
 
-            timestamp = kwargs.get('timestamp')
-            day = timestamp.strftime("%d %b")
+            day = self.env.day_index
 
             if self.last_day['social_mixing'] != day:
-                # duration
-                n, M = self.contacts['duration']['avg']
-                where = self.contacts['duration']['n'] != 0
-                m = np.divide(self.contacts['duration']['total'], self.contacts['duration']['n'], where=where)
-                self.contacts['duration']['avg'] = (n+1, (n*M + m)/(n+1))
-
-                self.contacts['duration']['total'] = np.zeros((150,150))
-                self.contacts['duration']['n'] = np.zeros((150,150))
-
-                # n_contacts
-                n, M = self.contacts['n_contacts']['avg']
-                m = self.contacts['n_contacts']['total']
-                self.contacts['n_contacts']['avg'] = (n+1, (n*M + m)/(n+1))
-
-                self.contacts['n_contacts']['total'] = np.zeros((150,150))
-                self.last_day['social_mixing'] = day
+                self._close_social_mixing_day(day)
 
             else:
                 human1 = kwargs.get('human1', None)
@@ -400,18 +431,68 @@ class Tracker(object):
                 self.contacts['location_duration'][location.location_type].extend([0 for _ in range(bin - x + 1)])
             self.contacts['location_duration'][location.location_type][bin] += 1
 
-    def track_encounter_events(self, human1, human2, location, distance, duration):
+    def track_social_mixing_pairs(self, human, ages, durations, weight=1):
+        """
+        Same as `track_social_mixing` for all the pairs (`human`, other) of one arrival,
+        where `ages` and `durations` are arrays over the other humans, each pair counting
+        as `weight` pairs.
+        """
+        if len(durations) == 0:
+            return
+
+        bins = np.floor(durations/15).astype(np.int64)
+        x = len(self.contacts['histogram_duration'])
+        max_bin = bins.max()
+        if max_bin >= x:
+            self.contacts['histogram_duration'].extend([0 for _ in range(max_bin - x + 1)])
+        for bin, count in zip(*np.unique(bins, return_counts=True)):
+            self.contacts['histogram_duration'][bin] += count.item() * weight
+
+        day = self.env.day_index
+        if self.last_day['social_mixing'] != day:
+            # the pair that closes the day is not counted
+            self._close_social_mixing_day(day)
+            ages, durations = ages[1:], durations[1:]
+
+        np.add.at(self.contacts['duration']['total'], (human.age, ages), durations * weight)
+        np.add.at(self.contacts['duration']['n'], (human.age, ages), weight)
+
+        np.add.at(self.contacts['duration']['total'], (ages, human.age), durations * weight)
+        np.add.at(self.contacts['duration']['n'], (ages, human.age), weight)
+
+        np.add.at(self.contacts['n_contacts']['total'], (human.age, ages), weight)
+        np.add.at(self.contacts['n_contacts']['total'], (ages, human.age), weight)
+
+    def _close_social_mixing_day(self, day):
+        # duration
+        n, M = self.contacts['duration']['avg']
+        where = self.contacts['duration']['n'] != 0
+        m = np.divide(self.contacts['duration']['total'], self.contacts['duration']['n'], where=where)
+        self.contacts['duration']['avg'] = (n+1, (n*M + m)/(n+1))
+
+        self.contacts['duration']['total'] = np.zeros((150,150))
+        self.contacts['duration']['n'] = np.zeros((150,150))
+
+        # n_contacts
+        n, M = self.contacts['n_contacts']['avg']
+        m = self.contacts['n_contacts']['total']
+        self.contacts['n_contacts']['avg'] = (n+1, (n*M + m)/(n+1))
+
+        self.contacts['n_contacts']['total'] = np.zeros((150,150))
+        self.last_day['social_mixing'] = day
+
+    def track_encounter_events(self, human1, human2, location, distance, duration, weight=1):
         for i, (l,u) in enumerate(self.age_bins):
             if l <= human1.age < u:
                 bin1 = (i,(l,u))
             if l <= human2.age < u:
                 bin2 = (i, (l,u))
 
-        self.contacts["all_encounters"][human1.age, human2.age] += 1
-        self.contacts["all_encounters"][human2.age, human1.age] += 1
-        self.contacts["location_all_encounters"][location.location_type][human1.age, human2.age] += 1
-        self.contacts["location_all_encounters"][location.location_type][human2.age, human1.age] += 1
-        self.n_contacts += 1
+        self.contacts["all_encounters"][human1.age, human2.age] += weight
+        self.contacts["all_encounters"][human2.age, human1.age] += weight
+        self.contacts["location_all_encounters"][location.location_type][human1.age, human2.age] += weight
+        self.contacts["location_all_encounters"][location.location_type][human2.age, human1.age] += weight
+        self.n_contacts += weight
 
         # bins of 50
         dist_bin = math.floor(distance/50) if distance <= INFECTION_RADIUS else math.floor(INFECTION_RADIUS/50)
@@ -419,8 +500,8 @@ class Tracker(object):
         # bins of 15 mins
         time_bin = math.floor(duration/15) if duration <= 60 else 4
 
-        hour = self.env.hour_of_day()
-        day = self.env.day_of_week()
+        hour = self.env.hour
+        day = self.env.weekday
         if self.last_encounter_day != day:
             n, avg, last_day_count = self.day_encounters[self.last_encounter_day]
             self.day_encounters[self.last_encounter_day] = [n+1, (avg * n + last_day_count)/(n + 1), 0]
@@ -437,12 +518,12 @@ class Tracker(object):
             self.hour_encounters[self.last_encounter_hour] = [n+1, (avg * n + last_hour_count)/(n + 1), 0]
             self.last_encounter_hour = hour
 
-        self.day_encounters[self.last_encounter_day][-1] += 1
-        self.hour_encounters[self.last_encounter_hour][-1] += 1
-        self.daily_age_group_encounters[bin1[1]][-1] += 1
-        self.daily_age_group_encounters[bin2[1]][-1] += 1
-        self.dist_encounters[dist_bin] += 1
-        self.time_encounters[time_bin] += 1
+        self.day_encounters[self.last_encounter_day][-1] += weight
+        self.hour_encounters[self.last_encounter_hour][-1] += weight
+        self.daily_age_group_encounters[bin1[1]][-1] += weight
+        self.daily_age_group_encounters[bin2[1]][-1] += weight
+        self.dist_encounters[dist_bin] += weight
+        self.time_encounters[time_bin] += weight
 
     def write_metrics(self, logfile):
         log("######## DEMOGRAPHICS #########", logfile)
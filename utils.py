@@ -1,11 +1,13 @@
 from collections import OrderedDict, namedtuple
 
 import numpy as np
-from scipy.stats import norm, truncnorm, gamma
+from scipy.stats import norm, gamma
+from scipy.special import ndtr, ndtri
 import datetime
 import math
 from config import *
 from functools import lru_cache
+from sampling import AliasTable
 from interventions import *
 
 SymptomProbability = namedtuple('SymptomProbability', ['name', 'id', 'probabilities'])
@@ -442,25 +444,46 @@ def _sample_viral_load_gamma(rng, shape_mean=4.5, shape_std=.15, scale_mean=1.,
     return gamma(shape, scale=scale)
 
 
+class TruncatedNormal(object):
+    """
+    Normal of `mean` and `std` truncated to [`low`, `high`], drawn by inverse cdf from one
+    uniform draw of `rng` per value, like `truncnorm(...).rvs(random_state=rng)` without
+    building the scipy distribution on every draw.
+    """
+
+    def __init__(self, low, high, mean, std):
+        self.mean, self.std = mean, std
+        self.cdf_low = ndtr((low - mean) / std)
+        self.mass = ndtr((high - mean) / std) - self.cdf_low
+
+    def ppf(self, q):
+        return self.mean + self.std * ndtri(self.cdf_low + q * self.mass)
+
+    def rvs(self, rng, size=None):
+        return self.ppf(rng.uniform(size=size))
+
+
+@lru_cache(100)
+def _truncated_normal(low, high, mean, std):
+    return TruncatedNormal(low, high, mean, std)
+
+
 def _sample_viral_load_piecewise(rng, initial_viral_load=0, age=40):
     """ This function samples a piece-wise linear viral load model which increases, plateaus, and drops """
     # https://stackoverflow.com/questions/18441779/how-to-specify-upper-and-lower-limits-when-using-numpy-random-normal
 	# https://www.thelancet.com/journals/laninf/article/PIIS1473-3099(20)30196-1/fulltext
-    plateau_start = truncnorm((PLATEAU_START_CLIP_LOW - PLATEAU_START_MEAN)/PLATEAU_START_STD, (PLATEAU_START_CLIP_HIGH - PLATEAU_START_MEAN) / PLATEAU_START_STD, loc=PLATEAU_START_MEAN, scale=PLATEAU_START_STD).rvs(1, random_state=rng)
-    plateau_end = plateau_start + truncnorm((PLATEAU_DURATION_CLIP_LOW - PLATEAU_DURATION_MEAN)/PLEATEAU_DURATION_STD,
-                                            (PLATEAU_DURATION_CLIP_HIGH - PLATEAU_DURATION_MEAN) / PLEATEAU_DURATION_STD,
-                                            loc=PLATEAU_DURATION_MEAN, scale=PLEATEAU_DURATION_STD).rvs(1, random_state=rng)
+    plateau_start = _truncated_normal(PLATEAU_START_CLIP_LOW, PLATEAU_START_CLIP_HIGH, PLATEAU_START_MEAN, PLATEAU_START_STD).rvs(rng)
+    plateau_end = plateau_start + _truncated_normal(PLATEAU_DURATION_CLIP_LOW, PLATEAU_DURATION_CLIP_HIGH,
+                                                    PLATEAU_DURATION_MEAN, PLEATEAU_DURATION_STD).rvs(rng)
     recovered = plateau_end + ((age/10)-1) # age is a determining factor for the recovery time
     recovered = recovered + initial_viral_load * VIRAL_LOAD_RECOVERY_FACTOR \
-                          + truncnorm((RECOVERY_CLIP_LOW - RECOVERY_MEAN) / RECOVERY_STD,
-                                        (RECOVERY_CLIP_HIGH - RECOVERY_MEAN) / RECOVERY_STD,
-                                        loc=RECOVERY_MEAN, scale=RECOVERY_STD).rvs(1, random_state=rng)
+                          + _truncated_normal(RECOVERY_CLIP_LOW, RECOVERY_CLIP_HIGH, RECOVERY_MEAN, RECOVERY_STD).rvs(rng)
 
     base = age/200 # peak viral load varies linearly with age
     # plateau_mean =  initial_viral_load - (base + MIN_VIRAL_LOAD) / (base + MIN_VIRAL_LOAD, base + MAX_VIRAL_LOAD) # transform initial viral load into a range
     # plateau_height = rng.normal(plateau_mean, 1)
     plateau_height = rng.uniform(base + MIN_VIRAL_LOAD, base + MAX_VIRAL_LOAD)
-    return plateau_height, plateau_start.item(), plateau_end.item(), recovered.item()
+    return plateau_height, float(plateau_start), float(plateau_end), float(recovered)
 
 
 def _normalize_scores(scores):
@@ -1172,8 +1195,7 @@ def _get_random_area(num, total_area, rng):
 
 def _draw_random_discreet_gaussian(avg, scale, rng):
     # https://stackoverflow.com/a/37411711/3413239
-    irange, normal_pdf = _get_integer_pdf(avg, scale, 2)
-    return int(rng.choice(irange, size=1, p=normal_pdf))
+    return _get_discreet_gaussian_table(avg, scale).draw(rng)
 
 def _json_serialize(o):
     if isinstance(o, datetime.datetime):
@@ -1191,6 +1213,12 @@ def _get_integer_pdf(avg, scale, num_sigmas=2):
     return irange, normal_pdf
 
 
+@lru_cache(500)
+def _get_discreet_gaussian_table(avg, scale, num_sigmas=2):
+    irange, normal_pdf = _get_integer_pdf(avg, scale, num_sigmas)
+    return AliasTable(irange.astype(int).tolist(), normal_pdf)
+
+
 def probas_to_risk_mapping(probas,
                            num_bins,
                            lower_cutoff=None,